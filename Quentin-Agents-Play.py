@@ -1,127 +1,87 @@
 ##This class allows you to test the agents among them, and provides a interactive visualization during the game.
 
-import matplotlib.pyplot as plt
-from matplotlib.patches import Circle
-import numpy as np
-from Quentin_DQN import load_model, convert_state, rank_actions
+import argparse
+from Quentin_Inference import load_inference_model, next_move
 from Quentin import QuentinGame
+from Quentin_Render import RENDERERS, make_renderer
 
 
 class Play_Quentin(QuentinGame):
-    def __init__(self, size, agent_black=None, agent_white=None):
+    def __init__(self, size, agent_black=None, agent_white=None, renderer="matplotlib", delay=0.1):
         super().__init__(size)
-        self.agent_black = load_model(model_path=agent_black, state_size=size*size+1, action_size=size*size) if agent_black is not None else None
-        self.agent_white = load_model(model_path=agent_white, state_size=size*size+1, action_size=size*size) if agent_white is not None else None
-        self.fig, self.ax = plt.subplots()
-        plt.ion()
+        # an agent is the path of a saved or exported model (greedy moves, see load_inference_model: with a .npz model
+        # torch is not imported) or a player with a search (e.g.: MCTSPlayer)
+        self.agent_black = load_inference_model(agent_black, state_size=size*size+1, action_size=size*size) if isinstance(agent_black, str) else agent_black
+        self.agent_white = load_inference_model(agent_white, state_size=size*size+1, action_size=size*size) if isinstance(agent_white, str) else agent_white
+        # headless, text or matplotlib, with a pause of delay seconds after each move (see make_renderer)
+        self.renderer = make_renderer(renderer, size, delay)
     
     ##visualize
     def plot_board(self):
-        self.ax.clear()
-        self.ax.set_xticks(np.arange(0, self.size, 1))
-        self.ax.set_yticks(np.arange(0, self.size, 1))
-        self.ax.set_xticklabels([])
-        self.ax.set_yticklabels([])  # Reverse y labels
-        self.ax.grid(which='both', color='black', linestyle='-', linewidth=1)
-        self.ax.set_xlim(-0.5, self.size-0.5)
-        self.ax.set_ylim(-0.5, self.size-0.5)
-        self.ax.set_aspect('equal')
-        self.ax.spines['top'].set_visible(False)
-        self.ax.spines['bottom'].set_visible(False)
-        self.ax.spines['left'].set_visible(False)
-        self.ax.spines['right'].set_visible(False)
+        self.renderer.draw(self, self.winning_path())
 
-        # Add letters (A-M) to the left and right of the board
-        for i in range(self.size):
-            self.ax.text(-1, i, chr(ord('A') + self.size - i - 1), va='center', ha='center')  # Left side
-            self.ax.text(self.size, i, chr(ord('A') + self.size - i - 1), va='center', ha='center')  # Right side
-        # Add numbers (0-12) to the top and bottom of the board
-        for i in range(self.size):
-            self.ax.text(i, self.size, str(i), va='center', ha='center')  # Bottom side
-            self.ax.text(i, -1, str(i), va='center', ha='center')  # Top side
 
-        for idx, value in enumerate(self.board):
-            row, col = divmod(idx, self.size)
-            row = self.size-row-1
-            if value != -1:
-                color = 'black' if value == 0 else 'white'
-                circle = Circle((col, row), 0.4, facecolor=color, edgecolor='black', linewidth=1)
-                self.ax.add_patch(circle)      
-
-        plt.draw()
-        plt.pause(0.1)
-
-
-    def next_move(self, is_black, illegal):        
-        filled_locations = [i for i, x in enumerate(self.board) if x != -1]
-        valid_move = False
-        tmp = None
-
-        if (self.agent_black is not None) == is_black:
-            tmp = self.agent_black
-        if (self.agent_white is not None) == (not is_black):
-            tmp = self.agent_white
-            
-        if tmp is not None:
-            state = convert_state(self.board, self.size, not is_black)
-            ranked_actions, q_values = rank_actions(tmp, state)
-            i = -1
-            while not valid_move:
-                i = i+1
-                next_best = ranked_actions[i]
-                valid_move = next_best not in list(set(filled_locations) | set(illegal)) and 0 <= next_best < len(self.board)
-                if valid_move:
-                    self.board[next_best] = 0 if is_black else 1
-            return next_best
+    def next_move(self, is_black):
+        # best legal move according to the agent of the player: the illegal moves are masked out, so no retries are needed
+        agent = self.agent_black if is_black else self.agent_white
+        if hasattr(agent, "select_move"):
+            return agent.select_move(self.board, is_black)
+        return next_move(self, agent, is_black)
 
 
     def update_board(self, is_black):
-        illegal_moves =  []
-        while True:
-            last_move = self.next_move(is_black, illegal_moves)
-            empty_locations = [i for i, x in enumerate(self.board) if x == -1]
-            region = []
-            territories = []
-            while empty_locations:
-                for loc in empty_locations:
-                    if not region or self.adiacent_location(region, loc):
-                        region.append(loc)
-                if self.candidate_for_territory(region):
-                    self.fill_territory(region, last_move)
-                    territories.extend(region)
-                empty_locations = [x for x in empty_locations if x not in region]
-                region.clear()
-            if not self.legal_move(last_move):
-                self.board[last_move] = -1
-                for idx in territories:
-                    self.board[idx] = -1
-                territories.clear()
-                # print("Illegal move.")
-                illegal_moves.append(last_move)
-            else:
-                break
+        last_move = self.next_move(is_black)
+        if last_move is None:
+            # print("No legal moves.")
+            return False
+        return super().update_board(is_black, last_move)
     
 
     def play(self):
         while True:
             # print(black_string)
-            self.update_board(True)
+            if not self.update_board(True):
+                break
             self.plot_board()
             if self.gameover() != -1:
                 break
             # print(white_string)
-            self.update_board(False)
+            if not self.update_board(False):
+                break
             self.plot_board()
             if self.gameover() != -1:
                 break
 
 
 def main():
+    parser = argparse.ArgumentParser(description="a game between two agents")
+    parser.add_argument("--black", default="../quentin_sz7_ep25__black", help="saved or exported model of the black agent")
+    parser.add_argument("--white", default="../quentin_sz7_ep25__white", help="saved or exported model of the white agent")
+    parser.add_argument("--renderer", choices=RENDERERS, default="matplotlib")
+    parser.add_argument("--delay", type=float, default=0.1, help="pause after each move of the matplotlib renderer (seconds)")
+    parser.add_argument("--record", help="record file to which the game is appended (see Quentin_Records.py)")
+    args = parser.parse_args()
     size = 7
 
-    game = Play_Quentin(size, agent_black="../quentin_sz7_ep25__black", agent_white="../quentin_sz7_ep25__white")
+    game = Play_Quentin(size, agent_black=args.black, agent_white=args.white, renderer=args.renderer, delay=args.delay)
+    # with a search on top of the networks (e.g.: 200 simulations, or 0.5 seconds, per move; the white network
+    # evaluates the positions where white moves):
+    # from Quentin_MCTS import MCTSPlayer
+    # black = MCTSPlayer("../quentin_sz7_ep25__black", "../quentin_sz7_ep25__white", simulations=200, time_budget=0.5)
+    # game = Play_Quentin(size, agent_black=black, agent_white="../quentin_sz7_ep25__white")
+    # or with the moves ranked by a batched inference server (see Quentin_Server.py):
+    # from Quentin_Server import InferenceClient; black = InferenceClient("quentin.sock", "black")
+    writer = None
+    if args.record:
+        from Quentin_Records import RecordWriter
+        writer = RecordWriter(args.record, size)
+        writer.record(game)
     game.plot_board()
     game.play()
+    if writer is not None:
+        writer.end_game(game)
+        writer.close()
+    print({0: "BLACK WON!", 1: "WHITE WON!", -1: "DRAW"}[game.gameover()])
 
 if __name__ == "__main__":
     main()
@@ -2,12 +2,174 @@
 Code for the game: Translation from Java to Python (Powered by ChatGPT)
 """
 
+import random
+import sys
+from collections import OrderedDict
+import numpy as np
+
+
+_ADJACENCY = {}
+
+
+def adjacency_tables(size):
+    """
+    returns the orthogonally adjacent points and the diagonal points of each point of a board with the given side,
+    in the same order used by QuentinGame.neighbours and QuentinGame.diagonals;
+    the tables are built once per size, and shared by all the games of that size
+    """
+    if size not in _ADJACENCY:
+        neighbours = []
+        diagonals = []
+        for idx in range(size * size):
+            row, col = divmod(idx, size)
+            ## below, right, above, left
+            neighbours.append(tuple(i for i, ok in ((idx + size, row < size - 1), (idx + 1, col < size - 1),
+                                                    (idx - size, row > 0), (idx - 1, col > 0)) if ok))
+            ## below-right, below-left, above-left, above-right
+            diagonals.append(tuple(i for i, ok in ((idx + size + 1, row < size - 1 and col < size - 1),
+                                                   (idx + size - 1, row < size - 1 and col > 0),
+                                                   (idx - size - 1, row > 0 and col > 0),
+                                                   (idx - size + 1, row > 0 and col < size - 1)) if ok))
+        _ADJACENCY[size] = (tuple(neighbours), tuple(diagonals))
+    return _ADJACENCY[size]
+
+
+_SYMMETRIES = {}
+
+
+def board_symmetries(size):
+    """
+    returns the symmetries of the board which map the rules into themselves: the names, the permutations of the points
+    (the transformed board is board[perm]) and whether the colors are swapped. The flips and the 180 degrees rotation
+    keep the sides of each player; the transpositions and the 90 degrees rotations exchange the top/bottom and 
+    left/right sides, so they are combined with a swap of the colors. The first one is the identity.
+    Note: the territories are resolved in the order of the points (see _resolve_territories), so a move which fills
+    territories can have a different outcome on a transformed board (see check_symmetry in Quentin_Checks.py)
+    """
+    if size not in _SYMMETRIES:
+        idx = np.arange(size * size).reshape(size, size)
+        transforms = [("identity", idx, False), ("rotate_180", idx[::-1, ::-1], False),
+                      ("flip_rows", idx[::-1, :], False), ("flip_columns", idx[:, ::-1], False),
+                      ("transpose", idx.T, True), ("anti_transpose", idx[::-1, ::-1].T, True),
+                      ("rotate_90", np.rot90(idx), True), ("rotate_270", np.rot90(idx, 3), True)]
+        names = [name for name, _, _ in transforms]
+        perms = np.array([perm.ravel() for _, perm, _ in transforms])
+        swaps = np.array([swap for _, _, swap in transforms])
+        _SYMMETRIES[size] = (names, perms, swaps)
+    return _SYMMETRIES[size]
+
+
+def transform_board(board, perm, swap):
+    """
+    a board (list) transformed by a symmetry (see board_symmetries)
+    """
+    board = [board[i] for i in perm]
+    if swap:
+        board = [1 - x if x != -1 else x for x in board]
+    return board
+
+
+_ZOBRIST = {}
+
+
+def zobrist_keys(size):
+    """
+    returns the random 64-bit keys (black key, white key) of each point of a board with the given side:
+    the hash of a position is the xor of the keys of its stones. The keys are built once per size, with a fixed seed
+    """
+    if size not in _ZOBRIST:
+        rng = random.Random(size)
+        _ZOBRIST[size] = tuple((rng.getrandbits(64), rng.getrandbits(64)) for _ in range(size * size))
+    return _ZOBRIST[size]
+
+
+class TranspositionCache:
+    """
+    bounded LRU cache of the outcomes of the moves, keyed on (position hash, move, is_black): for each move,
+    whether it is legal, the points which become black and white (bit masks of the move and of the territories)
+    and the result of gameover afterwards. It can be shared by many games of the same size (e.g.: QuentinMultiEnv);
+    the least recently used entries are dropped when the (estimated) memory goes over max_bytes
+    """
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    @staticmethod
+    def entry_bytes(key, value):
+        # the tuples, their items and the slot of the ordered dictionary (hash table entry and linked list node)
+        return (sys.getsizeof(key) + sys.getsizeof(value) + sum(sys.getsizeof(x) for x in key + value) + 100)
+
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+
+    def put(self, key, value):
+        if key in self.entries:
+            return
+        self.entries[key] = value
+        self.bytes += self.entry_bytes(key, value)
+        while self.bytes > self.max_bytes and self.entries:
+            self.bytes -= self.entry_bytes(*self.entries.popitem(last=False))
+
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+_MISSING = object()     #previous value of the keys added to a dict (see QuentinGame._rollback)
+
 
 class QuentinGame:
+    """
+    board of a game of Quentin (-1: empty, 0: black, 1: white), with the structures which are kept up to date
+    by the moves (region map, connectivity of the stones, Zobrist hash and legal-action masks).
+    The board list must never be edited in place from outside: the moves (update_board, make_move) and
+    fill_territory write it together with those structures. To set up a position, assign a new list
+    (e.g.: game.board = board[:]), which is detected and rebuilds the structures
+    """
     
-    def __init__(self, size):
+    def __init__(self, size, cache=None):
         self.size = size        #side of the board
         self.board = [-1] * (size * size)       #board initialization
+        self.cache = cache      #TranspositionCache shared with other games (optional)
+        self._zobrist = zobrist_keys(size)
+        self._winner = None     #result of gameover, when it is already known
+        self._neighbours, self._diagonals = adjacency_tables(size)      #shared adjacency tables
+        ## virtual points for the sides of the board, used by the connectivity structure (see gameover)
+        self._top, self._bottom, self._left, self._right = range(size * size, size * size + 4)
+        self._bottom_side = frozenset(range(size * (size - 1), size * size))
+        self._right_side = frozenset(range(size - 1, size * size, size))
+        self._journal = None        #changes of the cached structures, while they can be taken back (see _rollback)
+        self._version = 0       #count of the changes of the board (moves, unmade moves and boards set from outside)
+        self._sync_board()
+        self._mask_version = None       #version of the board of the cached legal-action masks (see legal_actions_mask)
+        self._undo = []     #undo stack of make_move
+        self._rejected = []     #illegal moves of make_move (cleared at every move)
+        self.recorder = None        #RecordWriter which records the moves of the game (see Quentin_Records.py)
+        self.last_added = (0, 0)        #bit masks of the black and white stones placed by the last legal move
 
     def __str__(self):
         rows = "abcdefghijklm"
@@ -30,32 +192,14 @@ class QuentinGame:
         """
         returns the orthogonally adjacent points to the input point
         """
-        mylist = []
-        if idx + self.size < len(self.board) and idx + self.size not in exclude:
-            mylist.append(idx + self.size)
-        if idx + 1 < len(self.board) and idx // self.size == (idx + 1) // self.size and idx + 1 not in exclude:
-            mylist.append(idx + 1)
-        if idx - self.size >= 0 and idx - self.size not in exclude:
-            mylist.append(idx - self.size)
-        if idx - 1 >= 0 and idx // self.size == (idx - 1) // self.size and idx - 1 not in exclude:
-            mylist.append(idx - 1)
-        return mylist
+        return [i for i in self._neighbours[idx] if i not in exclude]
 
 
     def diagonals(self, idx):
         """
         returns the indexes of the diagonal points of the input point
         """
-        mylist = []
-        if idx + self.size + 1 < len(self.board) and (idx + 1) // self.size == idx // self.size:
-            mylist.append(idx + self.size + 1)
-        if idx + self.size - 1 < len(self.board) and (idx - 1) // self.size == idx // self.size and idx != 0:
-            mylist.append(idx + self.size - 1)
-        if idx - self.size - 1 >= 0 and (idx - 1) // self.size == idx // self.size:
-            mylist.append(idx - self.size - 1)
-        if idx - self.size + 1 >= 0 and (idx + 1) // self.size == idx // self.size:
-            mylist.append(idx - self.size + 1)
-        return mylist
+        return list(self._diagonals[idx])
 
 
     def legal_move(self, last_move):
@@ -66,14 +210,14 @@ class QuentinGame:
         like_colored_diags = 0
         like_colored_neighbours = []
         ## check for (and store the locations of) the like-colored neighbours of the last point
-        for i in self.neighbours(last_move, []):
+        for i in self._neighbours[last_move]:
             if self.board[i] == self.board[last_move]:
                 like_colored_neighbours.append(i)
         ## verify if any of the diagonally adjacent points are like-colored and share any of the neighbours from before
-        for i in self.diagonals(last_move):
+        for i in self._diagonals[last_move]:
             if self.board[i] == self.board[last_move]:
                 like_colored_diags = like_colored_diags + 1
-                common_neighbours = list(set(self.neighbours(i, [])) & set(like_colored_neighbours))
+                common_neighbours = list(set(self._neighbours[i]) & set(like_colored_neighbours))
                 # if so, the move is legal!
                 if len(common_neighbours) > 0:
                     return True        
@@ -91,11 +235,11 @@ class QuentinGame:
         ## find the empty neighbours of a starting region
         region_neighbours = set()
         for curr in region:
-            region_neighbours.update(self.neighbours(curr, []))
+            region_neighbours.update(self._neighbours[curr])
             region_neighbours.difference_update([i for i in region_neighbours if self.board[i] != -1])
         
         ## find the neighbours of the point of which you want to verify the adjacency to the region
-        extended_idx_neighbours = set(self.neighbours(idx, []))
+        extended_idx_neighbours = set(self._neighbours[idx])
         extended_idx_neighbours.difference_update([i for i in extended_idx_neighbours if self.board[i] != -1])
         extended_idx_neighbours.add(idx)
         
@@ -107,7 +251,7 @@ class QuentinGame:
         #otherwise, progressively expand the set of neighbours of the point, until...
         while True:
             for x in extended_idx_neighbours:
-                temp_set.update(self.neighbours(x, []))
+                temp_set.update(self._neighbours[x])
                 temp_set.difference_update([i for i in temp_set if self.board[i] != -1])
             # either it doesn't change anymore,
             if extended_idx_neighbours == temp_set:
@@ -124,7 +268,7 @@ class QuentinGame:
         a region is a candidate to become a territory if each of its points has at least two filled neighbours 
         """
         for curr in region:
-            cnt = sum(1 for i in self.neighbours(curr, []) if self.board[i] != -1)
+            cnt = sum(1 for i in self._neighbours[curr] if self.board[i] != -1)
             if cnt < 2:
                 return False
         return True
@@ -138,10 +282,12 @@ class QuentinGame:
         of the filled neighbours (in the event of a tie, the territory gets the color of the player who did not 
         do the last move)
         """
+        if self.board is not self._synced_board:
+            self._sync_board()
         ## determine the set of all the distinct neighbours of a region 
         neighbours_union = set()
         for i in region:
-            neighbours_union.update(self.neighbours(i, []))
+            neighbours_union.update(self._neighbours[i])
         neighbours_union.difference_update(region)
         distinct_neighbours = list(neighbours_union)
         ## evaluate the color to be assigned to the region
@@ -154,84 +300,850 @@ class QuentinGame:
                 cnt_white += 1
         ## assignment
         replacement = 0 if cnt_black > cnt_white else 1
-        for index in region:
-            self.board[index] = replacement
+        added = sum(1 << index for index in region if self.board[index] == -1)
+        black_added, white_added = (added, 0) if replacement == 0 else (0, added)
+        self._apply_stones(black_added, white_added)
+        self._toggle_hash(black_added, white_added)
+        self._winner = None
+        self._version += 1
 
     
 
     def update_board(self, is_black, move, unavail=[]):
         """
-        include the new move and all the related changes in the board (if they are compliant to the rules)
+        include the new move and all the related changes in the board (if they are compliant to the rules);
+        if the game is recorded, the attempt is passed to the recorder
         """
-        empty_locations = [i for i, x in enumerate(self.board) if x == -1]
-        valid_move = move in empty_locations and 0 <= move < len(self.board)
+        legal = self._update_board(is_black, move, unavail)
+        if self.recorder is not None:
+            self.recorder.attempt(self, is_black, move, legal)
+        return legal
+
+
+    def _update_board(self, is_black, move, unavail):
+        valid_move = 0 <= move < len(self.board) and self.board[move] == -1
         ## if the last move corresponds to a location which is already filled or one out of the board, the move is not valid
         if not valid_move:
             unavail.append(move)
             return False
-        
+
+        ## the region map is kept from the previous move, unless the board has been set from outside
+        if self.board is not self._synced_board:
+            self._sync_board()
+        key = None
+        if self.cache is not None:
+            key = (self.hash, move, bool(is_black))
+            entry = self.cache.get(key)
+            if entry is not None:
+                return self._replay_move(entry, move, unavail)
+        ## the changes are journaled, to take back an illegal move (make_move keeps the journal to take back the legal ones)
+        temporary = self._journal is None
+        if temporary:
+            self._journal = []
+        mark = len(self._journal)
+
         ## if the first validity check is passed, the second verification phase can start:
-        self.board[move] = 0 if is_black else 1
-        region = []
-        territories = []
-        ## scan through all the empty locations and detect regions in the board
-        while empty_locations:
-            for loc in empty_locations:
-                if not region or self.adiacent_location(region, loc):
-                    region.append(loc)
-            ## once a certain region has been completely defined (no other locations can be inserted),
-            # verify if the conditions to be considered a territory hold, and if so, fill the region accordingly 
-            if self.candidate_for_territory(region):
-                self.fill_territory(region, move)
-                territories.extend(region)
-
-            ## update the list of empty locations
-            empty_locations = [x for x in empty_locations if x not in region]
-            region.clear()
-        
+        # only the region which contained the move can be split by it
+        split = self._label[move]
+        self._place(move, 0 if is_black else 1)
+        self._drop_region(split)
+        pieces = self._flood_regions([i for i in self._neighbours[move] if self.board[i] == -1])
+        territories = self._resolve_territories(move, pieces)
+
         ## if after filling the territories (if any), the last move is still illegal, remove the last edits to the board
         if not self.legal_move(move):
-            self.board[move] = -1
-            for idx in territories:
-                self.board[idx] = -1
-            territories.clear()
+            self._rollback(mark)
+            if temporary:
+                self._journal = None
+            if key is not None:
+                self.cache.put(key, (False, 0, 0, -1))
+            unavail.append(move)
+            return False
+        ## the new stones are connected only now, since the territories can change the color of the move
+        self._connect(move)
+        for idx in territories:
+            self._connect(idx)
+        if temporary:
+            self._journal = None
+        black_added = white_added = 0
+        for idx in [move] + territories:
+            if self.board[idx] == 0:
+                black_added |= 1 << idx
+            else:
+                white_added |= 1 << idx
+        self._record_move(key, black_added, white_added)
+        return True
+
+
+    def _record_move(self, key, black_added, white_added):
+        """
+        after a legal move: update the hash with the new stones and, if there is a cache, store the move
+        """
+        self._toggle_hash(black_added, white_added)
+        self._winner = None
+        self.last_added = (black_added, white_added)
+        self._version += 1
+        if key is not None:
+            self.cache.put(key, (True, black_added, white_added, self.gameover()))
+
+
+    def make_move(self, is_black, move):
+        """
+        play a move as update_board does, pushing on the undo stack what is needed to take it back (see unmake_move):
+        lookahead and rollouts can explore the positions on a single game, without copying it.
+        Returns False (and pushes nothing) if the move is illegal. The moves are not passed to the recorder;
+        the board must not be set from outside until the moves are taken back.
+        Measured with bench_perft (nodes per second against copying a QuentinBitboard at each move): make/unmake
+        is about 2x faster on QuentinBitboard, but only about 1.0-1.3x on the list backend, whose journal of the
+        region map costs nearly as much as a copy (no gain at size 5, 1.2-1.3x at sizes 7 and 9)
+        """
+        if self.board is not self._synced_board:
+            self._sync_board()
+        state = self._undo_state()
+        if not self._update_board(is_black, move, self._rejected):
+            self._rejected.clear()
+            self._restore_state(state)      # nothing to take back, but the journal is closed if no moves are left
+            return False
+        self._undo.append(state)
+        return True
+
+
+    def unmake_move(self):
+        """
+        take back the last move played with make_move (with its territories), restoring the cached state of the game
+        """
+        self._restore_state(self._undo.pop())
+        self._version += 1
+
+
+    def _undo_state(self):
+        """
+        what make_move pushes on the undo stack: the length of the journal, which records every change of the board,
+        of the region map and of the connectivity of the stones from now on (see _rollback), the hash and the result
+        """
+        if self._journal is None:
+            self._journal = []
+        return len(self._journal), self.hash, self._winner
+
+
+    def _restore_state(self, state):
+        mark, self.hash, self._winner = state
+        self._rollback(mark)
+        if not self._undo:
+            self._journal = None
+
+
+    def _rollback(self, mark):
+        """
+        take back the changes journaled after the first mark ones: each one is a list or a dict, a key and its previous
+        value (_MISSING if the key was added)
+        """
+        journal = self._journal
+        while len(journal) > mark:
+            container, key, value = journal.pop()
+            if value is _MISSING:
+                del container[key]
+            else:
+                container[key] = value
+
+
+    def _drop_region(self, label):
+        """
+        remove a region from the region map; returns its locations
+        """
+        cells = self._regions.pop(label)
+        deficit = self._deficit.pop(label)
+        if self._journal is not None:
+            self._journal.append((self._regions, label, cells))
+            self._journal.append((self._deficit, label, deficit))
+        return cells
+
+
+    def _replay_move(self, entry, move, unavail):
+        """
+        apply a move found in the transposition cache
+        """
+        legal, black_added, white_added, winner = entry
+        if not legal:
             unavail.append(move)
             return False
+        self._apply_stones(black_added, white_added)
+        self._toggle_hash(black_added, white_added)
+        self._winner = winner
+        self.last_added = (black_added, white_added)
+        self._version += 1
+        return True
+
+
+    def _apply_stones(self, black_added, white_added):
+        """
+        fill empty points (bit masks of the new black and white stones), updating the region map and the connectivity:
+        the regions which contained the new stones are relabelled
+        """
+        changed = []
+        for mask, value in ((black_added, 0), (white_added, 1)):
+            while mask:
+                low = mask & -mask
+                changed.append((low.bit_length() - 1, value))
+                mask ^= low
+        labels = {self._label[idx] for idx, _ in changed}
+        for idx, value in changed:
+            self._place(idx, value)
+        for label in labels:
+            cells = self._drop_region(label)
+            self._flood_regions([i for i in cells if self.board[i] == -1])
+        for idx, _ in changed:
+            self._connect(idx)
+
+
+    def _toggle_hash(self, black_added, white_added):
+        for mask, value in ((black_added, 0), (white_added, 1)):
+            while mask:
+                low = mask & -mask
+                self.hash ^= self._zobrist[low.bit_length() - 1][value]
+                mask ^= low
+
+
+    def _sync_hash(self):
+        """
+        Zobrist hash of the position, from scratch
+        """
+        self.hash = 0
+        for idx, value in enumerate(self.board):
+            if value != -1:
+                self.hash ^= self._zobrist[idx][value]
+        self._winner = None
+
+
+    def _sync_board(self):
+        """
+        rebuild the cached structures (region map, connectivity of the stones and hash) from the board.
+        The moves edit the board list in place; a board set from outside (game.board = ...) is another list,
+        so comparing the lists by identity tells when the structures must be rebuilt (a board edited from outside
+        must be set again, e.g.: game.board = board[:])
+        """
+        self._sync_regions()
+        self._sync_paths()
+        self._sync_hash()
+        self._synced_board = self.board
+        self._version += 1
+
+
+    def _sync_regions(self):
+        """
+        rebuild from scratch the region map of the board: the number of filled neighbours of each location,
+        the label of the region each empty location belongs to, the (sorted) locations of each region and,
+        for each region, how many of its locations have less than two filled neighbours
+        """
+        self._filled_cnt = [sum(1 for i in self._neighbours[idx] if self.board[i] != -1) for idx in range(len(self.board))]
+        self._label = [-1] * len(self.board)
+        self._regions = {}
+        self._deficit = {}
+        self._next_label = 0
+        self._flood_regions([i for i, x in enumerate(self.board) if x == -1])
+
+
+    def _flood_regions(self, seeds):
+        """
+        (re)label the empty regions containing the seed locations, and return their labels
+        """
+        journal = self._journal
+        labels = []
+        seen = set()
+        for seed in seeds:
+            if seed in seen:
+                continue
+            seen.add(seed)
+            region = [seed]
+            for curr in region:
+                for i in self._neighbours[curr]:
+                    if self.board[i] == -1 and i not in seen:
+                        seen.add(i)
+                        region.append(i)
+            region.sort()
+            label = self._next_label
+            self._next_label += 1
+            for i in region:
+                if journal is not None:
+                    journal.append((self._label, i, self._label[i]))
+                self._label[i] = label
+            if journal is not None:
+                journal.append((self._regions, label, _MISSING))
+                journal.append((self._deficit, label, _MISSING))
+            self._regions[label] = region
+            self._deficit[label] = sum(1 for i in region if self._filled_cnt[i] < 2)
+            labels.append(label)
+        return labels
+
+
+    def _place(self, idx, value):
+        """
+        write a value in a location of the board, keeping the filled neighbours counts up to date
+        """
+        journal = self._journal
+        if self.board[idx] == -1:
+            if journal is not None:
+                journal.append((self._label, idx, self._label[idx]))
+            self._label[idx] = -1
+            for i in self._neighbours[idx]:
+                if journal is not None:
+                    journal.append((self._filled_cnt, i, self._filled_cnt[i]))
+                self._filled_cnt[i] += 1
+                if self._filled_cnt[i] == 2 and self.board[i] == -1:
+                    label = self._label[i]
+                    if journal is not None:
+                        journal.append((self._deficit, label, self._deficit[label]))
+                    self._deficit[label] -= 1
+        if journal is not None:
+            journal.append((self.board, idx, self.board[idx]))
+        self.board[idx] = value
+
+
+    def _settle(self, region, last_move, territories):
+        """
+        fill a region if it is a candidate for territory (see candidate_for_territory and fill_territory),
+        using the cached filled neighbours counts; return True if the region has been filled
+        """
+        if any(self._filled_cnt[i] < 2 for i in region):
+            return False
+        in_region = set(region)
+        distinct_neighbours = {i for curr in region for i in self._neighbours[curr] if i not in in_region}
+        cnt_black = sum(1 for i in distinct_neighbours if self.board[i] == 0)
+        cnt_white = sum(1 for i in distinct_neighbours if self.board[i] == 1)
+        if cnt_black == cnt_white:
+            if self.board[last_move] == 1:
+                cnt_black += 1
+            else:
+                cnt_white += 1
+        replacement = 0 if cnt_black > cnt_white else 1
+        for index in region:
+            self._place(index, replacement)
+        territories.extend(region)
         return True
 
 
+    def _resolve_territories(self, move, pieces):
+        """
+        detect and fill the territories after a move, from the pieces of the region split by the move.
+        The regions are visited in the same order (by their first location) as in the full scan of the board,
+        where the move itself is scanned as a location of the board: it joins the first region which is adjacent 
+        to it and larger than a single location, together with the locations of the other pieces which come after it.
+        The regions which are not adjacent to the move are only revisited if they are already candidates
+        """
+        territories = []
+        pieces_set = set(pieces)
+        queue = pieces + [label for label, deficit in self._deficit.items() if deficit == 0 and label not in pieces_set]
+        queue.sort(key=lambda label: self._regions[label][0])
+
+        ## regions which come before the move (unless one of them is joined by the move)
+        joined = None
+        pos = 0
+        while pos < len(queue) and self._regions[queue[pos]][0] < move:
+            label = queue[pos]
+            pos += 1
+            if label in pieces_set and len(self._regions[label]) > 1:
+                joined = label
+                break
+            if self._deficit[label] == 0:
+                self._settle(self._regions[label], move, territories)
+                self._drop_region(label)
+
+        ## the region of the move
+        region = [move]
+        if joined is not None:
+            region.extend(self._regions[joined])
+        for label in pieces:
+            if label != joined and label in self._regions:
+                region.extend(i for i in self._regions[label] if i > move)
+        filled = self._settle(region, move, territories)
+        if filled and joined is not None:
+            self._drop_region(joined)
+
+        ## regions which come after the move: the pieces are left with their locations which come before it
+        pending = []
+        for label in queue[pos:]:
+            cells = self._regions[label]
+            if label not in pieces_set:
+                pending.append((cells, label))
+                continue
+            early = [i for i in cells if i < move]
+            if filled:
+                self._drop_region(label)
+                pending.extend((self._regions[sub], sub) for sub in self._flood_regions(early))
+            elif early:
+                pending.append((early, label))
+        pending.sort()
+        for cells, label in pending:
+            if len(cells) == len(self._regions[label]):
+                if self._deficit[label] == 0:
+                    self._settle(cells, move, territories)
+                    self._drop_region(label)
+            elif self._settle(cells, move, territories):
+                late = [i for i in self._drop_region(label) if i > move]
+                self._flood_regions(late)
+        return territories
+
+
+    def legal_actions_mask(self, is_black):
+        """
+        boolean array over all the points of the board: True for the moves that update_board would accept for the player.
+        The territories are simulated on bit masks (see BoardMasks.resolve), without touching the board;
+        the masks are cached until the board changes
+        """
+        if self.board is not self._synced_board:
+            self._sync_board()
+        if self._version != self._mask_version:
+            self._mask_cache = {}
+            self._mask_version = self._version
+        is_black = bool(is_black)
+        if is_black not in self._mask_cache:
+            legal = self._legal_actions(is_black)
+            legal.flags.writeable = False
+            self._mask_cache[is_black] = legal
+        return self._mask_cache[is_black]
+
+
+    def _legal_actions(self, is_black):
+        """
+        simulate each empty point as the next move of the player (see BoardMasks.resolve). The simulation is skipped
+        when no territory can be filled: all the regions which can be filled are parts of the region of the move
+        (unless another region is already a candidate), and none of them can contain a point with less than two
+        filled neighbours: there must be a piece of the region without such points, or the move must be able to
+        join the pieces (no such points after the move), or a piece must have them only after the move
+        """
+        masks = bitboard_masks(self.size)
+        black = sum(1 << i for i, x in enumerate(self.board) if x == 0)
+        white = sum(1 << i for i, x in enumerate(self.board) if x == 1)
+        empty = masks.full & ~(black | white)
+        at_least_one, at_least_two = masks.filled_neighbours(black | white)
+        ready = empty & ~masks.flood(empty & ~at_least_two, empty)
+        legal = np.zeros(len(self.board), dtype=bool)
+        for region in masks.split(empty):
+            others_ready = ready & ~region
+            cells = region
+            while cells:
+                bit = cells & -cells
+                cells ^= bit
+                move = bit.bit_length() - 1
+                after_black, after_white = (black | bit, white) if is_black else (black, white | bit)
+                rest = region ^ bit
+                bad = rest & ~(at_least_two | (at_least_one & masks.neighbours[move]))
+                before = bit - 1
+                if (others_ready or rest & ~masks.flood(bad, rest)
+                        or (not bad & ~before and at_least_two >> move & 1)
+                        or (bad & ~before and rest & before & ~masks.flood(bad & before, rest))):
+                    after_black, after_white, _ = masks.resolve(after_black, after_white, move, region, others_ready)
+                legal[move] = masks.legal(after_black, after_white, move)
+        return legal
+
+
+    def _sync_paths(self):
+        """
+        rebuild from scratch the connectivity of the stones: disjoint sets of orthogonally adjacent, like-colored 
+        points, where the black stones on the top / bottom side are joined to two virtual points, and the white 
+        stones on the left / right side to two other virtual points
+        """
+        self._parent = list(range(len(self.board) + 4))
+        for idx, value in enumerate(self.board):
+            if value != -1:
+                self._connect(idx)
+
+
+    def _find(self, idx):
+        """
+        representative of the set of a point (with path halving)
+        """
+        parent = self._parent
+        journal = self._journal
+        while parent[idx] != idx:
+            if journal is not None:
+                journal.append((parent, idx, parent[idx]))
+            parent[idx] = parent[parent[idx]]
+            idx = parent[idx]
+        return idx
+
+
+    def _union(self, a, b):
+        a, b = self._find(a), self._find(b)
+        if self._journal is not None:
+            self._journal.append((self._parent, a, a))
+        self._parent[a] = b
+
+
+    def _connect(self, idx):
+        """
+        join a stone to its like-colored neighbours and, if it lies on its own sides, to the virtual points
+        """
+        value = self.board[idx]
+        for i in self._neighbours[idx]:
+            if self.board[i] == value:
+                self._union(idx, i)
+        if value == 0:
+            if idx < self.size:
+                self._union(idx, self._top)
+            if idx in self._bottom_side:
+                self._union(idx, self._bottom)
+        else:
+            if idx % self.size == 0:
+                self._union(idx, self._left)
+            if idx in self._right_side:
+                self._union(idx, self._right)
+
+
+    def _path_search(self, starts, blocked):
+        """
+        breadth-first search of a shortest path of like-colored points, from any of the starting points to the 
+        arrival side of their color (the bottom for the black, the right for the white); returns the path or []
+        """
+        value = self.board[starts[0]]
+        arrival = self._bottom_side if value == 0 else self._right_side
+        previous = {idx: None for idx in starts}
+        queue = list(previous)
+        for curr in queue:
+            if curr in arrival:
+                path = []
+                while curr is not None:
+                    path.append(curr)
+                    curr = previous[curr]
+                return path[::-1]
+            for i in self._neighbours[curr]:
+                if self.board[i] == value and i not in previous and i not in blocked:
+                    previous[i] = curr
+                    queue.append(i)
+        return []
+
+
     def winning_path_lookup(self, idx, exclude, winning_path):
         """
         checks for a winning path for a specific player:
-        a top-to-bottom way of orthogonally adjacent points, for the black player; a left-to-right way for the white player  
+        a top-to-bottom way of orthogonally adjacent points, for the black player; a left-to-right way for the white player.
+        The points in exclude and in winning_path are not crossed; if a path is found, its points are added to winning_path  
         """
         if idx in winning_path:
             return False
-        winning_path.add(idx)
-        neighbours = self.neighbours(idx, exclude)
-        ## define all the potential arrival points for the player 
-        arrival = list(range(self.size * (self.size - 1), self.size * self.size)) if self.board[idx] == 0 else list(range(self.size - 1, self.size * self.size, self.size))
-        if idx in arrival:
-            return True
-        ## look for a winning path recursively starting from each like-colored neighbour of the point
-        for neighbour in neighbours:
-            if self.board[neighbour] == self.board[idx] and self.winning_path_lookup(neighbour, exclude, winning_path):
-                return True
-        winning_path.remove(idx)
-        return False
+        path = self._path_search([idx], set(exclude) | winning_path)
+        winning_path.update(path)
+        return bool(path)
+
+
+    def winning_path(self):
+        """
+        returns the points of a (shortest) winning path, from the starting side to the arrival side, 
+        or an empty list if nobody won
+        """
+        winner = self.gameover()
+        if winner == -1:
+            return []
+        starts = range(self.size) if winner == 0 else range(0, self.size * self.size, self.size)
+        return self._path_search([i for i in starts if self.board[i] == winner], ())
     
 
     def gameover(self):
         """
-        verifies if there is a winning path for both the players
+        verifies if there is a winning path for both the players:
+        it is enough to check whether the virtual points of the two sides of a player are in the same set
         """
-        winning_path = set()
-        black_won = any(self.board[i] == 0 and self.winning_path_lookup(i, [], winning_path) for i in range(self.size))        
-        if black_won:
+        if self.board is not self._synced_board:
+            self._sync_board()
+        if self._find(self._top) == self._find(self._bottom):
             # print("BLACK won")
             return 0
-        white_won = any(self.board[i * self.size] == 1 and self.winning_path_lookup(i * self.size, [], winning_path) for i in range(self.size))
-        if white_won:
+        if self._find(self._left) == self._find(self._right):
             # print("WHITE won")
             return 1
-        return -1
\ No newline at end of file
+        return -1
+
+
+
+_MASKS = {}
+
+
+def bitboard_masks(size):
+    """
+    returns the BoardMasks of a board with the given side, built once per size
+    """
+    if size not in _MASKS:
+        _MASKS[size] = BoardMasks(size)
+    return _MASKS[size]
+
+
+class BoardMasks:
+    """
+    bit masks of a board (bit idx <-> point idx) and the rules of the game as operations on masks:
+    all the points, the points not in the first / last column, the four sides, and the masks of the
+    orthogonally adjacent and of the diagonal points of each point
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.full = (1 << (size * size)) - 1
+        self.left = sum(1 << (row * size) for row in range(size))
+        self.right = self.left << (size - 1)
+        self.top = (1 << size) - 1
+        self.bottom = self.top << (size * (size - 1))
+        self.not_left = self.full & ~self.left
+        self.not_right = self.full & ~self.right
+        neighbours, diagonals = adjacency_tables(size)
+        self.neighbours = [sum(1 << i for i in points) for points in neighbours]
+        self.diagonals = [sum(1 << i for i in points) for points in diagonals]
+
+
+    def dilate(self, mask):
+        """
+        the points of a mask together with their orthogonally adjacent points
+        """
+        return (mask | ((mask << self.size) & self.full) | (mask >> self.size)
+                | ((mask << 1) & self.not_left) | ((mask >> 1) & self.not_right))
+
+
+    def flood(self, seeds, within):
+        """
+        the points of a mask which can be reached from the seeds through orthogonally adjacent points of the mask
+        """
+        size, full, not_left, not_right = self.size, self.full, self.not_left, self.not_right
+        reached = seeds & within
+        while True:
+            expanded = (reached | ((reached << size) & full) | (reached >> size)
+                        | ((reached << 1) & not_left) | ((reached >> 1) & not_right)) & within
+            if expanded == reached:
+                return reached
+            reached = expanded
+
+
+    def split(self, mask):
+        """
+        the regions (orthogonally connected components) of a mask, sorted by their first point
+        """
+        regions = []
+        while mask:
+            region = self.flood(mask & -mask, mask)
+            regions.append(region)
+            mask &= ~region
+        return regions
+
+
+    def filled_neighbours(self, filled):
+        """
+        the points which have at least one, and at least two filled neighbours
+        """
+        below = filled >> self.size
+        above = (filled << self.size) & self.full
+        right = (filled >> 1) & self.not_right
+        left = (filled << 1) & self.not_left
+        return below | above | right | left, (below & above) | (right & left) | ((below | above) & (right | left))
+
+
+    def fill(self, black, white, region, last_move):
+        """
+        the color of a territory (see QuentinGame.fill_territory), the tie-break depends on the color of the last move
+        """
+        border = self.dilate(region) & ~region
+        cnt_black = (border & black).bit_count()
+        cnt_white = (border & white).bit_count()
+        if cnt_black == cnt_white:
+            if white >> last_move & 1:
+                cnt_black += 1
+            else:
+                cnt_white += 1
+        return 0 if cnt_black > cnt_white else 1
+
+
+    def resolve(self, black, white, move, region=None, ready=None):
+        """
+        detect and fill the territories after a move (already included in the masks), as QuentinGame.update_board does;
+        returns the masks of the black and white stones afterwards and the list of the filled territories (mask, color).
+        See QuentinGame._resolve_territories: here the regions which are not adjacent to the move are only
+        revisited if all their points have at least two filled neighbours.
+        The empty region which contained the move and the regions (not adjacent to the move) which are ready
+        to be filled can be passed if they are already known
+        """
+        bit = 1 << move
+        empty = self.full & ~(black | white)
+        fills = []
+
+        def settle(region):
+            nonlocal black, white, empty
+            if region & ~self.filled_neighbours(self.full & ~empty)[1]:
+                return False
+            replacement = self.fill(black, white, region, move)
+            if replacement == 0:
+                black |= region
+                white &= ~region
+            else:
+                white |= region
+                black &= ~region
+            empty &= ~region
+            fills.append((region, replacement))
+            return True
+
+        if region is None:
+            split_region = self.flood(self.neighbours[move] & empty, empty)
+        else:
+            split_region = region & ~bit
+        ## the region can only be split if the move has more than one empty neighbour
+        nearby = self.neighbours[move] & split_region
+        pieces = self.split(split_region) if nearby & (nearby - 1) else [split_region] if split_region else []
+        if ready is None:
+            ready = empty & ~split_region
+            ready &= ~self.flood(ready & ~self.filled_neighbours(self.full & ~empty)[1], ready)
+        queue = sorted([(region & -region, True, region) for region in pieces]
+                       + [(region & -region, False, region) for region in self.split(ready)])
+
+        ## regions which come before the move (unless one of them is joined by the move)
+        joined = 0
+        pos = 0
+        while pos < len(queue) and queue[pos][0] < bit:
+            _, is_piece, region = queue[pos]
+            pos += 1
+            if is_piece and region & (region - 1):
+                joined = region
+                break
+            settle(region)
+
+        ## the region of the move
+        before = bit - 1
+        region = bit | joined
+        for _, is_piece, piece in queue[pos:]:
+            if is_piece:
+                region |= piece & ~before
+        filled = settle(region)
+
+        ## regions which come after the move: the pieces are left with their points which come before it
+        pending = []
+        for _, is_piece, cells in queue[pos:]:
+            if not is_piece:
+                pending.append(cells)
+            elif filled:
+                pending.extend(self.split(cells & before))
+            elif cells & before:
+                pending.append(cells & before)
+        pending.sort(key=lambda region: region & -region)
+        for region in pending:
+            settle(region)
+        return black, white, fills
+
+
+    def legal(self, black, white, move):
+        """
+        see QuentinGame.legal_move
+        """
+        same = white if white >> move & 1 else black
+        like_colored_neighbours = self.neighbours[move] & same
+        like_colored_diags = self.diagonals[move] & same
+        while like_colored_diags:
+            low = like_colored_diags & -like_colored_diags
+            if self.neighbours[low.bit_length() - 1] & like_colored_neighbours:
+                return True
+            like_colored_diags ^= low
+        return not self.diagonals[move] & same
+
+
+class QuentinBitboard(QuentinGame):
+    """
+    same game, with the black stones, the white stones and the empty points stored as bit masks (Python integers):
+    regions, territories and winning paths are computed with shifts and masks (see BoardMasks).
+    The board list is kept up to date as a view of the masks, so it can be used (and set) as in QuentinGame
+    """
+
+    def __init__(self, size, cache=None):
+        self.masks = bitboard_masks(size)
+        super().__init__(size, cache)
+
+
+    def _undo_state(self):
+        """
+        the masks before the move, the hash and the result: the points to empty are the difference of the masks
+        """
+        return self.black, self.white, self.hash, self._winner
+
+
+    def _restore_state(self, state):
+        black, white, self.hash, self._winner = state
+        added = (self.black | self.white) & ~(black | white)
+        while added:
+            low = added & -added
+            idx = low.bit_length() - 1
+            self.board[idx] = -1
+            added ^= low
+        self.black, self.white = black, white
+        self.empty = self.masks.full & ~(black | white)
+
+
+    def _sync_board(self):
+        """
+        rebuild the masks (and the hash) from the board list
+        """
+        self.black = sum(1 << i for i, x in enumerate(self.board) if x == 0)
+        self.white = sum(1 << i for i, x in enumerate(self.board) if x == 1)
+        self.empty = self.masks.full & ~(self.black | self.white)
+        self._sync_hash()
+        self._synced_board = self.board
+        self._version += 1
+
+
+    def _apply_stones(self, black_added, white_added):
+        self.black |= black_added
+        self.white |= white_added
+        self.empty &= ~(black_added | white_added)
+        for mask, value in ((black_added, 0), (white_added, 1)):
+            while mask:
+                low = mask & -mask
+                self.board[low.bit_length() - 1] = value
+                mask ^= low
+
+
+    def _update_board(self, is_black, move, unavail):
+        """
+        include the new move and all the related changes in the board (if they are compliant to the rules),
+        exactly as QuentinGame._update_board does
+        """
+        valid_move = 0 <= move < len(self.board) and self.board[move] == -1
+        if not valid_move:
+            unavail.append(move)
+            return False
+        if self.board is not self._synced_board:
+            self._sync_board()
+        key = None
+        if self.cache is not None:
+            key = (self.hash, move, bool(is_black))
+            entry = self.cache.get(key)
+            if entry is not None:
+                return self._replay_move(entry, move, unavail)
+
+        bit = 1 << move
+        black, white = (self.black | bit, self.white) if is_black else (self.black, self.white | bit)
+        black, white, fills = self.masks.resolve(black, white, move)
+        if not self.masks.legal(black, white, move):
+            if key is not None:
+                self.cache.put(key, (False, 0, 0, -1))
+            unavail.append(move)
+            return False
+
+        black_added, white_added = black & ~self.black, white & ~self.white
+        self.black, self.white = black, white
+        self.empty = self.masks.full & ~(black | white)
+        self.board[move] = 0 if is_black else 1
+        for region, replacement in fills:
+            while region:
+                low = region & -region
+                idx = low.bit_length() - 1
+                self.board[idx] = replacement
+                region ^= low
+        self._record_move(key, black_added, white_added)
+        return True
+
+
+    def gameover(self):
+        """
+        verifies if there is a winning path for both the players
+        """
+        if self.board is not self._synced_board:
+            self._sync_board()
+        if self._winner is None:
+            if self.masks.flood(self.black & self.masks.top, self.black) & self.masks.bottom:
+                self._winner = 0
+            elif self.masks.flood(self.white & self.masks.left, self.white) & self.masks.right:
+                self._winner = 1
+            else:
+                self._winner = -1
+        return self._winner
@@ -0,0 +1,767 @@
+##Micro-benchmarks for the game engine and the agents.
+## Usage: python Quentin_Benchmark.py <benchmark> (run without arguments to list them)
+
+import random
+import sys
+import timeit
+from Quentin import QuentinGame, QuentinBitboard, TranspositionCache, adjacency_tables
+
+
+def legacy_neighbours(board, size, idx):
+    """
+    neighbours lookup as it was done before the adjacency tables (bounds checks on every call)
+    """
+    mylist = []
+    if idx + size < len(board):
+        mylist.append(idx + size)
+    if idx + 1 < len(board) and idx // size == (idx + 1) // size:
+        mylist.append(idx + 1)
+    if idx - size >= 0:
+        mylist.append(idx - size)
+    if idx - 1 >= 0 and idx // size == (idx - 1) // size:
+        mylist.append(idx - 1)
+    return mylist
+
+
+def legacy_diagonals(board, size, idx):
+    """
+    diagonals lookup as it was done before the adjacency tables (bounds checks on every call)
+    """
+    mylist = []
+    if idx + size + 1 < len(board) and (idx + 1) // size == idx // size:
+        mylist.append(idx + size + 1)
+    if idx + size - 1 < len(board) and (idx - 1) // size == idx // size and idx != 0:
+        mylist.append(idx + size - 1)
+    if idx - size - 1 >= 0 and (idx - 1) // size == idx // size:
+        mylist.append(idx - size - 1)
+    if idx - size + 1 >= 0 and (idx + 1) // size == idx // size:
+        mylist.append(idx - size + 1)
+    return mylist
+
+
+def random_game(size, seed=0, game_class=QuentinBitboard):
+    """
+    play a game with random moves, returns the game and the list of attempted moves (player, location)
+    """
+    rng = random.Random(seed)
+    game = game_class(size)
+    is_black = True
+    attempts = []
+    while game.gameover() == -1 and -1 in game.board:
+        move = rng.randrange(size * size)
+        attempts.append((is_black, move))
+        if game.update_board(is_black, move, []):
+            is_black = not is_black
+    return game, attempts
+
+
+def bench_adjacency(repeat=5):
+    """
+    cost of a full sweep of neighbours + diagonals lookups over the board, per point,
+    with the per-call bounds checks and with the shared adjacency tables
+    """
+    print(f"{'size':>4} {'legacy (ns)':>12} {'tables (ns)':>12} {'speed-up':>9} {'legal_move (us)':>16}")
+    for size in range(5, 14):
+        board = [-1] * (size * size)
+        neighbours, diagonals = adjacency_tables(size)
+        points = range(size * size)
+
+        def legacy():
+            for idx in points:
+                legacy_neighbours(board, size, idx)
+                legacy_diagonals(board, size, idx)
+
+        def tables():
+            for idx in points:
+                neighbours[idx]
+                diagonals[idx]
+
+        number = 200
+        t_legacy = min(timeit.repeat(legacy, number=number, repeat=repeat)) / (number * len(points)) * 1e9
+        t_tables = min(timeit.repeat(tables, number=number, repeat=repeat)) / (number * len(points)) * 1e9
+        game, _ = random_game(size)
+        t_legal = min(timeit.repeat(lambda: [game.legal_move(i) for i in points], number=20, repeat=repeat)) / (20 * len(points)) * 1e6
+        print(f"{size:>4} {t_legacy:>12.1f} {t_tables:>12.1f} {t_legacy / t_tables:>8.1f}x {t_legal:>16.2f}")
+
+
+def bench_backends(games=5):
+    """
+    cost of update_board (legal and illegal attempts) with the list and the bitboard backends,
+    replaying the same random games on both
+    """
+    print(f"{'size':>4} {'QuentinGame (us)':>17} {'QuentinBitboard (us)':>21}")
+    for size in range(5, 14):
+        replays = [random_game(size, seed)[1] for seed in range(games)]
+        timings = []
+        boards = []
+        for game_class in (QuentinGame, QuentinBitboard):
+            elapsed = 0.0
+            for attempts in replays:
+                game = game_class(size)
+                start = timeit.default_timer()
+                for is_black, move in attempts:
+                    game.update_board(is_black, move, [])
+                elapsed += timeit.default_timer() - start
+                boards.append(game.board)
+            timings.append(elapsed / sum(len(attempts) for attempts in replays) * 1e6)
+        assert boards[:games] == boards[games:], "the backends produced different boards"
+        print(f"{size:>4} {timings[0]:>17.1f} {timings[1]:>21.1f}")
+
+
+def perft_copy(game, is_black, depth):
+    """
+    leaves of the tree of the legal moves, copying the game at each move (as the nodes of MCTS)
+    """
+    if depth == 0 or game.gameover() != -1:
+        return 1
+    nodes = 0
+    for move in range(game.size * game.size):
+        if game.board[move] == -1:
+            child = type(game)(game.size)
+            child.board = game.board[:]
+            if child.update_board(is_black, move, []):
+                nodes += perft_copy(child, not is_black, depth - 1)
+    return nodes
+
+
+def perft(game, is_black, depth):
+    """
+    leaves of the tree of the legal moves, with make_move and unmake_move on a single game
+    """
+    if depth == 0 or game.gameover() != -1:
+        return 1
+    nodes = 0
+    for move in range(game.size * game.size):
+        if game.board[move] == -1 and game.make_move(is_black, move):
+            nodes += perft(game, not is_black, depth - 1)
+            game.unmake_move()
+    return nodes
+
+
+def bench_perft(positions=3):
+    """
+    nodes per second of perft from random positions: copying the game at each move (as MCTS)
+    and with make/unmake on the bitboard and on the list backend. Measured: make/unmake is about 2x the copy
+    on the bitboard, while on the list backend it is about the same at size 5 and 1.2-1.3x at sizes 7 and 9
+    """
+    print(f"{'size':>4} {'depth':>5} {'nodes':>8} {'copy (n/s)':>11} {'bitboard (n/s)':>15} {'list (n/s)':>11}")
+    for size, depth in ((5, 3), (7, 2), (9, 2)):
+        starts = []
+        for seed in range(positions):
+            game, attempts = random_game(size, seed)
+            ## about half of the board still empty (near the end of the game the trees would be too small)
+            starts.append(attempts[:size * size // 2])
+        rates = []
+        counts = []
+        for game_class, count in ((QuentinBitboard, perft_copy), (QuentinBitboard, perft), (QuentinGame, perft)):
+            nodes = 0
+            elapsed = 0.0
+            for attempts in starts:
+                game = game_class(size)
+                is_black = True
+                for player, move in attempts:
+                    if game.update_board(player, move, []):
+                        is_black = not player
+                start = timeit.default_timer()
+                nodes += count(game, is_black, depth)
+                elapsed += timeit.default_timer() - start
+            counts.append(nodes)
+            rates.append(nodes / elapsed)
+        assert counts[0] == counts[1] == counts[2], "the perft counts are different"
+        print(f"{size:>4} {depth:>5} {counts[0]:>8} {rates[0]:>11.0f} {rates[1]:>15.0f} {rates[2]:>11.0f}")
+
+
+def bench_cache(size=7, games=200, openings=20):
+    """
+    cost of update_board with and without a shared TranspositionCache, replaying random games
+    which repeat a limited number of openings (as self-play with a greedy policy does)
+    """
+    replays = [random_game(size, seed % openings)[1] for seed in range(games)]
+    moves = sum(len(attempts) for attempts in replays)
+    print(f"{'backend':>16} {'no cache (us)':>14} {'cache (us)':>11} {'hit rate':>9} {'entries':>8} {'MB':>6}")
+    for game_class in (QuentinGame, QuentinBitboard):
+        timings = []
+        for cache in (None, TranspositionCache()):
+            start = timeit.default_timer()
+            for attempts in replays:
+                game = game_class(size, cache)
+                for is_black, move in attempts:
+                    game.update_board(is_black, move, [])
+                    game.gameover()
+            timings.append((timeit.default_timer() - start) / moves * 1e6)
+        stats = cache.stats()
+        print(f"{game_class.__name__:>16} {timings[0]:>14.1f} {timings[1]:>11.1f} {stats['hit_rate']:>9.2f} "
+              f"{stats['entries']:>8} {stats['bytes'] / 2**20:>6.2f}")
+
+
+def bench_render(size=7, games=5):
+    """
+    cost of drawing the board after each move of random games (Agg canvas, rendered at every move):
+    clearing and rebuilding the axes as the play scripts did, against the incremental MatplotlibRenderer
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Circle
+    from types import SimpleNamespace
+    from Quentin_Render import MatplotlibRenderer
+
+    def rebuild(ax, board):
+        ax.clear()
+        ax.set_xticks(range(size))
+        ax.set_yticks(range(size))
+        ax.grid(which='both', color='black', linestyle='-', linewidth=1)
+        ax.set_xlim(-0.5, size-0.5)
+        ax.set_ylim(-0.5, size-0.5)
+        for i in range(size):
+            ax.text(-1, i, chr(ord('A') + size - i - 1))
+            ax.text(size, i, chr(ord('A') + size - i - 1))
+            ax.text(i, size, str(i))
+            ax.text(i, -1, str(i))
+        for idx, value in enumerate(board):
+            if value != -1:
+                row, col = divmod(idx, size)
+                ax.add_patch(Circle((col, size-row-1), 0.4, facecolor='black' if value == 0 else 'white'))
+
+    replays = []
+    for seed in range(games):
+        game = QuentinBitboard(size)
+        replays.append([SimpleNamespace(board=list(game.board)) for is_black, move in random_game(size, seed)[1]
+                        if game.update_board(is_black, move, [])])
+    moves = sum(len(positions) for positions in replays)
+    fig, ax = plt.subplots()
+    start = timeit.default_timer()
+    for positions in replays:
+        for position in positions:
+            rebuild(ax, position.board)
+            fig.canvas.draw()
+    t_rebuild = (timeit.default_timer() - start) / moves * 1e3
+    plt.close(fig)
+    start = timeit.default_timer()
+    for positions in replays:
+        renderer = MatplotlibRenderer(size)
+        for position in positions:
+            renderer.draw(position)
+            renderer.fig.canvas.draw()
+        renderer.close()
+    t_incremental = (timeit.default_timer() - start) / moves * 1e3
+    print(f"{'moves':>6} {'rebuild (ms)':>13} {'incremental (ms)':>17}")
+    print(f"{moves:>6} {t_rebuild:>13.2f} {t_incremental:>17.2f}")
+
+
+def bench_multienv(size=7, steps=200):
+    """
+    self-play throughput of QuentinMultiEnv, with the actions of all the games picked by one forward pass
+    of an (untrained) DQN: masked argmax of the Q-values
+    """
+    import numpy as np
+    import torch
+    from Quentin_DQN import DQN
+    from Quentin_MultiEnv import QuentinMultiEnv
+
+    model = DQN(size * size + 1, size * size)
+    print(f"{'games':>6} {'moves/s':>10} {'forward passes/s':>17}")
+    for num_envs in (1, 16, 64, 256):
+        env = QuentinMultiEnv(size, num_envs)
+        states, masks = env.reset()
+        start = timeit.default_timer()
+        for _ in range(steps):
+            with torch.no_grad():
+                q_values = model(torch.from_numpy(states)).numpy()
+            actions = np.where(masks, q_values, -np.inf).argmax(axis=1)
+            states, rewards, dones, masks, info = env.step(actions)
+        elapsed = timeit.default_timer() - start
+        print(f"{num_envs:>6} {steps * num_envs / elapsed:>10.0f} {steps / elapsed:>17.1f}")
+
+
+def bench_mcts(size=7, moves=5):
+    """
+    latency of MCTSPlayer.select_move from the empty board, with different simulation budgets and leaf batch sizes
+    (untrained DQN), and with a time budget
+    """
+    from Quentin_DQN import DQN
+    from Quentin_MCTS import MCTSPlayer
+
+    model = DQN(size * size + 1, size * size)
+    board = [-1] * (size * size)
+    print(f"{'simulations':>12} {'batch':>6} {'ms/move':>8} {'simulations/s':>14} {'forward passes':>15}")
+    for simulations in (50, 200, 800):
+        for batch_size in (1, 8, 32):
+            elapsed = 0.0
+            for _ in range(moves):
+                player = MCTSPlayer(model, simulations=simulations, batch_size=batch_size)
+                start = timeit.default_timer()
+                player.select_move(board, True)
+                elapsed += timeit.default_timer() - start
+            print(f"{simulations:>12} {batch_size:>6} {elapsed / moves * 1e3:>8.1f} {simulations * moves / elapsed:>14.0f} "
+                  f"{player.last_search['forward_passes']:>15}")
+    for budget in (0.05, 0.2):
+        player = MCTSPlayer(model, simulations=None, time_budget=budget)
+        start = timeit.default_timer()
+        player.select_move(board, True)
+        print(f"time budget {budget * 1e3:.0f} ms: {(timeit.default_timer() - start) * 1e3:.1f} ms, "
+              f"{player.last_search['simulations']} simulations")
+
+
+def bench_replay(size=7, repeat=20):
+    """
+    cost of one QuentinDQNAgent.replay call, per-sample (one optimization step per transition) and batched
+    """
+    import numpy as np
+    from Quentin_DQN import QuentinDQNAgent
+
+    rng = np.random.default_rng(0)
+    state_size, action_size = size * size + 1, size * size
+    print(f"{'batch':>6} {'per-sample (ms)':>16} {'batched (ms)':>13} {'speed-up':>9}")
+    for batch_size in (32, 128, 512):
+        timings = []
+        for batched in (False, True):
+            agent = QuentinDQNAgent(size, state_size, action_size, kernel_size=128, batched_replay=batched)
+            for _ in range(batch_size * 4):
+                agent.remember(rng.integers(-1, 2, state_size).astype(float), int(rng.integers(action_size)),
+                               float(rng.choice([0, -1, 100, -100])), rng.integers(-1, 2, state_size).astype(float),
+                               bool(rng.random() < 0.1))
+            timings.append(min(timeit.repeat(lambda: agent.replay(batch_size), number=1, repeat=repeat)) * 1e3)
+        print(f"{batch_size:>6} {timings[0]:>16.2f} {timings[1]:>13.2f} {timings[0] / timings[1]:>8.1f}x")
+
+
+def legacy_convert_state(board, size, player):
+    """
+    state encoding as it was done before the StateEncoder (float64, filled in a Python loop)
+    """
+    import numpy as np
+    state = np.zeros((size * size + 1))
+    for i, val in enumerate(board):
+        state[i] = val
+    state[-1] = player
+    return state
+
+
+def bench_encode(size=7, batch_size=256, number=2000):
+    """
+    per-move cost of turning a board into the input tensor of a DQN: legacy convert_state + torch.FloatTensor,
+    the vectorized convert_state + torch.as_tensor and the StateEncoder (single board and batches of boards)
+    """
+    import numpy as np
+    import torch
+    from Quentin_DQN import StateEncoder, convert_state
+
+    game, _ = random_game(size)
+    board = game.board
+    boards = np.array([random_game(size, seed)[0].board for seed in range(8)] * (batch_size // 8), dtype=np.int8)
+    players = np.arange(batch_size) % 2
+
+    def timing(func, n=number):
+        return min(timeit.repeat(func, number=n, repeat=5)) / n * 1e6
+
+    print(f"{'encoding':>32} {'us/board':>9}")
+    print(f"{'legacy + FloatTensor':>32} {timing(lambda: torch.FloatTensor(legacy_convert_state(board, size, 0))):>9.2f}")
+    print(f"{'convert_state + as_tensor':>32} "
+          f"{timing(lambda: torch.as_tensor(convert_state(board, size, 0), dtype=torch.float32)):>9.2f}")
+    for encoding in ('flat', 'onehot', 'planar'):
+        encoder = StateEncoder(size, batch_size, encoding)
+        single = timing(lambda: encoder.encode(board, 0))
+        batch = timing(lambda: encoder.encode_batch(boards, players), number // 20) / batch_size
+        print(f"{'StateEncoder ' + encoding:>32} {single:>9.2f}")
+        print(f"{f'StateEncoder {encoding} (batch {batch_size})':>32} {batch:>9.2f}")
+
+
+def bench_models(batch_size=256, repeat=20):
+    """
+    parameters and batched forward throughput of the MLP DQN (one model per board size, 128 units as the saved agents)
+    and of the convolutional ConvDQN (the same weights for every size)
+    """
+    import torch
+    from Quentin_DQN import DQN, ConvDQN
+
+    conv = ConvDQN()
+    conv_parameters = sum(p.numel() for p in conv.parameters())
+    print(f"{'size':>4} {'MLP params':>11} {'ConvDQN params':>15} {'MLP states/s':>13} {'ConvDQN states/s':>17}")
+    for size in range(5, 14, 2):
+        mlp = DQN(size * size + 1, size * size, 128)
+        states = torch.randint(-1, 2, (batch_size, size * size + 1)).float()
+        timings = []
+        for model in (mlp, conv):
+            with torch.no_grad():
+                timings.append(min(timeit.repeat(lambda: model(states), number=5, repeat=repeat)) / 5)
+        print(f"{size:>4} {sum(p.numel() for p in mlp.parameters()):>11} {conv_parameters:>15} "
+              f"{batch_size / timings[0]:>13.0f} {batch_size / timings[1]:>17.0f}")
+
+
+def bench_inference(model_path="quentin_sz7_ep25__black", size=7, moves=500):
+    """
+    per-move latency (next_move on the positions of random games), largest difference of the Q-values and
+    cold start (a new interpreter which loads the model and picks the first move) of a saved agent loaded with
+    load_model and exported with export_model
+    """
+    import os
+    import subprocess
+    import tempfile
+    import numpy as np
+    from Quentin_Inference import EXTENSIONS, export_model, load_inference_model, next_move, q_values
+
+    games = []
+    while len(games) < moves:
+        game, attempts = random_game(size, len(games))
+        replay = QuentinBitboard(size)
+        is_black = True
+        for player, move in attempts[:len(attempts) // 2]:
+            if replay.update_board(player, move, []):
+                is_black = not player
+        games.append((replay, is_black))
+    states = np.array([list(game.board) + [0] for game, _ in games], dtype=np.float32)
+    cold_start = ("import sys, time; start = time.perf_counter(); "
+                  "from Quentin import QuentinBitboard; from Quentin_Inference import load_inference_model, next_move; "
+                  "next_move(QuentinBitboard({size}), load_inference_model({path!r}), True); "
+                  "print(time.perf_counter() - start, 'torch' in sys.modules)")
+    reference = load_inference_model(model_path)
+    print(f"{'model':>12} {'move (us)':>10} {'max |dQ|':>9} {'cold start (s)':>15} {'torch':>6}")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {"load_model": model_path}
+        for format in ("torchscript", "quantized", "numpy"):
+            paths[format] = export_model(model_path, os.path.join(directory, "model" + EXTENSIONS[format]), format, size)
+        for name, path in paths.items():
+            model = load_inference_model(path)
+            elapsed = min(timeit.repeat(lambda: [next_move(game, model, is_black) for game, is_black in games],
+                                        number=1, repeat=3)) / len(games) * 1e6
+            error = np.abs(q_values(model, states) - q_values(reference, states)).max()
+            output = subprocess.run([sys.executable, "-c", cold_start.format(size=size, path=path)],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            print(f"{name:>12} {elapsed:>10.1f} {error:>9.4f} {float(output[0]):>15.2f} {output[1]:>6}")
+
+
+def legacy_update_target_model(agent):
+    """
+    soft update of the target network as it was done before the flattened weights (state_dict round-trip)
+    """
+    target_model_state_dict = agent.target_model.state_dict()
+    model_state_dict = agent.model.state_dict()
+    for key in model_state_dict:
+        target_model_state_dict[key] = model_state_dict[key]*agent.tau + target_model_state_dict[key]*(1-agent.tau)
+    agent.target_model.load_state_dict(target_model_state_dict)
+
+
+def bench_target(size=7, episodes=40, seed=0):
+    """
+    cost of an update of the target network, with the state_dict round-trip and in place on the flattened weights,
+    and its share of the time of an alternating training run (the target is updated at every step)
+    """
+    import json
+    import os
+    import tempfile
+    from Quentin_DQN import QuentinDQNAgent
+    from Quentin_Train import train
+
+    print(f"{'network':>8} {'params':>7} {'state_dict (us)':>16} {'in place (us)':>14}")
+    for architecture in ('mlp', 'conv'):
+        agent = QuentinDQNAgent(size, size * size + 1, size * size, architecture=architecture, kernel_size=128)
+        legacy = min(timeit.repeat(lambda: legacy_update_target_model(agent), number=200, repeat=5)) / 200 * 1e6
+        in_place = min(timeit.repeat(agent.update_target_model, number=200, repeat=5)) / 200 * 1e6
+        print(f"{architecture:>8} {agent.model_weights.numel():>7} {legacy:>16.1f} {in_place:>14.1f}")
+
+    print(f"{'update':>11} {'steps/s':>8} {'target share':>13}")
+    update = QuentinDQNAgent.update_target_model
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ('state_dict', 'in place'):
+            path = os.path.join(directory, name + ".jsonl")
+            QuentinDQNAgent.update_target_model = legacy_update_target_model if name == 'state_dict' else update
+            try:
+                _, _, run = train('alternating', size, episodes, 64, opponent="quentin_sz7_ep25__black",
+                                  learn_black=False, kernel_size=128, seed=seed, metrics_path=path, log_every=episodes + 1)
+            finally:
+                QuentinDQNAgent.update_target_model = update
+            with open(path) as f:
+                record = json.loads(f.readline())
+            print(f"{name:>11} {run['steps'] / record['interval']:>8.0f} "
+                  f"{100 * record['phases']['update_target_model']['share']:>12.1f}%")
+
+
+def bench_buffer(size=7, capacity=20000, batch_size=128, repeat=50):
+    """
+    memory per transition and sampling cost of the replay memory: deque of tuples of float64 states
+    (convert_state) against the preallocated ReplayBuffer
+    """
+    import tracemalloc
+    from collections import deque
+    import numpy as np
+    import torch
+    from Quentin_DQN import ReplayBuffer, convert_state
+
+    rng = np.random.default_rng(0)
+    state_size = size * size + 1
+    boards = [list(rng.integers(-1, 2, size * size)) for _ in range(64)]
+
+    def transition(i):
+        return (convert_state(boards[i % 64], size, i % 2), i % (size * size), 0.0,
+                convert_state(boards[(i + 1) % 64], size, i % 2), False)
+
+    tracemalloc.start()
+    memory = deque(maxlen=capacity)
+    for i in range(capacity):
+        memory.append(transition(i))
+    deque_bytes = tracemalloc.get_traced_memory()[0] / capacity
+    tracemalloc.stop()
+
+    def deque_sample():
+        minibatch = random.sample(memory, batch_size)
+        states, actions, rewards, next_states, dones = zip(*minibatch)
+        return torch.FloatTensor(np.array(states)), torch.FloatTensor(np.array(next_states))
+
+    tracemalloc.start()
+    buffer = ReplayBuffer(capacity, state_size)
+    for i in range(capacity):
+        buffer.append(*transition(i))
+    buffer_bytes = tracemalloc.get_traced_memory()[0] / capacity
+    tracemalloc.stop()
+
+    t_deque = min(timeit.repeat(deque_sample, number=1, repeat=repeat)) * 1e6
+    t_buffer = min(timeit.repeat(lambda: buffer.sample(batch_size), number=1, repeat=repeat)) * 1e6
+    print(f"{'memory':>12} {'bytes/transition':>17} {'sample (us)':>12}")
+    print(f"{'deque':>12} {deque_bytes:>17.0f} {t_deque:>12.1f}")
+    print(f"{'ReplayBuffer':>12} {buffer_bytes:>17.0f} {t_buffer:>12.1f}")
+
+
+def bench_prioritized(size=5, seconds=60, batch_size=64, seed=0):
+    """
+    wins per wall-clock minute of a black agent learning against a random (legal) white player,
+    with uniform and prioritized replay, and the greedy win rate of the agent at the end of the training
+    """
+    import numpy as np
+    import torch
+    from Quentin_DQN import QuentinDQNAgent, convert_state
+
+    state_size, action_size = size * size + 1, size * size
+
+    def opponent_move(game, rng):
+        return int(rng.choice(np.flatnonzero(game.legal_actions_mask(False))))
+
+    def play(agent, rng, train):
+        # one game, black (agent) against white (random); returns the outcome (-1 stuck, 0 black, 1 white)
+        game = QuentinBitboard(size)
+        while True:
+            state = convert_state(game.board, size, 0)
+            action = agent.act(state, [], game.legal_actions_mask(True))
+            if action is None:
+                return -1
+            game.update_board(True, action, [])
+            winner = game.gameover()
+            if winner == -1 and game.legal_actions_mask(False).any():
+                game.update_board(False, opponent_move(game, rng), [])
+                winner = game.gameover()
+            if train:
+                reward = 0 if winner == -1 else 100 if winner == 0 else -100
+                agent.remember(state, action, reward, convert_state(game.board, size, 0), winner != -1)
+                if len(agent.memory) > batch_size:
+                    agent.replay(batch_size)
+                agent.update_target_model()
+            if winner != -1:
+                return winner
+
+    print(f"{'replay':>12} {'games':>6} {'wins':>6} {'wins/min':>9} {'greedy win rate':>16}")
+    for prioritized in (False, True):
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        rng = np.random.default_rng(seed)
+        agent = QuentinDQNAgent(size, state_size, action_size, epsilon_decay=0.999, prioritized_replay=prioritized)
+        games = wins = 0
+        start = timeit.default_timer()
+        while timeit.default_timer() - start < seconds:
+            wins += play(agent, rng, True) == 0
+            games += 1
+        minutes = (timeit.default_timer() - start) / 60
+        agent.epsilon = 0
+        greedy = np.mean([play(agent, rng, False) == 0 for _ in range(200)])
+        name = "prioritized" if prioritized else "uniform"
+        print(f"{name:>12} {games:>6} {wins:>6} {wins / minutes:>9.1f} {greedy:>16.2f}")
+
+
+def bench_selfplay(size=5, episodes=200):
+    """
+    episodes per second of parallel_learning (simultaneous scheme, with the learner training)
+    with an increasing number of worker processes
+    """
+    import os
+    from Quentin_SelfPlay import parallel_learning
+
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'episodes/s':>11} {'replays':>8}")
+    for workers in (1, 2, 4, 8):
+        _, _, stats = parallel_learning(size, 'simultaneous', workers=workers, episodes=episodes, batch_size=64, seed=0)
+        print(f"{workers:>8} {stats['episodes_per_second']:>11.1f} {stats['replays']:>8}")
+
+
+def bench_server(model_path="quentin_sz7_ep25__black", size=7, games=(1, 8, 32, 128), max_latency=0.002):
+    """
+    moves per second of concurrent games whose moves are ranked by the batched InferenceServer (in process),
+    against the same games played one at a time with a forward pass per move (next_move)
+    """
+    import asyncio
+    from Quentin_Inference import load_inference_model, next_move
+    from Quentin_Server import InferenceServer
+
+    model = load_inference_model(model_path)
+
+    def play_direct():
+        game = QuentinBitboard(size)
+        is_black = True
+        moves = 0
+        while game.gameover() == -1 and -1 in game.board:
+            move = next_move(game, model, is_black)
+            if move is None:
+                break
+            game.update_board(is_black, move, [])
+            is_black = not is_black
+            moves += 1
+        return moves
+
+    async def play_served(server):
+        game = QuentinBitboard(size)
+        is_black = True
+        moves = 0
+        while game.gameover() == -1 and -1 in game.board:
+            move = await server.next_move(game, is_black)
+            if move is None:
+                break
+            game.update_board(is_black, move, [])
+            is_black = not is_black
+            moves += 1
+        return moves
+
+    async def served(n):
+        async with InferenceServer({"model": model}, max_latency=max_latency) as server:
+            start = timeit.default_timer()
+            moves = sum(await asyncio.gather(*[play_served(server) for _ in range(n)]))
+            return moves / (timeit.default_timer() - start), server.stats()
+
+    print(f"{'games':>5} {'direct (moves/s)':>17} {'server (moves/s)':>17} {'batch size':>11} {'queue (ms)':>11}")
+    for n in games:
+        start = timeit.default_timer()
+        moves = sum(play_direct() for _ in range(n))
+        direct = moves / (timeit.default_timer() - start)
+        rate, stats = asyncio.run(served(n))
+        print(f"{n:>5} {direct:>17.0f} {rate:>17.0f} {stats['mean_batch_size']:>11.1f} {stats['mean_queue_ms']:>11.2f}")
+
+
+def bench_records(size=7, games=500, batch_size=1024):
+    """
+    cost of recording the games (per attempt, see RecordWriter) and size of the records; transitions per second
+    read from the records (see RecordReader.transitions) against replaying the games to rebuild the same states
+    """
+    import os
+    import tempfile
+    import numpy as np
+    from Quentin_Records import RecordReader, RecordWriter
+
+    replays = [random_game(size, seed)[1] for seed in range(games)]
+    attempts = sum(len(moves) for moves in replays)
+    path = os.path.join(tempfile.mkdtemp(), "games.qrec")
+    timings = []
+    for record in (False, True):
+        writer = RecordWriter(path, size) if record else None
+        start = timeit.default_timer()
+        for moves in replays:
+            game = QuentinBitboard(size) if writer is None else writer.record(QuentinBitboard(size))
+            for is_black, move in moves:
+                game.update_board(is_black, move, [])
+            if writer is not None:
+                writer.end_game(game)
+        if writer is not None:
+            writer.close()
+        timings.append((timeit.default_timer() - start) / attempts * 1e6)
+    print(f"{games} games, {attempts} attempts: update_board {timings[0]:.1f} us/attempt, "
+          f"recorded {timings[1]:.1f} us/attempt, {os.path.getsize(path) / games:.0f} bytes/game")
+
+    start = timeit.default_timer()
+    reader = RecordReader(path)
+    transitions = sum(len(actions) for _, actions, _, _, _ in reader.transitions(batch_size))
+    read = transitions / (timeit.default_timer() - start)
+    ## the states of the same transitions, rebuilt by replaying the games
+    start = timeit.default_timer()
+    rebuilt = 0
+    for moves in replays:
+        game = QuentinBitboard(size)
+        states = []
+        for is_black, move in moves:
+            states.append(game.board + [0 if is_black else 1])
+            game.update_board(is_black, move, [])
+        rebuilt += len(np.array(states, dtype=np.float32))
+    replayed = rebuilt / (timeit.default_timer() - start)
+    assert rebuilt == transitions, "the records have a different number of transitions"
+    print(f"transitions/s: records {read:.0f}, replaying the games {replayed:.0f}")
+    os.remove(path)
+
+
+def bench_offline(size=7, games=2000, batch_size=256, steps=300):
+    """
+    samples per second of the replays: the learner alone (batches already in memory), offline training from
+    recorded games (see train_offline) with an increasing number of loader workers, and online training (see train)
+    """
+    import os
+    import tempfile
+    import torch
+    from Quentin_DQN import QuentinDQNAgent
+    from Quentin_Offline import TransitionDataset, train_offline
+    from Quentin_Records import RecordWriter
+    from Quentin_Train import train
+
+    path = os.path.join(tempfile.mkdtemp(), "games.qrec")
+    writer = RecordWriter(path, size, chunk_games=100)
+    for seed in range(games):
+        _, attempts = random_game(size, seed)
+        game = writer.record(QuentinBitboard(size))
+        for is_black, move in attempts:
+            game.update_board(is_black, move, [])
+        writer.end_game(game)
+    writer.close()
+
+    agent = QuentinDQNAgent(size, size * size + 1, size * size)
+    batches = [batch for _, batch in zip(range(50), TransitionDataset([path], batch_size, shuffle_buffer=4096))]
+    losses = []
+    start = timeit.default_timer()
+    for i in range(steps):
+        agent.replay_batch(batches[i % len(batches)], losses)
+        agent.update_target_model()
+    print(f"learner alone: {steps * batch_size / (timeit.default_timer() - start):.0f} samples/s")
+    print(f"{os.cpu_count()} CPUs")
+    for workers in (0, 1, 2):
+        start = timeit.default_timer()
+        train_offline([path], steps, batch_size, workers=workers, shuffle_buffer=16384)
+        print(f"offline, {workers} workers: {steps * batch_size / (timeit.default_timer() - start):.0f} samples/s")
+    start = timeit.default_timer()
+    agents, losses, _ = train('simultaneous', size, 40, batch_size)
+    replays = sum(len(values) for values in losses.values())
+    print(f"online (simultaneous scheme): {replays * batch_size / (timeit.default_timer() - start):.0f} samples/s")
+    os.remove(path)
+
+
+BENCHMARKS = {
+    "adjacency": bench_adjacency,
+    "backends": bench_backends,
+    "perft": bench_perft,
+    "cache": bench_cache,
+    "render": bench_render,
+    "multienv": bench_multienv,
+    "mcts": bench_mcts,
+    "replay": bench_replay,
+    "buffer": bench_buffer,
+    "encode": bench_encode,
+    "models": bench_models,
+    "inference": bench_inference,
+    "records": bench_records,
+    "server": bench_server,
+    "target": bench_target,
+    "prioritized": bench_prioritized,
+    "selfplay": bench_selfplay,
+    "offline": bench_offline,
+}
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Available benchmarks: " + ", ".join(BENCHMARKS))
+        return
+    BENCHMARKS[sys.argv[1]]()
+
+if __name__ == "__main__":
+    main()
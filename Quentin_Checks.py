@@ -0,0 +1,178 @@
+##Correctness checks of the engine, the records and the search, which play random games: each check raises
+## AssertionError when it fails.
+## Usage: python Quentin_Checks.py [<check> ...] (all of them without arguments)
+
+import sys
+
+
+def check_mcts(size=5, moves=6):
+    """
+    MCTSPlayer with exported NumPy models (NumpyDQN, no torch in the search): its Q-values are the ones of the saved
+    agents, the moves of both colors are legal, and each leaf is evaluated by the network of its player to move
+    """
+    import os
+    import tempfile
+    import numpy as np
+    import torch
+    from Quentin import QuentinBitboard
+    from Quentin_DQN import QuentinDQNAgent, convert_state
+    from Quentin_Inference import NumpyDQN, export_model, load_inference_model
+    from Quentin_MCTS import MCTSPlayer
+
+    class Watched(NumpyDQN):
+        # a NumpyDQN which keeps the players to move of the states it evaluates
+        def __call__(self, states):
+            self.players.update(np.asarray(states)[:, -1].tolist())
+            return super().__call__(states)
+
+    directory = tempfile.mkdtemp()
+    models = {}
+    for is_black in (True, False):
+        torch.manual_seed(is_black)
+        agent = QuentinDQNAgent(size, size * size + 1, size * size)
+        path = os.path.join(directory, "black" if is_black else "white")
+        agent.save(path)
+        models[is_black] = load_inference_model(export_model(path, format="numpy"))
+        state = convert_state([-1] * (size * size), size, 0 if is_black else 1)
+        with torch.no_grad():
+            expected = agent.model(torch.from_numpy(state).float()).numpy()
+        assert np.allclose(models[is_black](state[None])[0], expected, atol=1e-5), "the NumPy model has other Q-values"
+    game = QuentinBitboard(size)
+    players = {is_black: MCTSPlayer(models[is_black], models[not is_black], simulations=64) for is_black in (True, False)}
+    is_black = True
+    for _ in range(moves):
+        move = players[is_black].select_move(game.board, is_black)
+        assert move is not None and game.legal_actions_mask(is_black)[move], f"illegal move {move} of the search"
+        game.update_board(is_black, move, [])
+        if game.gameover() != -1:
+            break
+        is_black = not is_black
+    own, opponent = Watched(models[True].config, models[True].weights), Watched(models[False].config, models[False].weights)
+    own.players, opponent.players = set(), set()
+    MCTSPlayer(own, opponent, simulations=64).select_move([-1] * (size * size), True)
+    assert own.players == {0.0} and opponent.players == {1.0}, "a leaf was evaluated by the network of the other color"
+    print(f"MCTS with NumPy models: {moves} legal moves, one network per color")
+
+
+def check_symmetry(size=7, games=20, seed=0):
+    """
+    invariance of the rules under the symmetries of the board, with both backends: random games are played and every
+    attempted move is also played on the transformed board (with the transformed move, and the other player if the
+    colors are swapped). The identity must match on every move; the other symmetries can only differ on the moves
+    which fill territories (on either board), since the territories are resolved in the order of the points
+    """
+    import random
+    import numpy as np
+    from Quentin import QuentinBitboard, QuentinGame, bitboard_masks, board_symmetries, transform_board
+
+    names, perms, swaps = board_symmetries(size)
+    masks = bitboard_masks(size)
+
+    def fills(board, is_black, move):
+        black = sum(1 << i for i, x in enumerate(board) if x == 0) | (is_black << move)
+        white = sum(1 << i for i, x in enumerate(board) if x == 1) | ((not is_black) << move)
+        return len(masks.resolve(black, white, move)[2])
+
+    for game_class in (QuentinGame, QuentinBitboard):
+        rng = random.Random(seed)
+        report = {name: {"moves": 0, "mismatches": 0, "mismatches_with_territories": 0} for name in names}
+        for _ in range(games):
+            game = game_class(size)
+            is_black = True
+            while game.gameover() == -1 and -1 in game.board:
+                move = rng.randrange(size * size)
+                before = game.board[:]
+                legal = game.update_board(is_black, move, [])
+                for name, perm, swap in zip(names, perms, swaps):
+                    other = game_class(size)
+                    other.board = transform_board(before, perm, swap)
+                    other_move = int(np.flatnonzero(perm == move)[0])
+                    other_black = is_black != bool(swap)
+                    territories = before[move] == -1 and (fills(before, is_black, move)
+                                                          or fills(other.board, other_black, other_move))
+                    other_legal = other.update_board(other_black, other_move, [])
+                    winner = game.gameover()
+                    expected_winner = 1 - winner if swap and winner != -1 else winner
+                    report[name]["moves"] += 1
+                    if (legal != other_legal or (legal and (other.board != transform_board(game.board, perm, swap)
+                                                            or other.gameover() != expected_winner))):
+                        report[name]["mismatches"] += 1
+                        report[name]["mismatches_with_territories"] += bool(territories)
+                if legal:
+                    is_black = not is_black
+        print(game_class.__name__)
+        print(f"{'symmetry':>15} {'moves':>6} {'mismatches':>11} {'with territories':>17}")
+        for name, counts in report.items():
+            print(f"{name:>15} {counts['moves']:>6} {counts['mismatches']:>11} {counts['mismatches_with_territories']:>17}")
+        assert report["identity"]["mismatches"] == 0, f"{game_class.__name__}: the identity does not match"
+        for name, counts in report.items():
+            assert counts["mismatches"] == counts["mismatches_with_territories"], \
+                f"{game_class.__name__}: {name} does not match on a move which fills no territory"
+
+
+def check_records(size=7, tries=500):
+    """
+    the transitions of a drawn game of the training loop (see play_episode: two learners with random moves, who
+    make illegal attempts and end when a player has no legal moves left) against the ones read from its record
+    """
+    import os
+    import random
+    import tempfile
+    import numpy as np
+    from Quentin import QuentinBitboard
+    from Quentin_DQN import QuentinDQNAgent
+    from Quentin_Metrics import Metrics
+    from Quentin_Records import RecordReader, RecordWriter
+    from Quentin_Train import play_episode
+
+    path = os.path.join(tempfile.mkdtemp(), "draw.qrec")
+    draw_rewards = {True: -10, False: 0}
+    for seed in range(tries):
+        random.seed(seed)
+        np.random.seed(seed)
+        agents = {player: QuentinDQNAgent(size, size * size + 1, size * size) for player in (True, False)}
+        run = {"illegal_moves": 0, "steps": 0, "losses": {True: [], False: []}}
+        if os.path.exists(path):
+            os.remove(path)
+        writer = RecordWriter(path, size)
+        game = writer.record(QuentinBitboard(size))
+        winner = play_episode(game, agents, None, draw_rewards, run, 0, 10**9, (1, 1), Metrics())
+        writer.end_game(game, winner)
+        writer.close()
+        if winner == 2 and run["illegal_moves"]:
+            break
+    else:
+        raise AssertionError(f"no drawn game with illegal attempts in {tries} games")
+    reader = RecordReader(path)
+    for player, agent in agents.items():
+        memory = agent.memory
+        played = sorted(zip(memory.states[:memory.size].tolist(), memory.actions[:memory.size].tolist(),
+                            memory.rewards[:memory.size].tolist(), memory.next_states[:memory.size].tolist(),
+                            memory.dones[:memory.size].tolist()))
+        read = sorted(transition for states, actions, rewards, next_states, dones
+                      in reader.transitions(players=(player,), draw_rewards=draw_rewards)
+                      for transition in zip(states.tolist(), actions.tolist(), rewards.tolist(), next_states.tolist(),
+                                            dones.tolist()))
+        assert played == read, f"the record and the training loop have different transitions ({'black' if player else 'white'})"
+    print(f"drawn game (seed {seed}, {run['illegal_moves']} illegal attempts): the record matches the training loop")
+    os.remove(path)
+
+
+CHECKS = {
+    "mcts": check_mcts,
+    "symmetry": check_symmetry,
+    "records": check_records,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(CHECKS)
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        print("Available checks: " + ", ".join(CHECKS))
+        sys.exit(2)
+    for name in names:
+        CHECKS[name]()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
+import math
 import random
 import numpy as np
 import torch
-from collections import deque
+from Quentin import board_symmetries, bitboard_masks
+from Quentin_Inference import encode_flat, rank_actions, next_move  # torch-free, shared with the play scripts
 
 # if GPU is to be used
 device = torch.device(
@@ -16,6 +18,7 @@ class DQN(torch.nn.Module):
         self.layer1 = torch.nn.Linear(state_size, kernel_dim)
         self.layer2 = torch.nn.Linear(kernel_dim, kernel_dim)
         self.layer3 = torch.nn.Linear(kernel_dim, action_size)
+        self.config = {"architecture": "mlp", "state_size": state_size, "action_size": action_size, "kernel_dim": kernel_dim}
         # Apply He initialization to the layers
         self._initialize_weights()
 
@@ -32,12 +35,314 @@ class DQN(torch.nn.Module):
         return self.layer3(x)
 
 
+def board_planes(states):
+    """
+    flat states (board and player, as convert_state), one or a batch of them, as the planes of the convolutional
+    network: black stones, white stones, empty points and player to move, of shape (batch, 4, size, size)
+    """
+    states = states.reshape(-1, states.shape[-1])
+    size = math.isqrt(states.shape[1] - 1)
+    boards = states[:, :-1].reshape(-1, size, size)
+    player = states[:, -1].reshape(-1, 1, 1).expand_as(boards)
+    dtype = states.dtype
+    return torch.stack([(boards == 0).to(dtype), (boards == 1).to(dtype), (boards == -1).to(dtype), player], dim=1)
+
+
+class ConvDQN(torch.nn.Module):
+    """
+    fully convolutional Q-network: the board planes (see board_planes) go through layers of 3x3 convolutions
+    (zero padding, so the sides of the board are visible), and a 1x1 convolution gives the Q-value of each point.
+    The same weights work with any size of the board; the input can also be flat states, as for DQN
+    """
+    def __init__(self, channels=32, layers=4):
+        super(ConvDQN, self).__init__()
+        self.convs = torch.nn.ModuleList([torch.nn.Conv2d(4 if i == 0 else channels, channels, 3, padding=1)
+                                          for i in range(layers)])
+        self.head = torch.nn.Conv2d(channels, 1, 1)
+        self.config = {"architecture": "conv", "channels": channels, "layers": layers}
+        for m in self.modules():
+            if isinstance(m, torch.nn.Conv2d):
+                torch.nn.init.kaiming_normal_(m.weight, mode='fan_in', nonlinearity='relu')
+                torch.nn.init.constant_(m.bias, 0)
+
+    def forward(self, x):
+        single = x.dim() == 1 or x.dim() == 3
+        if x.dim() <= 2:
+            x = board_planes(x)
+        elif x.dim() == 3:
+            x = x.unsqueeze(0)
+        for conv in self.convs:
+            x = torch.nn.functional.relu(conv(x))
+        q_values = self.head(x).flatten(1)
+        return q_values[0] if single else q_values
+
+
+def build_model(config):
+    """
+    the network described by a configuration (the config attribute of DQN and ConvDQN)
+    """
+    if config["architecture"] == "mlp":
+        return DQN(config["state_size"], config["action_size"], config["kernel_dim"])
+    if config["architecture"] == "conv":
+        return ConvDQN(config["channels"], config["layers"])
+    raise ValueError(f"unknown architecture: {config['architecture']}")
+
+
+def flatten_parameters(model):
+    """
+    moves the parameters (and the floating point buffers) of a network into one contiguous tensor, of which they
+    become views; returns that tensor, so that an update of all the weights is a single in-place operation.
+    The parameters keep their shapes, and load_state_dict copies into them (the views are kept)
+    """
+    tensors = list(model.parameters()) + [b for b in model.buffers() if b.is_floating_point()]
+    flat = torch.cat([t.detach().reshape(-1) for t in tensors])
+    offset = 0
+    for t in tensors:
+        t.data = flat[offset:offset + t.numel()].view_as(t)
+        offset += t.numel()
+    return flat
+
+
+class ReplayBuffer:
+    # ring buffer of transitions in preallocated arrays: the states (boards with values -1/0/1 and the player) 
+    # are stored as int8, and the minibatches are sampled with vectorized indexing.
+    # With symmetries (permutations of the points, color swaps and the inverse permutations, see board_symmetries)
+    # each sampled transition goes through one of them at random, if the rules give the same transition on the
+    # transformed board (checked the first time, and remembered in valid_symmetries)
+    def __init__(self, capacity, state_size, symmetries=None):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, state_size), dtype=np.int8)
+        self.actions = np.zeros(capacity, dtype=np.int16)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.next_states = np.zeros((capacity, state_size), dtype=np.int8)
+        self.dones = np.zeros(capacity, dtype=bool)
+        self.position = 0       # next slot to be written (the oldest transition, once the buffer is full)
+        self.size = 0
+        self.rng = np.random.default_rng()
+        self.symmetries = symmetries
+        if symmetries is not None:
+            self.valid_symmetries = np.full((capacity, len(symmetries[0])), -1, dtype=np.int8)   # -1: not checked yet
+            self.masks = bitboard_masks(math.isqrt(state_size - 1))
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, next_state, done):
+        self.states[self.position] = state
+        self.actions[self.position] = action
+        self.rewards[self.position] = reward
+        self.next_states[self.position] = next_state
+        self.dones[self.position] = done
+        if self.symmetries is not None:
+            self.valid_symmetries[self.position] = -1
+            self.valid_symmetries[self.position, 0] = 1
+        self.position = (self.position + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        # uniform sample without replacement, as float32/int64 tensors ready for the networks
+        indices = self.rng.choice(self.size, batch_size, replace=False)
+        return self.batch(indices)
+
+    def batch(self, indices):
+        states, actions, next_states = self.states[indices], self.actions[indices], self.next_states[indices]
+        if self.symmetries is not None:
+            states, actions, next_states = self.augment(indices, states, actions, next_states)
+        return (torch.from_numpy(states).to(device, torch.float32),
+                torch.from_numpy(actions).to(device, torch.int64),
+                torch.from_numpy(self.rewards[indices]).to(device),
+                torch.from_numpy(next_states).to(device, torch.float32),
+                torch.from_numpy(self.dones[indices]).to(device, torch.float32))
+
+    def augment(self, indices, states, actions, next_states):
+        # a random symmetry for each transition, applied as a gather of the points. The territories make the rules
+        # depend on the order of the points (see check_symmetry in Quentin_Checks.py), so only the transitions made
+        # of single stones (own move and reply, without territories) can be transformed, and only if the transformed moves
+        # also fill no territories; the other transitions are left as they are
+        perms, swaps, inverses = self.symmetries
+        new_stones = (next_states[:, :-1] != -1).sum(axis=1) - (states[:, :-1] != -1).sum(axis=1)
+        choice = self.rng.integers(len(perms), size=len(states))
+        choice[(new_stones < 1) | (new_stones > 2)] = 0
+        transformed = (self.transform(states, perms[choice], swaps[choice]), inverses[choice, actions].astype(np.int16),
+                       self.transform(next_states, perms[choice], swaps[choice]))
+        valid = self.valid_symmetries[indices, choice]
+        for k in np.flatnonzero(valid == -1):
+            ## on the original board too: a territory filled by the last move could look like a reply
+            valid[k] = self.check(states[k], actions[k], next_states[k]) and self.check(*(x[k] for x in transformed))
+            self.valid_symmetries[indices[k], choice[k]] = valid[k]
+        keep = valid == 0
+        choice[keep] = 0
+        if keep.any():
+            transformed[0][keep], transformed[1][keep], transformed[2][keep] = states[keep], actions[keep], next_states[keep]
+        return transformed
+
+    def check(self, state, action, next_state):
+        # 1 if the new stones of the transition, played in turn (own move, then the reply), are legal and fill no territories
+        board, after, is_black = state[:-1], next_state[:-1], state[-1] == 0
+        black = int.from_bytes(np.packbits(board == 0, bitorder='little').tobytes(), 'little')
+        white = int.from_bytes(np.packbits(board == 1, bitorder='little').tobytes(), 'little')
+        moves = [action] + [i for i in np.flatnonzero((board == -1) & (after != -1)) if i != action]
+        for move in moves:
+            if after[move] != (0 if is_black else 1):
+                return 0
+            bit = 1 << int(move)
+            black, white = (black | bit, white) if is_black else (black, white | bit)
+            if self.masks.resolve(black, white, int(move))[2] or not self.masks.legal(black, white, int(move)):
+                return 0
+            is_black = not is_black
+        return 1
+
+    def save(self, path):
+        # the transitions in a memory-mapped .npy file, one record per transition (the int8 states stay int8);
+        # returns the rest of the state of the buffer (position, size and random generator), for load
+        fields = [("state", np.int8, self.states.shape[1]), ("action", np.int16), ("reward", np.float32),
+                  ("next_state", np.int8, self.states.shape[1]), ("done", bool)]
+        if self.symmetries is not None:
+            fields.append(("valid_symmetries", np.int8, self.valid_symmetries.shape[1]))
+        records = np.lib.format.open_memmap(path, mode="w+", dtype=np.dtype(fields), shape=(self.size,))
+        records["state"], records["action"], records["reward"] = self.states[:self.size], self.actions[:self.size], self.rewards[:self.size]
+        records["next_state"], records["done"] = self.next_states[:self.size], self.dones[:self.size]
+        if self.symmetries is not None:
+            records["valid_symmetries"] = self.valid_symmetries[:self.size]
+        records.flush()
+        del records
+        return {"position": self.position, "size": self.size, "rng": self.rng.bit_generator.state}
+
+    def load(self, path, state):
+        # the transitions and the state written by save (the capacity and the state size must be the same)
+        records = np.load(path, mmap_mode="r")
+        self.size = len(records)
+        self.states[:self.size], self.actions[:self.size], self.rewards[:self.size] = records["state"], records["action"], records["reward"]
+        self.next_states[:self.size], self.dones[:self.size] = records["next_state"], records["done"]
+        if self.symmetries is not None:
+            self.valid_symmetries[:self.size] = records["valid_symmetries"]
+        del records
+        self.position = state["position"]
+        self.rng.bit_generator.state = state["rng"]
+
+    @staticmethod
+    def transform(states, perms, swaps):
+        transformed = np.empty_like(states)
+        transformed[:, :-1] = np.take_along_axis(states[:, :-1], perms, axis=1)
+        transformed[:, -1] = states[:, -1]
+        boards = transformed[swaps, :-1]
+        transformed[swaps, :-1] = np.where(boards == -1, -1, 1 - boards)
+        transformed[swaps, -1] = 1 - transformed[swaps, -1]
+        return transformed
+
+
+class SumTree:
+    # binary tree whose leaves hold the priorities of the transitions and each internal node the sum of its children:
+    # tree[1] is the total, the children of node i are 2i and 2i+1, the leaves start at index self.leaves
+    def __init__(self, capacity):
+        self.leaves = 1 << max(capacity - 1, 1).bit_length()
+        self.tree = np.zeros(2 * self.leaves)
+
+    def total(self):
+        return self.tree[1]
+
+    def priorities(self, indices):
+        return self.tree[indices + self.leaves]
+
+    def set(self, index, priority):
+        node = index + self.leaves
+        self.tree[node] = priority
+        node //= 2
+        while node:
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+            node //= 2
+
+    def update(self, indices, priorities):
+        # several leaves at once, the sums are recomputed one level at a time
+        nodes = np.asarray(indices) + self.leaves
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while True:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        # the leaves where the cumulative sums of the priorities reach the given values (one descent per value)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = self.tree[2 * nodes]
+            right = values > left
+            values = values - left * right
+            nodes = 2 * nodes + right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    # transitions are sampled with probability proportional to priority^alpha, the priority being the last TD error;
+    # the new ones get the maximum priority seen so far, so that they are replayed at least once
+    def __init__(self, capacity, state_size, alpha=0.6, beta=0.4, beta_increment=0.001, epsilon=1e-3, symmetries=None):
+        super().__init__(capacity, state_size, symmetries)
+        self.tree = SumTree(capacity)
+        self.alpha = alpha
+        self.beta = beta                        # importance-sampling exponent, annealed to 1
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon                  # keeps the transitions with no TD error in the game
+        self.max_priority = 1.0
+
+    def append(self, state, action, reward, next_state, done):
+        self.tree.set(self.position, self.max_priority ** self.alpha)
+        super().append(state, action, reward, next_state, done)
+
+    def sample(self, batch_size):
+        # stratified sample: one transition in each of batch_size equal segments of the total priority;
+        # returns the batch of tensors, the (normalized) importance-sampling weights and the indices of the transitions
+        segment = self.tree.total() / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+        probabilities = self.tree.priorities(indices) / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self.batch(indices) + (torch.from_numpy(weights.astype(np.float32)).to(device), indices)
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def save(self, path):
+        state = super().save(path)
+        state.update(tree=self.tree.tree.copy(), beta=self.beta, max_priority=self.max_priority)
+        return state
+
+    def load(self, path, state):
+        super().load(path, state)
+        self.tree.tree[:] = state["tree"]
+        self.beta = state["beta"]
+        self.max_priority = state["max_priority"]
+
+
 class QuentinDQNAgent:
     def __init__(self, size, state_size, action_size, **kwargs):
         self.size = size
         self.state_size = state_size
         self.action_size = action_size
-        self.memory = deque(maxlen=10000)
+        # symmetries of the board applied to the sampled transitions: True for the ones which keep the colors
+        # (for an agent which plays a single color), 'all' to include the ones which swap them
+        self.augment_symmetries = kwargs.get('augment_symmetries', False)
+        symmetries = None
+        if self.augment_symmetries:
+            _, perms, swaps = board_symmetries(size)
+            if self.augment_symmetries != 'all':
+                perms, swaps = perms[~swaps], swaps[~swaps]
+            symmetries = (perms, swaps, np.argsort(perms, axis=1))
+        # prioritized experience replay (sum-tree) instead of the uniform sampling of the transitions
+        self.prioritized_replay = kwargs.get('prioritized_replay', False)
+        if self.prioritized_replay:
+            self.memory = PrioritizedReplayBuffer(kwargs.get('memory_size', 10000), state_size,
+                                                  alpha=kwargs.get('priority_alpha', 0.6),
+                                                  beta=kwargs.get('priority_beta', 0.4),
+                                                  beta_increment=kwargs.get('priority_beta_increment', 0.001),
+                                                  symmetries=symmetries)
+        else:
+            self.memory = ReplayBuffer(kwargs.get('memory_size', 10000), state_size, symmetries)
         self.gamma = kwargs.get('gamma', 0.95)
         self.epsilon = kwargs.get('epsilon', 1.0)
         self.epsilon_max = kwargs.get('epsilon_max', 1.0)
@@ -45,73 +350,253 @@ class QuentinDQNAgent:
         self.epsilon_decay = kwargs.get('epsilon_decay', 0.995)
         self.learning_rate = kwargs.get('learning_rate', 0.02)
         self.tau = kwargs.get('tau', 0.005)
-        self.model = DQN(state_size, action_size, kernel_dim=kwargs.get('kernel_size', 64)).to(device)
-        self.target_model = DQN(state_size, action_size, kernel_dim=kwargs.get('kernel_size', 64)).to(device)
-        self.update_target_model()
+        # target network update: 'soft' (Polyak averaging with tau) or 'hard' (copy of the weights),
+        # once every target_update_period calls of update_target_model
+        self.target_update = kwargs.get('target_update', 'soft')
+        self.target_update_period = kwargs.get('target_update_period', 1)
+        self.target_update_calls = 0
+        # replay the minibatch with one forward/backward pass (False: one optimization step per transition, as before)
+        self.batched_replay = kwargs.get('batched_replay', True)
+        # network: 'mlp' (DQN, with kernel_size units per layer) or 'conv' (ConvDQN, with conv_channels and conv_layers)
+        if kwargs.get('architecture', 'mlp') == 'conv':
+            config = {"architecture": "conv", "channels": kwargs.get('conv_channels', 32), "layers": kwargs.get('conv_layers', 4)}
+        else:
+            config = {"architecture": "mlp", "state_size": state_size, "action_size": action_size,
+                      "kernel_dim": kwargs.get('kernel_size', 64)}
+        self.model = build_model(config).to(device)
+        self.target_model = build_model(config).to(device)
+        self.model_weights = flatten_parameters(self.model)
+        self.target_weights = flatten_parameters(self.target_model)
+        self.target_weights.lerp_(self.model_weights, self.tau)
+        self.encoder = StateEncoder(size)       # buffer of the state of act
         self.optimizer = torch.optim.Adam(self.model.parameters(), lr=self.learning_rate)
         # self.criterion = torch.nn.MSELoss()
         self.criterion = torch.nn.SmoothL1Loss()
+        self.weighted_criterion = torch.nn.SmoothL1Loss(reduction='none')   # scaled by the importance-sampling weights
 
     def update_target_model(self):
-        # self.target_model.load_state_dict(self.model.state_dict())
-        target_model_state_dict = self.target_model.state_dict()
-        model_state_dict = self.model.state_dict()
-        for key in model_state_dict:
-            target_model_state_dict[key] = model_state_dict[key]*self.tau + target_model_state_dict[key]*(1-self.tau)
-        self.target_model.load_state_dict(target_model_state_dict)
+        # in place, on the flattened weights (see flatten_parameters): target = tau*model + (1-tau)*target
+        # with a single lerp, or a copy for the hard update; no tensors are allocated
+        self.target_update_calls += 1
+        if self.target_update_calls % self.target_update_period:
+            return
+        if self.target_update == 'hard':
+            self.target_weights.copy_(self.model_weights)
+        else:
+            self.target_weights.lerp_(self.model_weights, self.tau)
 
     def remember(self, state, action, reward, next_state, done):
-        self.memory.append((state, action, reward, next_state, done))
+        self.memory.append(state, action, reward, next_state, done)
 
-    def act(self, state, unavail):
-        available_actions = list(set(range(self.action_size)) - set(unavail))
-        if not available_actions:
+    def act(self, state, unavail=[], legal_mask=None):
+        # the available actions are the legal ones (e.g.: QuentinGame.legal_actions_mask), if a mask is given,
+        # except the ones in unavail
+        available = np.ones(self.action_size, dtype=bool) if legal_mask is None else np.array(legal_mask, dtype=bool)
+        available[list(unavail)] = False
+        available_actions = np.flatnonzero(available)
+        if not len(available_actions):
             return None
         if np.random.rand() <= self.epsilon:
-            return random.choice(available_actions)
-        act_values = self.model(torch.FloatTensor(state))
-        available_q_values = act_values[available_actions]
-        return available_actions[torch.argmax(available_q_values).item()]
+            return int(random.choice(available_actions))
+        ## the state (flat, as convert_state) is copied into the buffer of the encoder: no tensor is allocated
+        state = self.encoder.encode(state[:-1], state[-1]).to(device)
+        with torch.no_grad():
+            act_values = self.model(state)
+        act_values[torch.from_numpy(~available)] = -float('inf')
+        return torch.argmax(act_values).item()
 
     def epsilon_update(self, episode):
       return self.epsilon_min + (self.epsilon_max - self.epsilon_min) * np.exp(-self.epsilon_decay * episode)
     
-    def replay(self, batch_size):
-        minibatch = random.sample(self.memory, batch_size)
-        for state, action, reward, next_state, done in minibatch:
-            target = reward
+    def replay(self, batch_size, losses=[]):
+        weights = None
+        if self.prioritized_replay:
+            *minibatch, weights, indices = self.memory.sample(batch_size)
+        else:
+            minibatch = self.memory.sample(batch_size)
+        if self.batched_replay:
+            td_errors = self.replay_batch(minibatch, losses, weights)
+        else:
+            td_errors = self.replay_per_sample(minibatch, losses, weights)
+        if self.prioritized_replay:
+            self.memory.update_priorities(indices, td_errors)
+        if self.epsilon > self.epsilon_min:
+            self.epsilon *= self.epsilon_decay
+
+    def replay_batch(self, minibatch, losses=[], weights=None):
+        # TD targets for the whole minibatch with one pass of the target network, 
+        # then a single loss on the Q-values of the actions taken and a single optimization step;
+        # returns the absolute TD errors
+        states, actions, rewards, next_states, dones = minibatch
+        with torch.no_grad():
+            targets = rewards + self.gamma * self.target_model(next_states).max(dim=1).values * (1 - dones)
+        q_values = self.model(states).gather(1, actions.unsqueeze(1)).squeeze(1)
+        if weights is None:
+            loss = self.criterion(q_values, targets)
+        else:
+            loss = (weights * self.weighted_criterion(q_values, targets)).mean()
+        self.optimizer.zero_grad()
+        loss.backward()
+        self.optimizer.step()
+        losses.append(loss.detach())
+        return (targets - q_values.detach()).abs().cpu().numpy()
+
+    def replay_per_sample(self, minibatch, losses=[], weights=None):
+        # the original replay: one optimization step per transition of the minibatch
+        td_errors = []
+        for i, (state, action, reward, next_state, done) in enumerate(zip(*minibatch)):
+            target = reward.item()
             if not done:
-                target += self.gamma * torch.max(self.target_model(torch.FloatTensor(next_state))).item()
-            target_f = self.model(torch.FloatTensor(state))
+                target += self.gamma * torch.max(self.target_model(next_state)).item()
+            target_f = self.model(state)
+            td_errors.append(abs(target - target_f[action].item()))
             target_f[action] = target
             self.optimizer.zero_grad()
-            loss = self.criterion(target_f, self.model(torch.FloatTensor(state)))
+            loss = self.criterion(target_f, self.model(state))
+            if weights is not None:
+                loss = loss * weights[i]
             loss.backward()
             self.optimizer.step()
-        if self.epsilon > self.epsilon_min:
-            self.epsilon *= self.epsilon_decay
+            losses.append(loss.detach())
+        return np.array(td_errors)
+
+    def training_state(self, memory_path):
+        # everything which changes during the training: the networks, the optimizer, epsilon and the replay memory
+        # (its transitions are written to memory_path, see ReplayBuffer.save), to resume the training exactly
+        return {"model": self.model.state_dict(), "target_model": self.target_model.state_dict(),
+                "optimizer": self.optimizer.state_dict(), "epsilon": self.epsilon,
+                "target_update_calls": self.target_update_calls, "memory": self.memory.save(memory_path)}
+
+    def load_training_state(self, state, memory_path):
+        self.model.load_state_dict(state["model"])
+        self.target_model.load_state_dict(state["target_model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        self.epsilon = state["epsilon"]
+        self.target_update_calls = state["target_update_calls"]
+        self.memory.load(memory_path, state["memory"])
+
+    def warm_start(self, model_path):
+        # start from the weights of a saved model (see load_model, e.g.: trained offline with Quentin_Offline.py),
+        # for the network and its target; the architecture must be the same
+        self.model.load_state_dict(load_model(model_path, self.state_size, self.action_size).state_dict())
+        self.target_weights.copy_(self.model_weights)
 
     def save(self, name):
-        torch.save(self.model.state_dict(), name)
+        save_checkpoint(self.model, name, size=self.size, gamma=self.gamma, learning_rate=self.learning_rate,
+                        tau=self.tau, epsilon=self.epsilon, epsilon_min=self.epsilon_min,
+                        epsilon_decay=self.epsilon_decay)
+
 
+def save_checkpoint(model, path, **hyperparameters):
+    """
+    save the weights of a network together with its architecture (model.config) and the training hyperparameters
+    """
+    torch.save({"architecture": model.config, "hyperparameters": hyperparameters, "state_dict": model.state_dict()}, path)
 
-def load_model(model_path, state_size, action_size, kernel_size=128):
-    model = DQN(state_size, action_size, kernel_size)
-    model.load_state_dict(torch.load(model_path))
+
+def load_model(model_path, state_size=None, action_size=None, kernel_size=None):
+    """
+    load a network saved by save_checkpoint, or a state dict of DQN (the format of the older agents, e.g.: 
+    quentin_sz7_ep25__black), whose sizes are read from the weights; the sizes, if given, must match
+    """
+    checkpoint = torch.load(model_path, map_location="cpu")
+    if "architecture" in checkpoint:
+        config = checkpoint["architecture"]
+        state_dict = checkpoint["state_dict"]
+    else:
+        kernel_dim, saved_state_size = checkpoint['layer1.weight'].shape
+        config = {"architecture": "mlp", "state_size": saved_state_size,
+                  "action_size": checkpoint['layer3.weight'].shape[0], "kernel_dim": kernel_dim}
+        state_dict = checkpoint
+    if config["architecture"] == "mlp":
+        for name, value in (("state_size", state_size), ("action_size", action_size), ("kernel_dim", kernel_size)):
+            if value is not None and value != config[name]:
+                raise ValueError(f"{model_path}: {name} of the saved model is {config[name]}, not {value}")
+    model = build_model(config)
+    model.load_state_dict(state_dict)
     model.eval()  # Set the model to evaluation mode
     return model
 
 def convert_state(board, size, player):
-    state = np.zeros((size * size + 1))
-    for i, val in enumerate(board):
-        state[i] = val
-    state[-1] = player
-    return state
-
-def rank_actions(model, state):
-    state_tensor = torch.FloatTensor(state).unsqueeze(0)  # Add batch dimension
-    with torch.no_grad():
-        q_values = model(state_tensor).numpy().flatten()
-    ranked_actions = np.argsort(q_values)[::-1]  # Sort actions by Q-value in descending order
-    q_values = q_values[ranked_actions]
-    return ranked_actions, q_values
\ No newline at end of file
+    # the board and the player in a new float64 array, as before (StateEncoder encodes into a reused float32 buffer)
+    return state_encoder(size).encode(board, player).numpy().astype(np.float64)
+
+
+class StateEncoder:
+    """
+    encodes boards (lists or arrays with -1 empty, 0 black, 1 white) into the rows of a preallocated float32 buffer,
+    which torch sees through torch.from_numpy: the returned tensors share the memory of the buffer, so they are
+    valid until the next encoding of the same rows.
+    Encodings:
+    • 'flat': the board and the player, as convert_state (size*size+1 values, see encode_flat),
+    • 'onehot': for each point, one-hot (empty, black, white), then the player (3*size*size+1 values),
+    • 'planar': black stones, white stones, empty points and player planes (4, size, size), as board_planes.
+    """
+    def __init__(self, size, batch_size=1, encoding='flat'):
+        self.size = size
+        self.encoding = encoding
+        n = size * size
+        if encoding == 'flat':
+            shape = (n + 1,)
+        elif encoding == 'onehot':
+            shape = (3 * n + 1,)
+        elif encoding == 'planar':
+            shape = (4, size, size)
+        else:
+            raise ValueError(f"unknown encoding: {encoding}")
+        self.buffer = np.zeros((batch_size,) + shape, dtype=np.float32)
+        self.tensor = torch.from_numpy(self.buffer)
+        self._points = np.arange(n)
+
+    def encode(self, board, player, row=0):
+        """
+        encode a board in a row of the buffer; returns the tensor of that row
+        """
+        state = self.buffer[row]
+        if self.encoding == 'flat':
+            encode_flat(board, player, state)
+        elif self.encoding == 'onehot':
+            state[:] = 0
+            state[:-1].reshape(-1, 3)[self._points, np.asarray(board, dtype=np.int8) + 1] = 1
+            state[-1] = player
+        else:
+            board = np.asarray(board, dtype=np.int8).reshape(self.size, self.size)
+            np.equal(board, 0, out=state[0])
+            np.equal(board, 1, out=state[1])
+            np.equal(board, -1, out=state[2])
+            state[3] = player
+        return self.tensor[row]
+
+    def encode_batch(self, boards, players):
+        """
+        encode the boards (e.g.: the int8 array of QuentinMultiEnv) in the first rows of the buffer,
+        with the players to move; returns the tensor of those rows
+        """
+        boards = np.asarray(boards)
+        k = len(boards)
+        states = self.buffer[:k]
+        if self.encoding == 'flat':
+            encode_flat(boards, players, states)
+        elif self.encoding == 'onehot':
+            states[:] = 0
+            states[:, :-1].reshape(k, -1, 3)[np.arange(k)[:, None], self._points, boards + 1] = 1
+            states[:, -1] = players
+        else:
+            boards = boards.reshape(k, self.size, self.size)
+            np.equal(boards, 0, out=states[:, 0])
+            np.equal(boards, 1, out=states[:, 1])
+            np.equal(boards, -1, out=states[:, 2])
+            states[:, 3] = np.asarray(players, dtype=np.float32).reshape(-1, 1, 1)
+        return self.tensor[:k]
+
+
+_ENCODERS = {}
+
+
+def state_encoder(size, encoding='flat'):
+    """
+    single-state encoder shared by the callers which pick one move at a time
+    """
+    if (size, encoding) not in _ENCODERS:
+        _ENCODERS[size, encoding] = StateEncoder(size, 1, encoding)
+    return _ENCODERS[size, encoding]
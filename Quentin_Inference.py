@@ -0,0 +1,194 @@
+##Fast inference for the play scripts: a saved model (see load_model) can be exported to TorchScript, optionally with
+## the linear layers dynamically quantized to int8, or to a NumPy archive, whose forward pass runs without importing torch.
+## Usage: python Quentin_Inference.py quentin_sz7_ep25__black --format numpy (writes quentin_sz7_ep25__black.npz)
+
+import argparse
+import json
+import math
+import warnings
+import numpy as np
+
+EXTENSIONS = {"torchscript": ".pt", "quantized": ".int8.pt", "numpy": ".npz"}
+
+
+def _planes(states):
+    """
+    flat states (batch, size*size+1) as the planes of ConvDQN: black, white, empty and player to move (as board_planes)
+    """
+    size = math.isqrt(states.shape[1] - 1)
+    boards = states[:, :-1].reshape(-1, size, size)
+    player = np.broadcast_to(states[:, -1].reshape(-1, 1, 1), boards.shape)
+    return np.stack([boards == 0, boards == 1, boards == -1, player], axis=1).astype(np.float32)
+
+
+class NumpyDQN:
+    """
+    forward pass of a DQN or a ConvDQN with NumPy (float32), with the weights of an archive written by
+    export_model(..., format='numpy'); it takes and returns arrays, one state or a batch of them, as the torch models
+    """
+    def __init__(self, config, weights):
+        self.config = config
+        self.weights = {name: np.asarray(value, dtype=np.float32) for name, value in weights.items()}
+        if config["architecture"] == "mlp":
+            self.layers = [(self.weights[f"layer{i}.weight"].T.copy(), self.weights[f"layer{i}.bias"]) for i in (1, 2, 3)]
+        elif config["architecture"] == "conv":
+            ## the 3x3 kernels as matrices (9*channels in, channels out), to multiply the 3x3 patches of the planes
+            self.layers = [(self.weights[f"convs.{i}.weight"].transpose(2, 3, 1, 0).reshape(-1, self.weights[f"convs.{i}.weight"].shape[0]),
+                            self.weights[f"convs.{i}.bias"]) for i in range(config["layers"])]
+            self.head = (self.weights["head.weight"].reshape(1, -1).T.copy(), self.weights["head.bias"])
+        else:
+            raise ValueError(f"unknown architecture: {config['architecture']}")
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as archive:
+            config = json.loads(str(archive["config"]))
+            weights = {name: archive[name] for name in archive.files if name != "config"}
+        return cls(config, weights)
+
+    def __call__(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        if self.config["architecture"] == "mlp":
+            single = x.ndim == 1
+            x = x.reshape(-1, x.shape[-1])
+            for i, (weight, bias) in enumerate(self.layers):
+                x = x @ weight + bias
+                if i < 2:
+                    np.maximum(x, 0, out=x)
+            return x[0] if single else x
+        single = x.ndim in (1, 3)
+        if x.ndim <= 2:
+            x = _planes(x.reshape(-1, x.shape[-1]))
+        elif x.ndim == 3:
+            x = x[None]
+        batch, _, rows, cols = x.shape
+        for weight, bias in self.layers:
+            padded = np.pad(x.transpose(0, 2, 3, 1), ((0, 0), (1, 1), (1, 1), (0, 0)))
+            patches = np.concatenate([padded[:, i:i + rows, j:j + cols] for i in range(3) for j in range(3)], axis=3)
+            x = np.maximum(patches @ weight + bias, 0).transpose(0, 3, 1, 2)
+        weight, bias = self.head
+        q_values = (x.transpose(0, 2, 3, 1) @ weight + bias).reshape(batch, rows * cols)
+        return q_values[0] if single else q_values
+
+
+def export_model(model_path, output_path=None, format="torchscript", size=None):
+    """
+    export a model saved by save_checkpoint (or an older state dict of DQN) for inference:
+    • 'torchscript': traced TorchScript module, which loads without the classes of Quentin_DQN,
+    • 'quantized': the same, with the linear layers dynamically quantized to int8 (the convolutions stay float32),
+    • 'numpy': the weights and the architecture in a .npz archive, for NumpyDQN.
+    The traced modules of ConvDQN work for one board size only (size), and take batches of states.
+    Returns the path of the exported model (by default, the model path with the extension of the format)
+    """
+    import torch
+    from Quentin_DQN import load_model
+
+    model = load_model(model_path)
+    config = model.config
+    output_path = output_path or model_path + EXTENSIONS[format]
+    if format == "numpy":
+        with open(output_path, "wb") as f:
+            np.savez(f, config=json.dumps(config),
+                     **{name: value.numpy() for name, value in model.state_dict().items()})
+        return output_path
+    if format not in ("torchscript", "quantized"):
+        raise ValueError(f"unknown format: {format}")
+    if config["architecture"] == "mlp":
+        example = torch.zeros(1, config["state_size"])
+    elif size is None:
+        raise ValueError("the size of the board is needed to trace a convolutional model")
+    else:
+        example = torch.zeros(1, size * size + 1)
+    if format == "quantized":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore", FutureWarning)      # torch.jit is deprecated in the latest versions of torch
+        traced = torch.jit.trace(model, example)
+        torch.jit.save(traced, output_path, _extra_files={"config.json": json.dumps(config)})
+    return output_path
+
+
+def load_inference_model(model_path, state_size=None, action_size=None):
+    """
+    load a model for the play scripts by the extension of its path: .npz as a NumpyDQN (torch is not imported),
+    .pt as a TorchScript module (see export_model), any other path with load_model; the sizes, if given, must match
+    """
+    if model_path.endswith(".npz"):
+        model = NumpyDQN.load(model_path)
+    elif model_path.endswith(".pt"):
+        import torch
+        extra_files = {"config.json": ""}
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", FutureWarning)
+            model = torch.jit.load(model_path, map_location="cpu", _extra_files=extra_files)
+        model.config = json.loads(extra_files["config.json"])
+    else:
+        from Quentin_DQN import load_model
+        return load_model(model_path, state_size, action_size)
+    if model.config["architecture"] == "mlp":
+        for name, value in (("state_size", state_size), ("action_size", action_size)):
+            if value is not None and value != model.config[name]:
+                raise ValueError(f"{model_path}: {name} of the saved model is {model.config[name]}, not {value}")
+    return model
+
+
+def q_values(model, states):
+    """
+    Q-values (as an array) of a batch of states with a NumpyDQN or a torch module (eager or TorchScript)
+    """
+    if isinstance(model, NumpyDQN):
+        return model(states)
+    import torch
+    with torch.no_grad():
+        return model(torch.as_tensor(states, dtype=torch.float32)).numpy()
+
+
+def rank_actions(model, state, legal_mask=None):
+    q = q_values(model, np.asarray(state, dtype=np.float32).reshape(1, -1))[0]  # batch of one state
+    ranked_actions = np.argsort(q)[::-1]  # Sort actions by Q-value in descending order
+    if legal_mask is not None:
+        ranked_actions = ranked_actions[np.asarray(legal_mask)[ranked_actions]]  # Keep only the legal actions
+    return ranked_actions, q[ranked_actions]
+
+
+def encode_flat(boards, players, out):
+    """
+    the flat encoding of convert_state, written in out: the board, then the player. One state (out of size*size+1
+    values) or a batch of them (one row per board); shared by encode_state and StateEncoder, it needs no torch
+    """
+    out[..., :-1] = boards
+    out[..., -1] = players
+    return out
+
+
+_STATES = {}
+
+
+def encode_state(board, player):
+    """
+    the board and the player (as convert_state) in a float32 array reused for each size: valid until the next call
+    """
+    n = len(board)
+    if n not in _STATES:
+        _STATES[n] = np.empty(n + 1, dtype=np.float32)
+    return encode_flat(board, player, _STATES[n])
+
+
+def next_move(game, model, is_black):
+    # best legal action for the player according to a fixed policy (None if the player has no legal moves)
+    state = encode_state(game.board, not is_black)
+    ranked_actions, q = rank_actions(model, state, game.legal_actions_mask(is_black))
+    return int(ranked_actions[0]) if len(ranked_actions) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="export a saved agent for fast inference")
+    parser.add_argument("model", help="path of the saved agent (see load_model)")
+    parser.add_argument("--format", choices=list(EXTENSIONS), default="torchscript")
+    parser.add_argument("--output", help="path of the exported model (default: the model path with the extension of the format)")
+    parser.add_argument("--size", type=int, help="board size (needed to trace a convolutional model)")
+    args = parser.parse_args()
+    print(export_model(args.model, args.output, args.format, args.size))
+
+if __name__ == "__main__":
+    main()
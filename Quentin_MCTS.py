@@ -0,0 +1,203 @@
+##Monte Carlo Tree Search player guided by a DQN: the Q-values of the network give the priors of the moves
+## (softmax) and the evaluation of the leaves (best Q-value); the leaves are evaluated in batches, each one by the
+## network of its player to move. Any model of load_inference_model works (with a .npz model torch is not imported).
+
+import math
+import time
+import numpy as np
+from Quentin import QuentinBitboard
+from Quentin_Inference import encode_flat, load_inference_model, q_values
+
+
+class Node:
+    """
+    a position of the search tree, with the player to move; the statistics of its moves (legal actions)
+    are stored in arrays: prior, visit count and total value (for the player to move)
+    """
+    __slots__ = ("game", "is_black", "terminal", "actions", "priors", "visits", "values", "children", "pending")
+
+    def __init__(self, game, is_black, terminal=None):
+        self.game = game
+        self.is_black = is_black
+        self.terminal = terminal        # value of a finished game for the player to move (-1 lost, 0 draw)
+        self.actions = None             # legal moves, set when the node is expanded
+        self.children = {}
+        self.pending = False            # waiting for the evaluation of the network
+
+    def expand(self, actions, priors):
+        self.actions = actions
+        self.priors = priors
+        self.visits = np.zeros(len(actions))
+        self.values = np.zeros(len(actions))
+
+    def select(self, c_puct):
+        """
+        index of the move with the highest PUCT score (unvisited moves have a neutral value)
+        """
+        q = np.divide(self.values, self.visits, out=np.zeros(len(self.actions)), where=self.visits > 0)
+        u = c_puct * self.priors * math.sqrt(self.visits.sum() + 1) / (1 + self.visits)
+        return int(np.argmax(q + u))
+
+    def child(self, i):
+        if i not in self.children:
+            game = QuentinBitboard(self.game.size)
+            game.board = self.game.board[:]
+            game.update_board(self.is_black, int(self.actions[i]), [])
+            ## if the move wins, the player to move in the new position has lost
+            self.children[i] = Node(game, not self.is_black, -1.0 if game.gameover() != -1 else None)
+        return self.children[i]
+
+
+class MCTSPlayer:
+    """
+    picks the moves with a search of simulations (or time) budget per move:
+    • model: network of the player, opponent_model: network of the other color, which evaluates the positions where
+      the opponent moves (the agents learn a single color); None: model for both colors, if it has learnt both.
+      A network is a model of load_inference_model or its path,
+    • simulations: number of simulations per move; time_budget: seconds per move (the search stops at the first limit;
+      None: no limit of that kind, but at least one is needed),
+    • batch_size: leaves collected (with virtual loss on their paths) before each forward pass of the model,
+    • c_puct: exploration constant, temperature: of the softmax of the Q-values which gives the priors,
+    • value_scale: Q-values are divided by it to get the values of the leaves in [-1, 1] (the rewards are +-100).
+    The subtree of the position reached after the move is kept, and reused at the next move of the player
+    """
+    def __init__(self, model, opponent_model=None, simulations=200, time_budget=None, batch_size=8, c_puct=1.5,
+                 temperature=10.0, value_scale=100.0, virtual_loss=1.0):
+        if simulations is None and time_budget is None:
+            raise ValueError("the search needs a budget: simulations, time_budget or both")
+        self.model = load_inference_model(model) if isinstance(model, str) else model
+        if opponent_model is None:
+            self.opponent_model = self.model
+        else:
+            self.opponent_model = load_inference_model(opponent_model) if isinstance(opponent_model, str) else opponent_model
+        self.simulations = simulations
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.c_puct = c_puct
+        self.temperature = temperature
+        self.value_scale = value_scale
+        self.virtual_loss = virtual_loss
+        self.root = None
+        self.is_black = None        # color of the player, set by select_move
+        self.states = None      # buffer of the encoded leaves (see encode_flat)
+        self.last_search = {}
+
+    def evaluate(self, leaves):
+        """
+        expand the leaves with one forward pass of the network of each player to move; returns their values
+        (for the player to move)
+        """
+        masks = [leaf.game.legal_actions_mask(leaf.is_black) for leaf in leaves]
+        for k, leaf in enumerate(leaves):
+            encode_flat(leaf.game.board, 0 if leaf.is_black else 1, self.states[k])
+        own = np.array([leaf.is_black == self.is_black for leaf in leaves])
+        leaf_q = np.empty((len(leaves), self.states.shape[1] - 1), dtype=np.float32)
+        for model, rows in ((self.model, own), (self.opponent_model, ~own)):
+            if rows.any():
+                leaf_q[rows] = q_values(model, self.states[:len(leaves)][rows])
+        values = []
+        for leaf, mask, q in zip(leaves, masks, leaf_q):
+            leaf.pending = False
+            actions = np.flatnonzero(mask)
+            if not len(actions):
+                ## no moves available: it's a draw
+                leaf.terminal = 0.0
+                values.append(0.0)
+                continue
+            logits = q[actions] / self.temperature
+            priors = np.exp(logits - logits.max())
+            leaf.expand(actions, priors / priors.sum())
+            values.append(float(np.clip(q[actions].max() / self.value_scale, -1, 1)))
+        return values
+
+    def backup(self, path, value):
+        # the value is for the player to move at the end of the path: it changes sign at each level.
+        # The visits were already counted with the virtual loss, which is removed from the values
+        for node, i in reversed(path):
+            value = -value
+            node.values[i] += value + self.virtual_loss
+
+    def search(self, root):
+        start = time.perf_counter()
+        deadline = None if self.time_budget is None else start + self.time_budget
+        simulations = 0
+        forward_passes = 0
+        if root.actions is None and root.terminal is None:
+            self.evaluate([root])
+            forward_passes += 1
+        while (root.terminal is None and (self.simulations is None or simulations < self.simulations)
+               and (deadline is None or time.perf_counter() < deadline)):
+            leaves, paths = [], []
+            batch_size = self.batch_size if self.simulations is None else min(self.batch_size, self.simulations - simulations)
+            for _ in range(batch_size):
+                node, path = root, []
+                while node.actions is not None and node.terminal is None:
+                    i = node.select(self.c_puct)
+                    ## virtual loss: the next simulations of the batch are steered away from this path
+                    node.visits[i] += 1
+                    node.values[i] -= self.virtual_loss
+                    path.append((node, i))
+                    node = node.child(i)
+                simulations += 1
+                if node.terminal is not None:
+                    self.backup(path, node.terminal)
+                elif node.pending:
+                    ## the leaf is already in the batch: revert the virtual loss and evaluate the batch
+                    for n, i in path:
+                        n.visits[i] -= 1
+                        n.values[i] += self.virtual_loss
+                    simulations -= 1
+                    break
+                else:
+                    node.pending = True
+                    leaves.append(node)
+                    paths.append(path)
+            if leaves:
+                for path, value in zip(paths, self.evaluate(leaves)):
+                    self.backup(path, value)
+                forward_passes += 1
+        self.last_search = {"simulations": simulations, "forward_passes": forward_passes,
+                            "seconds": time.perf_counter() - start}
+
+    def find_root(self, board, is_black):
+        """
+        the node of the position in the kept subtree (after the opponent's move), if any
+        """
+        if self.root is None:
+            return None
+        candidates = [self.root] + list(self.root.children.values())
+        for node in candidates:
+            if node.is_black == is_black and node.game.board == board:
+                return node
+        return None
+
+    def select_move(self, board, is_black, unavail=()):
+        """
+        best move for the player in the position of the board (the most visited move at the root),
+        excluding the moves in unavail; None if the player has no legal moves
+        """
+        size = math.isqrt(len(board))
+        if self.states is None or self.states.shape[1] != size * size + 1:
+            self.states = np.empty((self.batch_size, size * size + 1), dtype=np.float32)
+        if self.is_black != is_black:
+            self.root = None        # the kept subtree was evaluated for the other color
+        self.is_black = is_black
+        root = None if unavail else self.find_root(list(board), is_black)
+        if root is None:
+            game = QuentinBitboard(size)
+            game.board = list(board)
+            root = Node(game, is_black)
+            if unavail:
+                self.evaluate([root])
+                if root.actions is not None:
+                    keep = ~np.isin(root.actions, list(unavail))
+                    priors = root.priors[keep]
+                    root.expand(root.actions[keep], priors / max(priors.sum(), 1e-12))
+        if root.actions is not None and not len(root.actions):
+            return None
+        self.search(root)
+        if root.actions is None:
+            return None
+        best = int(np.argmax(root.visits))
+        self.root = root.child(best)
+        return int(root.actions[best])
@@ -0,0 +1,80 @@
+##Instrumentation of the training loops: per-phase timers and counters, written as JSON lines (one record every
+## few episodes), cheap enough to be always on. With tags, each phase runs inside a function named after it
+## (phase_<name>), so that the phases can be told apart in the output of cProfile or py-spy.
+
+import json
+import sys
+import time
+from collections import defaultdict
+
+
+def _tagged(name):
+    """
+    a function which calls function(*args) and whose code object is named phase_<name>
+    """
+    def phase(function, args):
+        return function(*args)
+    names = {"co_name": "phase_" + name}
+    if sys.version_info >= (3, 11):
+        names["co_qualname"] = "phase_" + name
+    phase.__code__ = phase.__code__.replace(**names)
+    phase.__name__ = phase.__qualname__ = "phase_" + name
+    return phase
+
+
+class Metrics:
+    """
+    timers of the phases of a run (time, calls) and counters of events, accumulated between two records:
+    • time(name, function, *args): calls function(*args), and adds its duration to the phase name,
+    • count(name, n): adds n to the counter name,
+    • emit(episode, **fields): writes a record (JSON line) with the rates and the phases of the last interval,
+      and the given fields; then the timers and the counters start again from zero.
+    Without a path the records are not written (emit still returns them)
+    """
+    def __init__(self, path=None, tags=False):
+        self.file = open(path, "a") if path else None
+        self.tags = tags
+        self._phases = {}
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.start = self.last = time.perf_counter()
+
+    def time(self, name, function, *args):
+        start = time.perf_counter()
+        if self.tags:
+            if name not in self._phases:
+                self._phases[name] = _tagged(name)
+            result = self._phases[name](function, args)
+        else:
+            result = function(*args)
+        self.seconds[name] += time.perf_counter() - start
+        self.calls[name] += 1
+        return result
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def emit(self, episode, **fields):
+        now = time.perf_counter()
+        interval = now - self.last
+        record = {"episode": episode, "elapsed": now - self.start, "interval": interval}
+        for name, value in self.counters.items():
+            record[name] = value
+            record[name + "_per_second"] = value / interval
+        record.update(fields)
+        record["phases"] = {name: {"seconds": seconds, "calls": self.calls[name], "share": seconds / interval}
+                            for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])}
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+        self.last = now
+        return record
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,100 @@
+##Synchronous multi-game environment: N games of Quentin stepped together, so that a single forward pass of an agent
+## can pick the actions for all of them. The games are still stepped one after the other (a Python loop over the
+## games in step), only the states, the rewards and the masks are exchanged as arrays.
+
+import numpy as np
+from Quentin import QuentinGame
+
+
+class QuentinMultiEnv:
+    """
+    N independent games, whose boards are stored in a single array of shape (N, size*size)
+    (-1 empty, 0 black, 1 white). In each game the players alternate as in the training loops:
+    black moves first, an illegal move is rejected (and penalized) and the same player has to move again.
+    """
+    def __init__(self, size, num_envs, game_class=QuentinGame, auto_reset=True, **kwargs):
+        self.size = size
+        self.num_envs = num_envs
+        self.state_size = size * size + 1
+        self.action_size = size * size
+        self.game_class = game_class
+        self.auto_reset = auto_reset
+        ## Rewards (for the player who moved)
+        self.win_reward = kwargs.get('win_reward', 100)
+        self.lose_reward = kwargs.get('lose_reward', -100)
+        self.illegal_reward = kwargs.get('illegal_reward', -1)
+        self.draw_reward = kwargs.get('draw_reward', 0)
+        ## TranspositionCache shared by all the games (optional)
+        self.cache = kwargs.get('cache')
+        self.games = [game_class(size, self.cache) for _ in range(num_envs)]
+        self.boards = np.full((num_envs, self.action_size), -1, dtype=np.int8)
+        self.players = np.zeros(num_envs, dtype=np.int8)     # player to move in each game: 0 black, 1 white
+        self.unavail = [[] for _ in range(num_envs)]        # moves rejected in the current turn of each game
+
+    def reset(self, env_ids=None):
+        """
+        start new games (all of them, or the ones in env_ids); returns the states and the legal-action masks
+        """
+        env_ids = range(self.num_envs) if env_ids is None else env_ids
+        for i in env_ids:
+            self.games[i] = self.game_class(self.size, self.cache)
+            self.boards[i] = -1
+            self.players[i] = 0
+            self.unavail[i] = []
+        return self.states(), self.legal_masks()
+
+    def states(self):
+        """
+        the states of all the games, in the format of convert_state: the board and the player to move
+        """
+        states = np.empty((self.num_envs, self.state_size), dtype=np.float32)
+        states[:, :-1] = self.boards
+        states[:, -1] = self.players
+        return states
+
+    def legal_masks(self):
+        """
+        boolean array of shape (N, size*size): the legal moves of the player to move in each game
+        (see QuentinGame.legal_actions_mask), except the ones already rejected in the current turn
+        """
+        masks = np.stack([game.legal_actions_mask(player == 0) for game, player in zip(self.games, self.players)])
+        for i, unavail in enumerate(self.unavail):
+            if unavail:
+                masks[i, unavail] = False
+        return masks
+
+    def step(self, actions):
+        """
+        apply one action (a location of the board) in each game, for the player to move (one game after the other).
+        Returns the new states, the rewards of the players who moved, the done flags, the legal-action masks
+        and a dictionary with the outcome of each game (-1 not over, 0 black won, 1 white won, 2 draw),
+        whether each move was accepted and, if auto_reset is set, the final states of the games which ended
+        (whose boards are replaced by new games in the returned states)
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        accepted = np.zeros(self.num_envs, dtype=bool)
+        outcomes = np.full(self.num_envs, -1, dtype=np.int8)
+        for i, game in enumerate(self.games):
+            player = self.players[i]
+            if not game.update_board(player == 0, int(actions[i]), self.unavail[i]):
+                rewards[i] = self.illegal_reward
+            else:
+                accepted[i] = True
+                self.boards[i] = game.board
+                self.unavail[i] = []
+                self.players[i] = 1 - player
+                outcomes[i] = game.gameover()
+                if outcomes[i] != -1:
+                    rewards[i] = self.win_reward if outcomes[i] == player else self.lose_reward
+        ## if the player to move has no available actions, it's a draw
+        stuck = ~self.legal_masks().any(axis=1) & (outcomes == -1)
+        outcomes[stuck] = 2
+        rewards[stuck & accepted] = self.draw_reward
+        dones[:] = outcomes != -1
+        info = {"outcomes": outcomes, "accepted": accepted}
+        if self.auto_reset and dones.any():
+            info["final_states"] = self.states()[dones]
+            self.reset(np.flatnonzero(dones))
+        return self.states(), rewards, dones, self.legal_masks(), info
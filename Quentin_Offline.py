@@ -0,0 +1,189 @@
+##Offline training: an agent learns from recorded games (see Quentin_Records), streamed by a loader of worker
+## processes which prefetch and shuffle the transitions, with the batched replay of QuentinDQNAgent and no games played.
+## The saved agent can be the starting point of an online run (see the warm_start option of Quentin_Train.train).
+## Usage: python Quentin_Offline.py games.qrec --player black --steps 20000 --output quentin_sz7_offline__black
+
+import argparse
+import os
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+from Quentin_DQN import QuentinDQNAgent, device
+from Quentin_Metrics import Metrics
+from Quentin_Records import RecordReader
+
+
+class TransitionDataset(IterableDataset):
+    """
+    one pass over the transitions of the players (True for black) in record files, as batches of tensors ready for
+    QuentinDQNAgent.replay_batch. The chunks of the files are shared among the workers of the loader; each worker
+    reads its chunks in random order and passes their transitions through a shuffle buffer of shuffle_buffer
+    transitions (kept as int8), from which the batches are drawn at random. Set epoch to change the order of a pass.
+    The other options are the rewards of RecordReader.transitions
+    """
+    def __init__(self, paths, batch_size=256, players=(True, False), shuffle_buffer=65536, seed=0, **kwargs):
+        self.paths = list(paths)
+        self.batch_size = batch_size
+        self.players = players
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
+        self.rewards = kwargs
+        readers = [RecordReader(path) for path in self.paths]
+        sizes = {reader.size for reader in readers}
+        if len(sizes) != 1:
+            raise ValueError(f"the record files have different board sizes: {sorted(sizes)}")
+        self.size = sizes.pop()
+        self.chunks = [(i, c) for i, reader in enumerate(readers) for c in range(len(reader.chunks))]
+
+    def __iter__(self):
+        info = get_worker_info()
+        worker, workers = (0, 1) if info is None else (info.id, info.num_workers)
+        rng = np.random.default_rng([self.seed, self.epoch, worker])
+        readers = [RecordReader(path) for path in self.paths]       # memory-mapped in each worker
+        mine = self.chunks[worker::workers]
+        state_size = self.size * self.size + 1
+        threshold = max(self.shuffle_buffer, self.batch_size)
+        capacity = threshold + self.batch_size
+        pool = (np.empty((capacity, state_size), np.int8), np.empty(capacity, np.int64), np.empty(capacity, np.float32),
+                np.empty((capacity, state_size), np.int8), np.empty(capacity, bool))
+        count = 0
+        for i in rng.permutation(len(mine)):
+            path_index, chunk = mine[i]
+            for batch in readers[path_index].transitions(self.batch_size, self.players, shuffle=True,
+                                                          seed=rng.integers(2**32), chunks=[chunk], dtype=np.int8,
+                                                          **self.rewards):
+                n = len(batch[1])
+                for array, values in zip(pool, batch):
+                    array[count:count + n] = values
+                count += n
+                while count >= threshold:
+                    yield self._draw(pool, count, rng)
+                    count -= self.batch_size
+        ## the end of the pass: the rest of the buffer, in random order
+        order = rng.permutation(count)
+        for start in range(0, count, self.batch_size):
+            idx = order[start:start + self.batch_size]
+            yield self._tensors(tuple(array[idx] for array in pool))
+
+    def _draw(self, pool, count, rng):
+        """
+        a random batch out of the first count transitions of the buffer: the last ones take the places left
+        """
+        idx = rng.choice(count, self.batch_size, replace=False)
+        batch = tuple(array[idx] for array in pool)
+        drawn = np.zeros(count, dtype=bool)
+        drawn[idx] = True
+        tail = np.arange(count - self.batch_size, count)
+        holes = idx[idx < count - self.batch_size]
+        movers = tail[~drawn[tail]]
+        for array in pool:
+            array[holes] = array[movers]
+        return self._tensors(batch)
+
+    @staticmethod
+    def _tensors(batch):
+        states, actions, rewards, next_states, dones = batch
+        return (torch.from_numpy(states.astype(np.float32)), torch.from_numpy(actions), torch.from_numpy(rewards),
+                torch.from_numpy(next_states.astype(np.float32)), torch.from_numpy(dones.astype(np.float32)))
+
+
+def train_offline(paths, steps=10000, batch_size=256, players=(True, False), **kwargs):
+    """
+    train a QuentinDQNAgent on the transitions of record files (see TransitionDataset) for steps replays
+    (passes over the records are repeated as needed), with workers processes loading prefetch batches each
+    (workers=0: in the training process; by default up to 2, leaving a CPU to the learner). The target network is updated (update_target_model) every target_every
+    replays. With output, the agent is saved there (see QuentinDQNAgent.save) every save_every replays and at
+    the end; a metrics record (see Metrics: replay and loading times, samples per second) is written to metrics_path
+    every log_every replays. Other options: the rewards of the records, seed and the QuentinDQNAgent hyperparameters.
+    Returns the agent and its losses
+    """
+    workers = kwargs.get('workers', min(2, os.cpu_count() - 1))     # a CPU is left to the learner
+    prefetch = kwargs.get('prefetch', 4)
+    target_every = kwargs.get('target_every', 1)
+    output = kwargs.get('output')
+    save_every = kwargs.get('save_every', 5000)
+    log_every = kwargs.get('log_every', 1000)
+    seed = kwargs.get('seed', 0)
+    reward_keys = ('win_reward', 'lose_reward', 'illegal_reward', 'draw_rewards')
+    dataset = TransitionDataset(paths, batch_size, players, kwargs.get('shuffle_buffer', 65536), seed,
+                                **{key: kwargs[key] for key in reward_keys if key in kwargs})
+    torch.manual_seed(seed)
+    agent_kwargs = {key: value for key, value in kwargs.items()
+                    if key not in reward_keys + ('workers', 'prefetch', 'target_every', 'output', 'save_every',
+                                                 'log_every', 'seed', 'shuffle_buffer', 'metrics_path')}
+    size = dataset.size
+    agent = QuentinDQNAgent(size, size * size + 1, size * size, **agent_kwargs)
+    metrics = Metrics(kwargs.get('metrics_path'))
+    loader_kwargs = {"prefetch_factor": prefetch, "persistent_workers": False} if workers else {}
+    loader = DataLoader(dataset, batch_size=None, num_workers=workers, **loader_kwargs)
+    losses = []
+    step = 0
+    while step < steps:
+        batches = iter(loader)      # a pass over the records
+        while step < steps:
+            batch = metrics.time("load", next, batches, None)
+            if batch is None:
+                break
+            batch = tuple(tensor.to(device) for tensor in batch)
+            metrics.time("replay", agent.replay_batch, batch, losses)
+            metrics.count("samples", len(batch[1]))
+            step += 1
+            if step % target_every == 0:
+                agent.update_target_model()
+            if output and (step % save_every == 0 or step == steps):
+                _save_atomic(agent, output)
+            if step % log_every == 0 or step == steps:
+                replay = metrics.seconds["replay"]
+                metrics.emit(step, epoch=dataset.epoch, loss=float(torch.stack(losses[-log_every:]).mean()),
+                             learner_samples_per_second=metrics.counters["samples"] / replay if replay else None)
+        if step == 0:
+            raise ValueError("the record files have no transitions of the players")
+        dataset.epoch += 1
+    metrics.close()
+    return agent, losses
+
+
+def _save_atomic(agent, path):
+    # written to a temporary file, then renamed: an interruption leaves the previous save usable
+    agent.save(path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="train an agent offline, on recorded games (see Quentin_Records.py)")
+    parser.add_argument("records", nargs="+", help="record files (of the same board size)")
+    parser.add_argument("--player", choices=["black", "white", "both"], default="black",
+                        help="the transitions of which player are learned")
+    parser.add_argument("--output", required=True, help="path of the saved agent (see load_model)")
+    parser.add_argument("--steps", type=int, default=10000, help="replays (minibatches)")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=min(2, os.cpu_count() - 1),
+                        help="loader processes (0: load in the training process)")
+    parser.add_argument("--prefetch", type=int, default=4, help="batches prefetched by each worker")
+    parser.add_argument("--shuffle-buffer", type=int, default=65536, help="transitions of the shuffle buffer of each worker")
+    parser.add_argument("--target-every", type=int, default=1, help="replays between two target network updates")
+    parser.add_argument("--save-every", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--learning-rate", type=float, default=0.02)
+    parser.add_argument("--gamma", type=float, default=0.95)
+    parser.add_argument("--tau", type=float, default=0.005)
+    parser.add_argument("--architecture", choices=["mlp", "conv"], default="mlp")
+    parser.add_argument("--kernel-size", type=int, default=64)
+    parser.add_argument("--target-update", choices=["soft", "hard"], default="soft")
+    parser.add_argument("--target-update-period", type=int, default=1)
+    parser.add_argument("--metrics", help="JSON lines file of the metrics")
+    parser.add_argument("--log-every", type=int, default=1000, help="replays between two records of the metrics")
+    args = parser.parse_args()
+    players = {"black": (True,), "white": (False,), "both": (True, False)}[args.player]
+    agent, losses = train_offline(args.records, args.steps, args.batch_size, players, workers=args.workers,
+                                  prefetch=args.prefetch, shuffle_buffer=args.shuffle_buffer,
+                                  target_every=args.target_every, output=args.output, save_every=args.save_every,
+                                  seed=args.seed, learning_rate=args.learning_rate, gamma=args.gamma, tau=args.tau,
+                                  architecture=args.architecture, kernel_size=args.kernel_size,
+                                  target_update=args.target_update, target_update_period=args.target_update_period,
+                                  metrics_path=args.metrics, log_every=args.log_every)
+    print(f"{len(losses)} replays, mean loss of the last 100: {float(torch.stack(losses[-100:]).mean()):.4f}")
+
+if __name__ == "__main__":
+    main()
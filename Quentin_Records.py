@@ -0,0 +1,257 @@
+##Game records: a compact binary file of the games (every attempted move, with the stones it placed), written while
+## playing by a recorder attached to the games, and read back memory-mapped, chunk by chunk, as batches of transitions
+## for offline training and analysis.
+## Usage: writer = RecordWriter("games.qrec", 7); game = writer.record(QuentinBitboard(7)); ...; writer.end_game(game)
+## (the records of the training loop are checked against its transitions by: python Quentin_Checks.py records)
+
+import os
+import numpy as np
+
+## File: a header, then chunks of finished games, appended one after the other; each chunk is its header, the games
+## (attempts, winner: 0 black, 1 white, 2 draw), the attempts of the games (location, flags, number of black and
+## white stones placed) and the stones placed by the legal attempts (locations: the black ones, then the white ones)
+HEADER = np.dtype([("magic", "S4"), ("version", "<u2"), ("size", "<u2")])
+CHUNK = np.dtype([("magic", "S4"), ("games", "<u4"), ("attempts", "<u4"), ("stones", "<u4")])
+GAME = np.dtype([("attempts", "<u4"), ("winner", "i1")])
+ATTEMPT = np.dtype([("location", "u1"), ("flags", "u1"), ("black", "u1"), ("white", "u1")])
+BLACK, LEGAL = 1, 2     # flags of the attempts
+VERSION = 1
+
+
+def _points(mask):
+    points = []
+    while mask:
+        low = mask & -mask
+        points.append(low.bit_length() - 1)
+        mask ^= low
+    return points
+
+
+def _chunk_length(chunk):
+    return (CHUNK.itemsize + int(chunk["games"]) * GAME.itemsize + int(chunk["attempts"]) * ATTEMPT.itemsize
+            + int(chunk["stones"]))
+
+
+def _complete_length(f):
+    """
+    length of the header and of the complete chunks of a file (a chunk can be incomplete if the writer was interrupted)
+    """
+    total = os.fstat(f.fileno()).st_size
+    offset = HEADER.itemsize
+    while offset + CHUNK.itemsize <= total:
+        f.seek(offset)
+        chunk = np.frombuffer(f.read(CHUNK.itemsize), CHUNK)[0]
+        if chunk["magic"] != b"QCHK" or offset + _chunk_length(chunk) > total:
+            break
+        offset += _chunk_length(chunk)
+    return offset
+
+
+class RecordWriter:
+    """
+    appends the games of one board size to a record file (created if it does not exist). A game is recorded from
+    record(game) to end_game(game): every call of its update_board (see QuentinGame.update_board) adds the attempt,
+    with the stones of the legal ones (the move and the filled territories); many games can be recorded at once.
+    The finished games are written in chunks of chunk_games (and by flush and close); the games not ended are not
+    written. An existing file is truncated to its last complete chunk, or to truncate bytes (see flush)
+    """
+    def __init__(self, path, size, chunk_games=1024, truncate=None):
+        if size * size > 255:
+            raise ValueError(f"the records store the points in bytes: the board size must be at most 15, not {size}")
+        self.size = size
+        self.chunk_games = chunk_games
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, "r+b" if exists else "w+b")
+        if exists:
+            header = np.frombuffer(self.file.read(HEADER.itemsize), HEADER)[0]
+            if header["magic"] != b"QREC" or header["size"] != size:
+                raise ValueError(f"{path} is not a record file of the size {size}")
+            end = _complete_length(self.file) if truncate is None else truncate
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file.write(np.array((b"QREC", VERSION, size), HEADER).tobytes())
+        self.open_games = {}        # id of a recorded game: the game, its attempts and its stones
+        self.games, self.attempts, self.stones = [], [], []     # finished games, not yet written
+
+    def record(self, game):
+        if game.size != self.size:
+            raise ValueError(f"the records are of the size {self.size}, not {game.size}")
+        game.recorder = self
+        self.open_games[id(game)] = (game, [], [])
+        return game
+
+    def attempt(self, game, is_black, move, legal):
+        # called by update_board; the moves out of the board are not actions, so they are not recorded
+        if not 0 <= move < self.size * self.size:
+            return
+        _, attempts, stones = self.open_games[id(game)]
+        if legal:
+            black, white = _points(game.last_added[0]), _points(game.last_added[1])
+            stones += black
+            stones += white
+            attempts.append((move, LEGAL | bool(is_black), len(black), len(white)))
+        else:
+            attempts.append((move, bool(is_black), 0, 0))
+
+    def end_game(self, game, winner=None):
+        """
+        the game is finished: winner is its result (0 black, 1 white, 2 draw), by default the one of gameover
+        (a draw if nobody won)
+        """
+        _, attempts, stones = self.open_games.pop(id(game))
+        game.recorder = None
+        winner = game.gameover() if winner is None else winner
+        self.games.append((len(attempts), 2 if winner == -1 else winner))
+        self.attempts += attempts
+        self.stones += stones
+        if len(self.games) >= self.chunk_games:
+            self.flush()
+
+    def flush(self):
+        """
+        write the finished games as a chunk; returns the length of the file, which can be passed as truncate to a
+        new writer to go back to this point (e.g.: when a training run is resumed from a checkpoint)
+        """
+        if self.games:
+            chunk = np.array((b"QCHK", len(self.games), len(self.attempts), len(self.stones)), CHUNK)
+            self.file.write(chunk.tobytes() + np.array(self.games, GAME).tobytes()
+                            + np.array(self.attempts, ATTEMPT).tobytes() + np.array(self.stones, np.uint8).tobytes())
+            self.games, self.attempts, self.stones = [], [], []
+        self.file.flush()
+        return self.file.tell()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+        for game, _, _ in self.open_games.values():
+            game.recorder = None
+        self.open_games = {}
+
+
+class RecordReader:
+    """
+    reads a record file (see RecordWriter) memory-mapped: only the chunk headers are read when it is opened, the
+    games are read from the file when they are used, so that millions of games do not need to fit in memory
+    """
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        header = self.data[:HEADER.itemsize].view(HEADER)[0]
+        if header["magic"] != b"QREC":
+            raise ValueError(f"{path} is not a record file")
+        self.size = int(header["size"])
+        self.chunks = []        # games, attempts and stones of each chunk (views of the file)
+        offset = HEADER.itemsize
+        while offset + CHUNK.itemsize <= len(self.data):
+            chunk = self.data[offset:offset + CHUNK.itemsize].view(CHUNK)[0]
+            if chunk["magic"] != b"QCHK" or offset + _chunk_length(chunk) > len(self.data):
+                break       # incomplete chunk at the end (the writer was interrupted)
+            views = []
+            offset += CHUNK.itemsize
+            for dtype, count in ((GAME, chunk["games"]), (ATTEMPT, chunk["attempts"]), (np.dtype(np.uint8), chunk["stones"])):
+                views.append(self.data[offset:offset + int(count) * dtype.itemsize].view(dtype))
+                offset += int(count) * dtype.itemsize
+            self.chunks.append(tuple(views))
+        self.num_games = sum(len(games) for games, _, _ in self.chunks)
+        self.num_attempts = sum(len(attempts) for _, attempts, _ in self.chunks)
+
+    def __len__(self):
+        return self.num_games
+
+    def games(self):
+        """
+        the games one by one: the winner, the attempts (structured array: location, flags, black, white)
+        and the stones placed by the legal ones
+        """
+        for games, attempts, stones in self.chunks:
+            starts = np.concatenate(([0], np.cumsum(games["attempts"], dtype=np.int64)))
+            placed = np.concatenate(([0], np.cumsum(attempts["black"] + attempts["white"].astype(np.int64))))
+            for i, (count, winner) in enumerate(games.tolist()):
+                yield winner, attempts[starts[i]:starts[i + 1]], stones[placed[starts[i]]:placed[starts[i + 1]]]
+
+    def _tables(self, chunk):
+        """
+        for each attempt of a chunk, its game and its turn (index in the game); for each game, the turn at which
+        each point was filled and its stone. A stone is never removed, so the board before the turn t is the stones
+        filled at the turns before t (see _boards)
+        """
+        games, attempts, stones = chunk
+        n = self.size * self.size
+        counts = games["attempts"].astype(np.int64)
+        game = np.repeat(np.arange(len(games)), counts)
+        turn = np.arange(len(attempts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        placed = attempts["black"].astype(np.int64) + attempts["white"]
+        owner = np.repeat(np.arange(len(attempts)), placed)         # attempt of each stone
+        rank = np.arange(len(stones)) - np.repeat(np.cumsum(placed) - placed, placed)
+        filled_at = np.full((len(games), n), np.iinfo(np.int32).max, dtype=np.int32)
+        value = np.full((len(games), n), -1, dtype=np.int8)
+        filled_at[game[owner], stones] = turn[owner]
+        value[game[owner], stones] = rank >= attempts["black"][owner]     # the white stones follow the black ones
+        return game, turn, filled_at, value
+
+    @staticmethod
+    def _boards(tables, game, turn):
+        _, _, filled_at, value = tables
+        return np.where(filled_at[game] < turn[:, None], value[game], -1)
+
+    def transitions(self, batch_size=1024, players=(True, False), shuffle=False, seed=None, chunks=None, **kwargs):
+        """
+        batches of the transitions of the players (True for black) as in the training loops (see Quentin_Train):
+        states, actions, rewards, next states (in the format of convert_state, float32) and done flags.
+        An illegal attempt leaves the state as it is (illegal_reward, default -1); a legal move goes to the state
+        of the next attempt of the player or, if it is his last legal move, to the final board (win_reward 100,
+        lose_reward -100, draw_rewards: by player, default 0). The boards are rebuilt from the stones (no moves are replayed);
+        with shuffle, the chunks and the transitions of each chunk are read in random order. chunks: the indices of
+        the chunks to read (default all of them); dtype: of the states (e.g.: int8, to keep many of them in memory)
+        """
+        win_reward = kwargs.get('win_reward', 100)
+        lose_reward = kwargs.get('lose_reward', -100)
+        illegal_reward = kwargs.get('illegal_reward', -1)
+        draw_rewards = kwargs.get('draw_rewards', {True: 0, False: 0})
+        dtype = kwargs.get('dtype', np.float32)
+        rng = np.random.default_rng(seed)
+        order = np.arange(len(self.chunks)) if chunks is None else np.asarray(chunks)
+        if shuffle:
+            order = rng.permutation(order)
+        pending, count = [], 0      # transitions not yet yielded (less than a batch)
+        for c in order:
+            chunk = self.chunks[c]
+            games, attempts, _ = chunk
+            tables = self._tables(chunk)
+            game, turn = tables[0], tables[1]
+            black = (attempts["flags"] & BLACK).astype(bool)
+            legal = (attempts["flags"] & LEGAL).astype(bool)
+            ## the next attempt of the same player in the same game (-1 if none); the last legal attempt of a player
+            ## ends its sequence, also when it is followed by illegal ones (in a draw, the player with no legal moves
+            ## left tried them all), as in the training loops
+            following = np.full(len(attempts), -1)
+            done = np.zeros(len(attempts), dtype=bool)
+            for side in (True, False):
+                idx = np.flatnonzero(black == side)
+                same_game = game[idx[1:]] == game[idx[:-1]]
+                following[idx[:-1][same_game]] = idx[1:][same_game]
+                idx = idx[legal[idx]]
+                done[idx] = np.append(game[idx[1:]] != game[idx[:-1]], True)
+            next_turn = np.where(legal, np.where(done, np.iinfo(np.int32).max, turn[following]), turn)
+            winner = games["winner"][game].astype(np.int64)
+            reward = np.where(legal, 0.0, illegal_reward)
+            final = np.where(winner == 2, np.where(black, draw_rewards[True], draw_rewards[False]),
+                             np.where(winner == np.where(black, 0, 1), win_reward, lose_reward))
+            reward = np.where(done, final, reward).astype(np.float32)
+            selected = np.flatnonzero(np.isin(black, list(players)))
+            if shuffle:
+                selected = rng.permutation(selected)
+            for start in range(0, len(selected), batch_size):
+                idx = selected[start:start + batch_size]
+                player = (~black[idx]).astype(dtype)[:, None]
+                states = np.hstack([self._boards(tables, game[idx], turn[idx]), player], dtype=dtype)
+                next_states = np.hstack([self._boards(tables, game[idx], next_turn[idx]), player], dtype=dtype)
+                pending.append((states, attempts["location"][idx].astype(np.int64), reward[idx], next_states, done[idx]))
+                count += len(idx)
+                if count >= batch_size:
+                    merged = pending[0] if len(pending) == 1 else [np.concatenate(parts) for parts in zip(*pending)]
+                    yield tuple(part[:batch_size] for part in merged)
+                    count -= batch_size
+                    pending = [tuple(part[batch_size:] for part in merged)] if count else []
+        if pending:
+            yield tuple(np.concatenate(parts) for parts in zip(*pending))
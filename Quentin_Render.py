@@ -0,0 +1,108 @@
+##Renderers of the play scripts: headless (nothing is drawn, matplotlib is not imported), text (the board printed
+## after each move) and matplotlib, which keeps the figure and adds only the patches of the new stones at each move.
+
+class HeadlessRenderer:
+    """
+    draws nothing: for batch games between agents (e.g.: on a server)
+    """
+    def draw(self, game, winning_path=()):
+        pass
+
+    def close(self):
+        pass
+
+
+class TextRenderer:
+    """
+    prints the board (str of the game, e.g.: QuentinGame.__str__) after each move, and the winning path, if any
+    """
+    def draw(self, game, winning_path=()):
+        print(game)
+        if winning_path:
+            print("winning path: " + " ".join(sorted("abcdefghijklm"[i // game.size] + str(i % game.size) for i in winning_path)))
+
+    def close(self):
+        pass
+
+
+class MatplotlibRenderer:
+    """
+    interactive figure of the board: the grid and the labels are drawn once, then each draw adds the patches of
+    the stones placed since the last one (the move and the filled territories) and highlights the winning path.
+    The figure is refreshed without blocking; delay is an optional pause (in seconds) after each move,
+    to follow the games between agents
+    """
+    def __init__(self, size, delay=0.0):
+        import matplotlib.pyplot as plt
+        from matplotlib.patches import Circle
+        self.plt = plt
+        self.Circle = Circle
+        self.size = size
+        self.delay = delay
+        self.stones = {}        # point: (patch, colour) of its stone
+        self.highlighted = set()
+        self.fig, self.ax = plt.subplots()
+        plt.ion()
+        self.ax.set_xticks(range(size))
+        self.ax.set_yticks(range(size))
+        self.ax.set_xticklabels([])
+        self.ax.set_yticklabels([])
+        self.ax.grid(which='both', color='black', linestyle='-', linewidth=1)
+        self.ax.set_xlim(-0.5, size-0.5)
+        self.ax.set_ylim(-0.5, size-0.5)
+        self.ax.set_aspect('equal')
+        for side in ('top', 'bottom', 'left', 'right'):
+            self.ax.spines[side].set_visible(False)
+        # Add letters (A-M) to the left and right of the board, numbers (0-12) to the top and bottom
+        for i in range(size):
+            self.ax.text(-1, i, chr(ord('A') + size - i - 1), va='center', ha='center')
+            self.ax.text(size, i, chr(ord('A') + size - i - 1), va='center', ha='center')
+            self.ax.text(i, size, str(i), va='center', ha='center')
+            self.ax.text(i, -1, str(i), va='center', ha='center')
+        plt.show(block=False)
+
+    def draw(self, game, winning_path=()):
+        for idx, value in enumerate(game.board):
+            stone = self.stones.get(idx)
+            if stone is not None and stone[1] != value:
+                ## the stone was taken back (it doesn't happen in a game, only if the board is reused)
+                stone[0].remove()
+                del self.stones[idx]
+                self.highlighted.discard(idx)
+                stone = None
+            if stone is None and value != -1:
+                row, col = divmod(idx, self.size)
+                circle = self.Circle((col, self.size-row-1), 0.4, facecolor='black' if value == 0 else 'white',
+                                     edgecolor='black', linewidth=1)
+                self.stones[idx] = (self.ax.add_patch(circle), value)
+        # the stones of the winning path (if any) are highlighted
+        winning_path = set(winning_path)
+        for idx in self.highlighted - winning_path:
+            self.stones[idx][0].set(edgecolor='black', linewidth=1)
+        for idx in winning_path - self.highlighted:
+            self.stones[idx][0].set(edgecolor='red', linewidth=3)
+        self.highlighted = winning_path
+        if self.delay:
+            self.plt.pause(self.delay)
+        else:
+            self.fig.canvas.draw_idle()
+            self.fig.canvas.flush_events()
+
+    def close(self):
+        self.plt.close(self.fig)
+
+
+RENDERERS = ("headless", "text", "matplotlib")
+
+
+def make_renderer(mode, size, delay=0.0):
+    """
+    the renderer of a mode (see RENDERERS)
+    """
+    if mode == "headless":
+        return HeadlessRenderer()
+    if mode == "text":
+        return TextRenderer()
+    if mode == "matplotlib":
+        return MatplotlibRenderer(size, delay)
+    raise ValueError(f"unknown renderer: {mode}")
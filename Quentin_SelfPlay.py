@@ -0,0 +1,206 @@
+##Parallel self-play: a pool of worker processes plays the games with copies of the DQNs, which are synced
+## periodically with the weights of the learner; the transitions are streamed to the learner (the main process),
+## which owns the replay buffers and the optimizers.
+
+import time
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from queue import Empty
+from Quentin import QuentinBitboard
+from Quentin_DQN import QuentinDQNAgent, build_model, convert_state, load_model
+
+
+def episode_rewards(winner, is_black):
+    """
+    reward of a player at the end of a game: +100 if he wins, -100 if he loses (as in the training loops)
+    """
+    return 100 if winner == (0 if is_black else 1) else -100
+
+
+def choose_action(model, state, mask, epsilon, rng):
+    """
+    epsilon-greedy action among the legal ones (mask), with the Q-values of the model
+    """
+    if rng.random() < epsilon:
+        return int(rng.choice(np.flatnonzero(mask)))
+    with torch.no_grad():
+        q_values = model(torch.from_numpy(state.astype(np.float32))).numpy()
+    q_values[~mask] = -np.inf
+    return int(np.argmax(q_values))
+
+
+def play_episode(game_class, size, models, epsilons, draw_rewards, rng):
+    """
+    play one game; models maps each player (True for black) to the model which picks its moves,
+    epsilons maps the learning players to their exploration rate (the other players are greedy).
+    A transition of a player goes from the state in which he moves to the state after the opponent's reply
+    (or to the final state, if the game ends), as in the training loops of the notebook.
+    Returns the winner (0 black, 1 white, 2 draw) and, for each learning player, the arrays of the transitions
+    (states, actions, rewards, next states, dones)
+    """
+    game = game_class(size)
+    records = {is_black: [] for is_black in epsilons}
+    pending = {}        # last (state, action) of each learning player, waiting for the next state
+    is_black = True
+    while True:
+        state = convert_state(game.board, size, 0 if is_black else 1).astype(np.int8)
+        mask = game.legal_actions_mask(is_black)
+        if not mask.any():
+            ## no moves available for the player to move: it's a draw
+            winner = 2
+            for player, (last_state, action) in pending.items():
+                records[player].append((last_state, action, draw_rewards[player],
+                                        convert_state(game.board, size, 0 if player else 1), True))
+            break
+        if is_black in pending:
+            records[is_black].append(pending.pop(is_black) + (0, state, False))
+        action = choose_action(models[is_black], state, mask, epsilons.get(is_black, 0), rng)
+        game.update_board(is_black, action, [])
+        if is_black in epsilons:
+            pending[is_black] = (state, action)
+        winner = game.gameover()
+        if winner != -1:
+            for player, (last_state, action) in pending.items():
+                records[player].append((last_state, action, episode_rewards(winner, player),
+                                        convert_state(game.board, size, 0 if player else 1), True))
+            break
+        is_black = not is_black
+
+    transitions = {}
+    for player, steps in records.items():
+        if steps:
+            states, actions, rewards, next_states, dones = zip(*steps)
+            transitions[player] = (np.array(states, dtype=np.int8), np.array(actions, dtype=np.int16),
+                                   np.array(rewards, dtype=np.float32), np.array(next_states, dtype=np.int8),
+                                   np.array(dones, dtype=bool))
+    return winner, transitions
+
+
+def self_play_worker(worker_id, size, shared_models, learning, version, lock, epsilons, queue, stop, kwargs):
+    """
+    play episodes until stop is set, with local copies of the shared models (reloaded whenever the learner
+    publishes new weights), and put their transitions on the queue
+    """
+    torch.set_num_threads(1)
+    seed = kwargs.get('seed')
+    rng = np.random.default_rng(None if seed is None else seed + worker_id)
+    game_class = kwargs.get('game_class', QuentinBitboard)
+    draw_rewards = kwargs.get('draw_rewards', {True: 0, False: 0})
+    models = {player: build_model(model.config) for player, model in shared_models.items()}
+    synced = -1
+    while not stop.is_set():
+        if version.value != synced:
+            with lock:
+                synced = version.value
+                for player, model in models.items():
+                    model.load_state_dict(shared_models[player].state_dict())
+        exploration = {player: epsilons[player].value for player in learning}
+        winner, transitions = play_episode(game_class, size, models, exploration, draw_rewards, rng)
+        queue.put((worker_id, winner, transitions))
+
+
+def parallel_learning(size=7, scheme='simultaneous', workers=2, episodes=1000, batch_size=128, **kwargs):
+    """
+    train with self-play episodes generated by a pool of worker processes.
+
+    scheme 'simultaneous': a black and a white agent learn by playing against each other
+    (draw: -10 for the black, 0 for the white, as in simultaneous_learning);
+    scheme 'alternating': one agent (black if learn_black, else white) learns against a fixed opponent,
+    given as a DQN or as the path of a saved model (as in black_learning and white_learning).
+
+    Other options: train_every (transitions received between two replays, default 4), sync_every
+    (replays between two weights updates of the workers, default 10), save_episodes, seed, game_class
+    and the QuentinDQNAgent hyperparameters (e.g.: architecture, kernel_size, prioritized_replay).
+    Returns the agents (by player, True for black), their losses and some statistics of the run
+    """
+    state_size = size * size + 1
+    action_size = size * size
+    train_every = kwargs.get('train_every', 4)
+    sync_every = kwargs.get('sync_every', 10)
+    save_episodes = kwargs.get('save_episodes') or []
+    if scheme == 'simultaneous':
+        learning = [True, False]
+        draw_rewards = {True: -10, False: 0}
+    elif scheme == 'alternating':
+        learn_black = kwargs.get('learn_black', True)
+        learning = [learn_black]
+        draw_rewards = {True: 0, False: 0}
+        opponent = kwargs['opponent']
+        if isinstance(opponent, str):
+            opponent = load_model(opponent)
+    else:
+        raise ValueError(f"unknown scheme: {scheme}")
+
+    agent_kwargs = {key: value for key, value in kwargs.items()
+                    if key not in ('train_every', 'sync_every', 'save_episodes', 'seed', 'game_class',
+                                   'learn_black', 'opponent')}
+    agents = {player: QuentinDQNAgent(size, state_size, action_size, **agent_kwargs) for player in learning}
+    losses = {player: [] for player in learning}
+
+    ## Shared state between the learner and the workers
+    ctx = mp.get_context()
+    shared_models = {}
+    for player in (True, False):
+        source = agents[player].model if player in agents else opponent
+        shared_models[player] = build_model(source.config)
+        shared_models[player].load_state_dict(source.state_dict())
+        shared_models[player].share_memory()
+    version = ctx.Value('i', 0)
+    lock = ctx.Lock()
+    epsilons = {player: ctx.Value('d', agents[player].epsilon) for player in learning}
+    queue = ctx.Queue()
+    stop = ctx.Event()
+    worker_kwargs = {'seed': kwargs.get('seed'), 'game_class': kwargs.get('game_class', QuentinBitboard),
+                     'draw_rewards': draw_rewards}
+    processes = [ctx.Process(target=self_play_worker, daemon=True,
+                             args=(i, size, shared_models, learning, version, lock, epsilons, queue, stop, worker_kwargs))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+
+    ## Learner
+    steps = 0
+    replays = 0
+    results = [0, 0, 0]     # black wins, white wins, draws
+    start = time.perf_counter()
+    try:
+        for e in range(episodes):
+            worker_id, winner, transitions = queue.get()
+            results[winner] += 1
+            for player, batch in transitions.items():
+                agent = agents[player]
+                for transition in zip(*batch):
+                    agent.remember(*transition)
+                    steps += 1
+                    if steps % train_every == 0 and all(len(a.memory) > batch_size for a in agents.values()):
+                        for p, a in agents.items():
+                            a.replay(batch_size, losses[p])
+                            a.update_target_model()
+                            epsilons[p].value = a.epsilon
+                        replays += 1
+                        if replays % sync_every == 0:
+                            with lock:
+                                for p, a in agents.items():
+                                    shared_models[p].load_state_dict(a.model.state_dict())
+                                version.value += 1
+            if e in save_episodes:
+                suffix = "" if scheme == 'simultaneous' else "_alternating"
+                for player, agent in agents.items():
+                    agent.save(f"quentin_sz{size}_ep{e}__{'black' if player else 'white'}{suffix}")
+    finally:
+        elapsed = time.perf_counter() - start
+        stop.set()
+        ## the workers can exit only when their transitions have been taken from the queue
+        while any(process.is_alive() for process in processes):
+            try:
+                queue.get(timeout=0.1)
+            except Empty:
+                pass
+        for process in processes:
+            process.join()
+
+    stats = {"episodes": episodes, "seconds": elapsed, "episodes_per_second": episodes / elapsed,
+             "transitions": steps, "replays": replays, "black_wins": results[0], "white_wins": results[1],
+             "draws": results[2]}
+    return agents, losses, stats
@@ -0,0 +1,288 @@
+##Batched inference server: the requests of many concurrent games (coroutines in the same event loop, or clients on
+## a local Unix socket) are collected in micro-batches, one forward pass per batch, within a maximum latency.
+## Usage: python Quentin_Server.py black=quentin_sz7_ep25__black white=quentin_sz7_ep25__white --socket quentin.sock
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import numpy as np
+from Quentin import QuentinBitboard
+from Quentin_Inference import load_inference_model, q_values, encode_state
+from Quentin_Metrics import Metrics
+
+
+class InferenceServer:
+    """
+    owns the models (name: model, or path of a saved or exported model, see load_inference_model) and answers the
+    requests of ranked actions (as rank_actions): the requests of each model wait in a queue, until max_batch_size
+    of them are collected or the first one has waited max_latency seconds (see _batcher); then a single forward pass
+    ranks them all.
+    The totals (see stats) are always kept; with a metrics path, a record of the last log_every batches is written
+    (see Metrics: requests and batches per second, forward pass time, batch sizes and waits in the queue)
+    """
+    def __init__(self, models, max_batch_size=64, max_latency=0.002, metrics_path=None, log_every=1000):
+        self.models = {name: load_inference_model(model) if isinstance(model, str) else model
+                       for name, model in models.items()}
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.log_every = log_every
+        self.metrics = Metrics(metrics_path)
+        self.queues = {}
+        self.tasks = []
+        self.totals = {"requests": 0, "batches": 0, "max_batch_size": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0}
+        self.interval = {"max_batch_size": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0}
+        self.start_time = None
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self.start_time = loop.time()
+        for name in self.models:
+            self.queues[name] = asyncio.Queue()
+            self.tasks.append(loop.create_task(self._batcher(name)))
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.metrics.close()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def rank(self, state, legal_mask=None, model=None):
+        """
+        the actions ranked by Q-value (best first), only the legal ones if a mask is given, and their Q-values
+        (as rank_actions); model is the name of the model (it can be omitted if the server has only one)
+        """
+        if model is None:
+            if len(self.models) != 1:
+                raise ValueError("the name of the model is needed: the server has " + ", ".join(self.models))
+            model = next(iter(self.models))
+        if model not in self.queues:
+            raise ValueError(f"unknown model: {model}")
+        state, legal_mask = self._check_request(self.models[model], state, legal_mask)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self.queues[model].put((state, legal_mask, future, loop.time()))
+        return await future
+
+    @staticmethod
+    def _check_request(model, state, legal_mask):
+        """
+        the state (flat, as convert_state: the board and the player) and the mask (one flag per point) as arrays;
+        ValueError if their shapes do not fit the model, so that a bad request never reaches a batch
+        """
+        state = np.asarray(state, dtype=np.float32)
+        config = getattr(model, "config", {})
+        if state.ndim != 1:
+            raise ValueError(f"the state must be flat (board and player), not of shape {state.shape}")
+        if config.get("architecture") == "mlp" and len(state) != config["state_size"]:
+            raise ValueError(f"the state has {len(state)} values, the model takes {config['state_size']}")
+        size = math.isqrt(max(len(state) - 1, 0))
+        if size == 0 or size * size != len(state) - 1:
+            raise ValueError(f"the state has {len(state)} values, not the points of a square board and the player")
+        if legal_mask is not None:
+            legal_mask = np.asarray(legal_mask, dtype=bool)
+            if legal_mask.shape != (len(state) - 1,):
+                raise ValueError(f"the mask has shape {legal_mask.shape}, the board has {len(state) - 1} points")
+        return state, legal_mask
+
+    async def next_move(self, game, is_black, model=None):
+        # best legal action for the player (None if the player has no legal moves), as next_move of Quentin_Inference
+        ranked_actions, _ = await self.rank(encode_state(game.board, not is_black).copy(),
+                                            game.legal_actions_mask(is_black), model)
+        return int(ranked_actions[0]) if len(ranked_actions) else None
+
+    async def _batcher(self, name):
+        ## the requests already queued are always taken; the batcher waits for more (until the deadline) only while
+        ## the batch is smaller than the previous one: a single client is not delayed, and when clients leave
+        ## the batches shrink after one wait
+        loop = asyncio.get_running_loop()
+        queue = self.queues[name]
+        expected = 1
+        while True:
+            batch = [await queue.get()]
+            deadline = batch[0][3] + self.max_latency
+            while len(batch) < self.max_batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if len(batch) >= expected or timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            expected = len(batch)
+            self._run_batch(self.models[name], batch, loop.time())
+
+    def _run_batch(self, model, batch, now):
+        ## one forward pass per state size (a convolutional model can serve many board sizes); an error fails only
+        ## the requests it concerns, and never stops the batcher
+        waits = [now - queued for _, _, _, queued in batch]
+        groups = {}
+        for request in batch:
+            groups.setdefault(len(request[0]), []).append(request)
+        for group in groups.values():
+            try:
+                q = self.metrics.time("forward", q_values, model, np.stack([state for state, _, _, _ in group]))
+            except Exception as error:
+                for _, _, future, _ in group:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, legal_mask, future, _), q_row in zip(group, q):
+                if future.done():       # the caller was cancelled
+                    continue
+                try:
+                    ranked_actions = np.argsort(q_row)[::-1]
+                    if legal_mask is not None:
+                        ranked_actions = ranked_actions[legal_mask[ranked_actions]]
+                    future.set_result((ranked_actions, q_row[ranked_actions]))
+                except Exception as error:
+                    future.set_exception(error)
+        self._record(len(batch), waits)
+
+    def _record(self, batch_size, waits):
+        self.metrics.count("requests", batch_size)
+        self.metrics.count("batches")
+        for counters in (self.totals, self.interval):
+            counters["max_batch_size"] = max(counters["max_batch_size"], batch_size)
+            counters["queue_seconds"] += sum(waits)
+            counters["max_queue_seconds"] = max(counters["max_queue_seconds"], max(waits))
+        self.totals["requests"] += batch_size
+        self.totals["batches"] += 1
+        if self.metrics.file is not None and self.totals["batches"] % self.log_every == 0:
+            requests = self.metrics.counters["requests"]
+            self.metrics.emit(self.totals["batches"], mean_batch_size=requests / self.log_every,
+                              max_batch_size=self.interval["max_batch_size"],
+                              mean_queue_ms=self.interval["queue_seconds"] / requests * 1e3,
+                              max_queue_ms=self.interval["max_queue_seconds"] * 1e3)
+            self.interval = {"max_batch_size": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0}
+
+    def stats(self):
+        """
+        totals since the start: requests, batches, batch sizes, waits in the queue and requests per second
+        """
+        requests, batches = self.totals["requests"], self.totals["batches"]
+        elapsed = asyncio.get_running_loop().time() - self.start_time
+        return {"requests": requests, "batches": batches,
+                "mean_batch_size": requests / batches if batches else 0.0,
+                "max_batch_size": self.totals["max_batch_size"],
+                "mean_queue_ms": self.totals["queue_seconds"] / requests * 1e3 if requests else 0.0,
+                "max_queue_ms": self.totals["max_queue_seconds"] * 1e3,
+                "requests_per_second": requests / elapsed if elapsed > 0 else 0.0}
+
+    async def serve_unix(self, path):
+        """
+        accept clients (see InferenceClient) on a Unix socket; returns the asyncio server
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        return await asyncio.start_unix_server(self._handle, path)
+
+    async def _handle(self, reader, writer):
+        ## one JSON object per line: {"model", "state", "mask"} -> {"actions", "q"}, or {"stats": true} -> stats
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("stats"):
+                        response = self.stats()
+                    else:
+                        ranked_actions, q = await self.rank(request["state"], request.get("mask"), request.get("model"))
+                        response = {"actions": ranked_actions.tolist(), "q": q.tolist()}
+                except Exception as error:      # a bad request does not close the connection
+                    response = {"error": f"{type(error).__name__}: {error}"}
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionResetError:
+            pass
+        finally:
+            writer.close()
+
+
+class InferenceClient:
+    """
+    blocking client of an InferenceServer on a Unix socket, for one model (its name can be omitted if the server
+    has only one). It can be used as a player of the play scripts (see select_move)
+    """
+    def __init__(self, path, model=None):
+        self.model = model
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.file = self.sock.makefile("rwb")
+
+    def _request(self, request):
+        self.file.write(json.dumps(request).encode() + b"\n")
+        self.file.flush()
+        response = json.loads(self.file.readline())
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def rank_actions(self, state, legal_mask=None):
+        response = self._request({"model": self.model, "state": np.asarray(state, dtype=float).tolist(),
+                                  "mask": None if legal_mask is None else np.asarray(legal_mask, dtype=bool).tolist()})
+        return np.array(response["actions"], dtype=np.int64), np.array(response["q"], dtype=np.float32)
+
+    def select_move(self, board, is_black, unavail=()):
+        """
+        best legal move for the player (as next_move), excluding the moves in unavail; None if there are none
+        """
+        game = QuentinBitboard(int(len(board) ** 0.5))
+        game.board = list(board)
+        legal_mask = game.legal_actions_mask(is_black).copy()
+        legal_mask[list(unavail)] = False
+        ranked_actions, _ = self.rank_actions(encode_state(board, not is_black), legal_mask)
+        return int(ranked_actions[0]) if len(ranked_actions) else None
+
+    def stats(self):
+        return self._request({"stats": True})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+async def serve(models, path, **kwargs):
+    async with InferenceServer(models, **kwargs) as server:
+        await server.serve_unix(path)
+        print(f"serving {', '.join(models)} on {path}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="batched inference server of saved agents on a Unix socket")
+    parser.add_argument("models", nargs="+", help="name=path of a saved or exported model (see load_inference_model)")
+    parser.add_argument("--socket", default="quentin.sock", help="path of the Unix socket")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-latency", type=float, default=2.0, help="maximum wait of a request in the queue (ms)")
+    parser.add_argument("--metrics", help="JSON lines file of the server metrics")
+    parser.add_argument("--log-every", type=int, default=1000, help="batches between two metrics records")
+    args = parser.parse_args()
+    models = dict(model.split("=", 1) for model in args.models)
+    try:
+        asyncio.run(serve(models, args.socket, max_batch_size=args.max_batch_size, max_latency=args.max_latency / 1e3,
+                          metrics_path=args.metrics, log_every=args.log_every))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
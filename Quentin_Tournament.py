@@ -0,0 +1,148 @@
+##Headless tournament between saved agents: round-robin matches played across a process pool,
+## with the moves of all the concurrent games of a match picked by a single forward pass of each DQN.
+## Usage: python Quentin_Tournament.py quentin_sz7_ep25__black quentin_sz7_ep25__white [--games 50 --workers 4]
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from Quentin import QuentinBitboard
+from Quentin_DQN import load_model
+
+
+def play_match(black, white, size, games, opening_moves=2, seed=0, game_class=QuentinBitboard):
+    """
+    play games between two models (black moves first), all at the same time: at each turn the states of the games
+    still running go through the model to move in one batch, and each game takes the best legal action.
+    The first opening_moves moves of every game are random (legal) moves, so that the games are not all the same.
+    Returns the winner (0 black, 1 white, 2 draw) and the number of moves of each game
+    """
+    rng = np.random.default_rng(seed)
+    boards = [game_class(size) for _ in range(games)]
+    winners = np.full(games, -1)
+    lengths = np.zeros(games, dtype=int)
+    states = np.empty((games, size * size + 1), dtype=np.float32)
+    is_black = True
+    turn = 0
+    while (winners == -1).any():
+        running = np.flatnonzero(winners == -1)
+        masks = np.stack([boards[i].legal_actions_mask(is_black) for i in running])
+        stuck = ~masks.any(axis=1)
+        winners[running[stuck]] = 2      # no moves available for the player to move: it's a draw
+        running, masks = running[~stuck], masks[~stuck]
+        if not len(running):
+            break
+        if turn < opening_moves:
+            actions = [rng.choice(np.flatnonzero(mask)) for mask in masks]
+        else:
+            for k, i in enumerate(running):
+                states[k, :-1] = boards[i].board
+            states[:len(running), -1] = 0 if is_black else 1
+            with torch.no_grad():
+                q_values = (black if is_black else white)(torch.from_numpy(states[:len(running)])).numpy()
+            actions = np.where(masks, q_values, -np.inf).argmax(axis=1)
+        for i, action in zip(running, actions):
+            boards[i].update_board(is_black, int(action), [])
+            lengths[i] += 1
+            winners[i] = boards[i].gameover()
+        is_black = not is_black
+        turn += 1
+    return winners, lengths
+
+
+_MODELS = {}
+
+
+def _load_models(paths):
+    torch.set_num_threads(1)
+    for path in paths:
+        _MODELS[path] = load_model(path)
+
+
+def _play_pairing(args):
+    black, white, size, games, opening_moves, seed = args
+    winners, lengths = play_match(_MODELS[black], _MODELS[white], size, games, opening_moves, seed)
+    return black, white, winners, lengths
+
+
+def elo_ratings(scores, games, iterations=200):
+    """
+    Elo ratings (mean 1500) fitting a Bradley-Terry model to the results of the tournament:
+    scores[i, j] are the points of player i against player j (1 per win, 0.5 per draw), games[i, j] the games played.
+    Every pair of players which met gets a virtual draw, so that the ratings stay finite
+    """
+    scores = scores + 0.5 * (games > 0)
+    games = games + (games > 0)
+    gamma = np.ones(len(scores))
+    for _ in range(iterations):
+        gamma = scores.sum(axis=1) / (games / (gamma[:, None] + gamma[None, :])).sum(axis=1)
+        gamma /= np.exp(np.log(gamma).mean())
+    return 1500 + 400 * np.log10(gamma)
+
+
+def round_robin(paths, size=7, games=50, workers=None, opening_moves=2, seed=0):
+    """
+    every agent plays a match of the given number of games against every other agent, with black and with white;
+    the matches are distributed over a pool of worker processes.
+    Returns a list with the statistics of each agent (sorted by Elo rating) and the overall statistics
+    """
+    n = len(paths)
+    tasks = [(paths[i], paths[j], size, games, opening_moves, seed + i * n + j)
+             for i in range(n) for j in range(n) if i != j]
+    scores = np.zeros((n, n))
+    played = np.zeros((n, n))
+    wins = np.zeros((n, 2))         # wins with black, wins with white
+    draws = np.zeros(n)
+    moves = np.zeros(n)
+    index = {path: i for i, path in enumerate(paths)}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_load_models, initargs=(paths,)) as pool:
+        for black, white, winners, lengths in pool.map(_play_pairing, tasks):
+            b, w = index[black], index[white]
+            scores[b, w] += np.sum(winners == 0) + 0.5 * np.sum(winners == 2)
+            scores[w, b] += np.sum(winners == 1) + 0.5 * np.sum(winners == 2)
+            played[b, w] += games
+            played[w, b] += games
+            wins[b, 0] += np.sum(winners == 0)
+            wins[w, 1] += np.sum(winners == 1)
+            draws[[b, w]] += np.sum(winners == 2)
+            moves[[b, w]] += lengths.sum()
+    elapsed = time.perf_counter() - start
+    ratings = elo_ratings(scores, played)
+    total = played.sum(axis=1)
+    table = [{"agent": path, "elo": ratings[i], "games": int(total[i]), "wins": int(wins[i].sum()),
+              "draws": int(draws[i]), "losses": int(total[i] - wins[i].sum() - draws[i]),
+              "win_rate": wins[i].sum() / total[i], "black_win_rate": wins[i, 0] / (total[i] / 2),
+              "white_win_rate": wins[i, 1] / (total[i] / 2), "mean_length": moves[i] / total[i]}
+             for i, path in enumerate(paths)]
+    table.sort(key=lambda row: -row["elo"])
+    summary = {"games": len(tasks) * games, "seconds": elapsed, "games_per_second": len(tasks) * games / elapsed}
+    return table, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="round-robin tournament between saved agents")
+    parser.add_argument("agents", nargs="+", help="paths of the saved agents (see load_model)")
+    parser.add_argument("--size", type=int, default=7)
+    parser.add_argument("--games", type=int, default=50, help="games of each match (for each colour)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--opening-moves", type=int, default=2, help="random moves at the start of every game")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if len(args.agents) < 2:
+        parser.error("at least two agents are needed")
+
+    table, summary = round_robin(args.agents, args.size, args.games, args.workers, args.opening_moves, args.seed)
+    width = max(len(row["agent"]) for row in table)
+    print(f"{'agent':<{width}} {'elo':>7} {'games':>6} {'W':>5} {'D':>5} {'L':>5} "
+          f"{'win %':>6} {'black %':>8} {'white %':>8} {'length':>7}")
+    for row in table:
+        print(f"{row['agent']:<{width}} {row['elo']:>7.0f} {row['games']:>6} {row['wins']:>5} {row['draws']:>5} "
+              f"{row['losses']:>5} {100 * row['win_rate']:>6.1f} {100 * row['black_win_rate']:>8.1f} "
+              f"{100 * row['white_win_rate']:>8.1f} {row['mean_length']:>7.1f}")
+    print(f"{summary['games']} games in {summary['seconds']:.1f} s ({summary['games_per_second']:.1f} games/s)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+##Training loops of the project (simultaneous and alternating learning, see Project.ipynb) with periodic, atomic
+## checkpoints of the whole state of the run (networks, optimizers, epsilons, replay memories, counters and random
+## generators), from which an interrupted run resumes exactly as if it had never stopped.
+## Usage: python Quentin_Train.py simultaneous --run-dir runs/sz7 --episodes 1000 [--resume]
+##        python Quentin_Train.py alternating --learn white --opponent quentin_sz7_ep25__black --run-dir runs/white_sz7
+
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import numpy as np
+import torch
+from Quentin import QuentinBitboard
+from Quentin_DQN import QuentinDQNAgent, device, load_model, next_move, state_encoder
+from Quentin_Metrics import Metrics
+from Quentin_Records import RecordWriter
+from Quentin_SelfPlay import episode_rewards
+
+## steps (rounds of a black and a white move) between two replays and between two updates of the target networks
+SCHEDULES = {"simultaneous": (4, 100), "alternating": (15, 1)}
+
+
+def learner_move(game, agent, is_black, metrics):
+    """
+    the learning agent picks moves until one is legal: each illegal attempt is stored as a transition with
+    reward -1, which leaves the board as it is (as in the training loops of the notebook).
+    Returns the state (a copy, the encoder buffer is reused) and the action of the legal move (None if the player
+    has no legal moves) and the attempts
+    """
+    encoder = state_encoder(game.size)
+    state = metrics.time("encode_state", encoder.encode, game.board, 0 if is_black else 1)
+    unavail = []
+    action = metrics.time("act", agent.act, state, unavail)
+    while action is not None and not metrics.time("update_board", game.update_board, is_black, action, unavail):
+        metrics.time("remember", agent.remember, state, action, -1, state, False)
+        action = metrics.time("act", agent.act, state, unavail)
+    return state.numpy().copy(), action, len(unavail)
+
+
+def play_episode(game, agents, opponent, draw_rewards, run, e, batch_size, schedule, metrics):
+    """
+    one game: agents maps the learning players (True for black) to their QuentinDQNAgent, the other player (if any)
+    plays the best legal moves of the opponent network.
+    A transition of a learning player goes from the state in which he moves to the state after the opponent's reply,
+    or to the final state (+100 win, -100 loss, draw_rewards for a draw: the last legal move of the player who has
+    no legal moves left goes to the final state too). At every step (a move of each player) the
+    agents replay a minibatch and update their target networks as scheduled (see SCHEDULES).
+    The phases and the events (moves, illegal attempts, replays) are recorded by metrics (see Metrics).
+    Returns the winner (0 black, 1 white, 2 draw)
+    """
+    train_every, target_every = schedule
+    size = game.size
+    pending = {}        # last (state, action) of each learning player, waiting for the next state
+    is_black = True
+    while True:
+        if is_black in agents:
+            state, action, attempts = learner_move(game, agents[is_black], is_black, metrics)
+            run["illegal_moves"] += attempts
+            metrics.count("illegal_moves", attempts)
+            ## the state of the move (the illegal attempts leave the board as it is) is the next state of the previous
+            ## one; if the player has no legal moves, the previous move is the last one, with the final state
+            if action is not None:
+                if is_black in pending:
+                    previous_state, previous_action = pending.pop(is_black)
+                    metrics.time("remember", agents[is_black].remember, previous_state, previous_action, 0, state, False)
+                pending[is_black] = (state, action)
+        else:
+            action = metrics.time("opponent_move", next_move, game, opponent, is_black)
+            if action is not None:
+                metrics.time("update_board", game.update_board, is_black, action)
+        winner = 2 if action is None else metrics.time("gameover", game.gameover)
+        if action is not None:
+            metrics.count("moves")
+        if winner != -1:
+            for learner, (state, action) in pending.items():
+                reward = draw_rewards[learner] if winner == 2 else episode_rewards(winner, learner)
+                next_state = metrics.time("encode_state", state_encoder(size).encode, game.board, 0 if learner else 1)
+                metrics.time("remember", agents[learner].remember, state, action, reward, next_state, True)
+            return winner
+        if not is_black:
+            run["steps"] += 1
+            if run["steps"] % train_every == 0 and all(len(agent.memory) > batch_size for agent in agents.values()):
+                for learner, agent in agents.items():
+                    agent.epsilon = agent.epsilon_update(e)
+                    losses = []
+                    metrics.time("replay", agent.replay, batch_size, losses)
+                    metrics.count("replays")
+                    run["losses"][learner].extend(float(loss) for loss in losses)
+            if run["steps"] % target_every == 0:
+                for agent in agents.values():
+                    metrics.time("update_target_model", agent.update_target_model)
+        is_black = not is_black
+
+
+def _memory_file(learner):
+    return f"memory_{'black' if learner else 'white'}.npy"
+
+
+def _sync_file(path):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def save_run(run_dir, run, agents, keep=2):
+    """
+    checkpoint of the run in run_dir/checkpoint_<episode>: it is written in a temporary directory, which is renamed
+    only when complete, then the file latest points to it (replaced atomically), so that an interruption at any time
+    leaves the previous checkpoint usable. Only the last keep checkpoints are kept
+    """
+    name = f"checkpoint_{run['episode']:07d}"
+    temporary = os.path.join(run_dir, "tmp_" + name)
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    state = {"run": run, "agents": {}, "random": random.getstate(), "numpy": np.random.get_state(),
+             "torch": torch.get_rng_state()}
+    for learner, agent in agents.items():
+        path = os.path.join(temporary, _memory_file(learner))
+        state["agents"][learner] = agent.training_state(path)
+        _sync_file(path)
+    with open(os.path.join(temporary, "state.pt"), "wb") as f:
+        torch.save(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    final = os.path.join(run_dir, name)
+    shutil.rmtree(final, ignore_errors=True)
+    os.rename(temporary, final)
+    with open(os.path.join(run_dir, "latest.tmp"), "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(os.path.join(run_dir, "latest.tmp"), os.path.join(run_dir, "latest"))
+    checkpoints = sorted(entry for entry in os.listdir(run_dir) if entry.startswith("checkpoint_"))
+    for old in checkpoints[:-keep]:
+        shutil.rmtree(os.path.join(run_dir, old))
+
+
+def load_run(run_dir, agents):
+    """
+    restore the agents and the random generators from the latest checkpoint of run_dir (see save_run);
+    returns the state of the run (next episode, steps, losses), or None if there is no checkpoint
+    """
+    latest = os.path.join(run_dir, "latest")
+    if not os.path.exists(latest):
+        return None
+    with open(latest) as f:
+        checkpoint = os.path.join(run_dir, f.read().strip())
+    ## a checkpoint of our own runs: random generators and numpy arrays are not plain weights
+    state = torch.load(os.path.join(checkpoint, "state.pt"), map_location=device, weights_only=False)
+    for learner, agent in agents.items():
+        agent.load_training_state(state["agents"][learner], os.path.join(checkpoint, _memory_file(learner)))
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    return state["run"]
+
+
+def train(scheme='simultaneous', size=7, episodes=20, batch_size=128, save_episodes=None, **kwargs):
+    """
+    train with the simultaneous scheme (a black and a white agent learn by playing against each other;
+    draw: -10 for the black, 0 for the white) or the alternating one (one agent, black if learn_black, learns
+    against the fixed opponent network saved in opponent); episodes + 1 games are played, as in the notebook.
+
+    Checkpoints: with run_dir, the whole state of the run is saved every checkpoint_every episodes (default 10) and
+    at the end; with resume, the run restarts from the latest checkpoint of run_dir (with the same arguments).
+    stop (a function) is called after each episode: if it returns True, the run is checkpointed and stopped.
+    Metrics (see Metrics): a record every log_every episodes (default 10) is written to the JSON lines file
+    metrics_path (if given); with profile_tags, the phases are tagged for cProfile and py-spy.
+    Records: with record_path, the games are appended to that record file (see Quentin_Records); the checkpoints
+    keep its length, so that a resumed run does not record again the games played after the last checkpoint.
+    Warm start: warm_start maps learning players (True for black) to saved models whose weights the agents start
+    from (see QuentinDQNAgent.warm_start), e.g.: agents trained offline (see Quentin_Offline).
+    Other options: seed, game_class and the QuentinDQNAgent hyperparameters.
+    Returns the agents (by player, True for black), their losses and the state of the run
+    """
+    run_dir = kwargs.get('run_dir')
+    checkpoint_every = kwargs.get('checkpoint_every', 10)
+    seed = kwargs.get('seed')
+    game_class = kwargs.get('game_class', QuentinBitboard)
+    stop = kwargs.get('stop', lambda: False)
+    log_every = kwargs.get('log_every', 10)
+    metrics = Metrics(kwargs.get('metrics_path'), kwargs.get('profile_tags', False))
+    save_episodes = save_episodes or []
+    if scheme == 'simultaneous':
+        learning = [True, False]
+        draw_rewards = {True: -10, False: 0}
+        opponent = None
+    elif scheme == 'alternating':
+        learning = [kwargs.get('learn_black', True)]
+        draw_rewards = {True: 0, False: 0}
+        opponent = load_model(kwargs['opponent'], size * size + 1, size * size)
+    else:
+        raise ValueError(f"unknown scheme: {scheme}")
+
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+    agent_kwargs = {key: value for key, value in kwargs.items()
+                    if key not in ('run_dir', 'checkpoint_every', 'resume', 'seed', 'game_class', 'stop',
+                                   'learn_black', 'opponent', 'log_every', 'metrics_path', 'profile_tags',
+                                   'record_path', 'warm_start')}
+    agents = {player: QuentinDQNAgent(size, size * size + 1, size * size, **agent_kwargs) for player in learning}
+    if seed is not None:
+        for player, agent in agents.items():
+            agent.memory.rng = np.random.default_rng([seed, int(player)])
+    for player, model_path in (kwargs.get('warm_start') or {}).items():
+        if player in agents:
+            agents[player].warm_start(model_path)
+    run = None
+    if run_dir is not None:
+        os.makedirs(run_dir, exist_ok=True)
+        if kwargs.get('resume'):
+            run = load_run(run_dir, agents)
+    if run is None:
+        run = {"episode": 0, "steps": 0, "illegal_moves": 0, "results": [0, 0, 0],
+               "losses": {player: [] for player in learning}}
+    writer = None
+    if kwargs.get('record_path'):
+        writer = RecordWriter(kwargs['record_path'], size, truncate=run.get("record_bytes"))
+
+    suffix = "" if scheme == 'simultaneous' else "_alternating"
+    while run["episode"] <= episodes:
+        e = run["episode"]
+        game = game_class(size) if writer is None else writer.record(game_class(size))
+        winner = play_episode(game, agents, opponent, draw_rewards, run, e, batch_size, SCHEDULES[scheme], metrics)
+        if writer is not None:
+            writer.end_game(game, winner)
+        run["results"][winner] += 1
+        run["episode"] += 1
+        metrics.count("episodes")
+        if e in save_episodes:
+            for player, agent in agents.items():
+                agent.save(os.path.join(run_dir or "", f"quentin_sz{size}_ep{e}__{'black' if player else 'white'}{suffix}"))
+        finished = run["episode"] > episodes or stop()
+        if run_dir is not None and (finished or run["episode"] % checkpoint_every == 0):
+            if writer is not None:
+                run["record_bytes"] = writer.flush()
+            metrics.time("checkpoint", save_run, run_dir, run, agents)
+        if finished or run["episode"] % log_every == 0:
+            names = {player: 'black' if player else 'white' for player in agents}
+            replays = metrics.counters["replays"] // max(len(agents), 1)
+            metrics.emit(run["episode"], steps=run["steps"],
+                         buffer_fill={names[p]: len(a.memory) / a.memory.capacity for p, a in agents.items()},
+                         epsilon={names[p]: a.epsilon for p, a in agents.items()},
+                         loss={names[p]: float(np.mean(run["losses"][p][-replays:])) if replays else None for p in agents})
+        if finished:
+            break
+    metrics.close()
+    if writer is not None:
+        writer.close()
+    return agents, run["losses"], run
+
+
+def simultaneous_learning(size=7, episodes=20, batch_size=128, save_episodes=None, **kwargs):
+    """
+    the simultaneous scheme of the notebook (see train); returns the losses of the black and of the white agent
+    """
+    _, losses, _ = train('simultaneous', size, episodes, batch_size, save_episodes, **kwargs)
+    return losses[True], losses[False]
+
+
+def black_learning(agent_name, size=7, episodes=20, batch_size=128, save_episodes=None, **kwargs):
+    """
+    a black agent learns against the white agent saved in agent_name (see train); returns its losses
+    """
+    _, losses, _ = train('alternating', size, episodes, batch_size, save_episodes, opponent=agent_name,
+                         learn_black=True, **kwargs)
+    return losses[True]
+
+
+def white_learning(agent_name, size=7, episodes=20, batch_size=128, save_episodes=None, **kwargs):
+    """
+    a white agent learns against the black agent saved in agent_name (see train); returns its losses
+    """
+    _, losses, _ = train('alternating', size, episodes, batch_size, save_episodes, opponent=agent_name,
+                         learn_black=False, **kwargs)
+    return losses[False]
+
+
+def alternate_learning(learner_is_white, agent_name, size=7, episodes=20, batch_size=128, save_episodes=None, **kwargs):
+    if learner_is_white:
+        return white_learning(agent_name, size, episodes, batch_size, save_episodes, **kwargs)
+    return black_learning(agent_name, size, episodes, batch_size, save_episodes, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="train the agents, with checkpoints from which the run can be resumed")
+    parser.add_argument("scheme", choices=["simultaneous", "alternating"])
+    parser.add_argument("--run-dir", required=True, help="directory of the checkpoints and of the saved agents")
+    parser.add_argument("--resume", action="store_true", help="continue the run of run-dir from its latest checkpoint")
+    parser.add_argument("--size", type=int, default=7)
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=128)
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="episodes between two checkpoints")
+    parser.add_argument("--save-episodes", type=int, nargs="*", default=[], help="episodes after which the agents are saved")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--learn", choices=["black", "white"], default="black", help="learning player (alternating scheme)")
+    parser.add_argument("--opponent", help="saved agent of the fixed player (alternating scheme)")
+    parser.add_argument("--learning-rate", type=float, default=0.02)
+    parser.add_argument("--gamma", type=float, default=0.95)
+    parser.add_argument("--tau", type=float, default=0.005)
+    parser.add_argument("--epsilon-decay", type=float, default=0.995)
+    parser.add_argument("--memory-size", type=int, default=10000)
+    parser.add_argument("--architecture", choices=["mlp", "conv"], default="mlp")
+    parser.add_argument("--kernel-size", type=int, default=64)
+    parser.add_argument("--prioritized-replay", action="store_true")
+    parser.add_argument("--target-update", choices=["soft", "hard"], default="soft")
+    parser.add_argument("--target-update-period", type=int, default=1,
+                        help="scheduled target updates (see SCHEDULES) between two actual ones")
+    parser.add_argument("--warm-start-black", help="saved model whose weights the black agent starts from (e.g.: trained offline)")
+    parser.add_argument("--warm-start-white", help="saved model whose weights the white agent starts from")
+    parser.add_argument("--metrics", help="JSON lines file of the metrics (default: metrics.jsonl in run-dir)")
+    parser.add_argument("--log-every", type=int, default=10, help="episodes between two records of the metrics")
+    parser.add_argument("--record", help="record file of the games (see Quentin_Records.py)")
+    parser.add_argument("--profile", choices=["none", "tags", "cprofile"], default="none",
+                        help="tags: the phases are functions named phase_<name> (e.g.: for py-spy); "
+                             "cprofile: also profile the run, the statistics are saved in profile.prof in run-dir")
+    args = parser.parse_args()
+
+    ## the arguments of a run are kept in run-dir: a resumed run uses them (only the episodes can be changed)
+    config_path = os.path.join(args.run_dir, "config.json")
+    config = vars(args).copy()
+    for key in ("resume", "metrics", "log_every", "profile", "record"):
+        del config[key]
+    if args.resume and os.path.exists(config_path):
+        with open(config_path) as f:
+            config = dict(json.load(f), episodes=args.episodes)
+    elif args.scheme == "alternating" and args.opponent is None:
+        parser.error("the alternating scheme needs an --opponent")
+    os.makedirs(args.run_dir, exist_ok=True)
+    with open(config_path, "w") as f:
+        json.dump(config, f, indent=1)
+
+    ## preemption (SIGTERM): the run stops at the end of the current episode, after a checkpoint
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    kwargs = {key: config.get(key, parser.get_default(key))
+              for key in ("learning_rate", "gamma", "tau", "epsilon_decay", "memory_size", "architecture",
+                          "kernel_size", "prioritized_replay", "seed", "target_update", "target_update_period")}
+    kwargs["warm_start"] = {player: config.get(key) for player, key in ((True, "warm_start_black"), (False, "warm_start_white"))
+                            if config.get(key)}
+    if config["scheme"] == "alternating":
+        kwargs.update(opponent=config["opponent"], learn_black=config["learn"] == "black")
+    kwargs.update(metrics_path=args.metrics or os.path.join(args.run_dir, "metrics.jsonl"), log_every=args.log_every,
+                  profile_tags=args.profile != "none", record_path=args.record)
+    if args.profile == "cprofile":
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+    agents, losses, run = train(config["scheme"], config["size"], config["episodes"], config["batch_size"],
+                                config["save_episodes"], run_dir=config["run_dir"],
+                                checkpoint_every=config["checkpoint_every"], resume=args.resume,
+                                stop=lambda: bool(stopping), **kwargs)
+    if args.profile == "cprofile":
+        profiler.disable()
+        profiler.dump_stats(os.path.join(args.run_dir, "profile.prof"))
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats("phase_")
+    print(f"episodes: {run['episode']}, steps: {run['steps']}, black wins: {run['results'][0]}, "
+          f"white wins: {run['results'][1]}, draws: {run['results'][2]}")
+    for player, values in losses.items():
+        if values:
+            print(f"{'black' if player else 'white'}: {len(values)} replays, "
+                  f"mean loss of the last 100: {np.mean(values[-100:]):.4f}")
+
+if __name__ == "__main__":
+    main()